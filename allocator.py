@@ -0,0 +1,168 @@
+import threading
+
+
+# Bitmap de blocos: um byte por bloco, 0 livre e 1 usado. As faixas livres
+# são achadas com find, que varre em C, então mesmo com o disco quase cheio
+# achar espaço é rápido. O bitmap pode morar dentro de outro buffer (o próprio
+# disco, bytearray ou mmap) a partir de offset, aí não precisa copiar nada pra
+# montar a imagem. Também serve de bitmap de inodes. mark(pos, n), se vier,
+# é avisado de cada pedaço do buffer antes dele mudar. Tudo que mexe no
+# bitmap passa por uma trava, então dá pra alocar de várias threads.
+#
+# O byte é na verdade um contador de donos: o cp compartilha blocos entre
+# arquivos (share soma um) e free_extent só solta o bloco quando o contador
+# chega a zero. shared conta os blocos com mais de um dono; enquanto é zero
+# o fim de uma faixa livre é só o próximo 1. on_free(start, n), se vier, é
+# avisado quando free_extent solta algum bloco da faixa (o dedup usa).
+class BlockAllocator:
+    POLICIES = ("next", "best")
+    MAX_REFS = 255
+    INC = bytes(range(1, 256)) + b"\xff"
+    DEC = b"\0" + bytes(range(255))
+
+    def __init__(self, num_blocks, policy="next", buffer=None, offset=0, free=None, mark=None,
+                 shared=0):
+        if policy not in self.POLICIES:
+            raise ValueError(f"unknown allocation policy: '{policy}'")
+        self.num_blocks = num_blocks
+        self.policy = policy
+        self.bitmap = bytearray(num_blocks) if buffer is None else buffer
+        self.base = offset
+        self.end = offset + num_blocks
+        self.free = num_blocks if free is None else free
+        self.cursor = 0
+        self.mark = mark
+        self.shared = shared
+        self.on_free = None
+        # Contadores (instrument.py), None quando desligados
+        self.probe = None
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return self.free
+
+    def _run_at(self, pos, limit=None):
+        # Primeira faixa livre a partir de pos, como (início, fim); com limit
+        # a faixa para em limit blocos
+        start = self.bitmap.find(b"\0", self.base + pos, self.end)
+        if start < 0:
+            return None
+        stop = self.end if limit is None else min(self.end, start + limit)
+        end = self.bitmap.find(b"\1", start, stop)
+        if end < 0:
+            end = stop
+        if self.shared:
+            # Bloco com contador > 1 também termina a faixa
+            run = self.bitmap[start:end]
+            end = start + len(run) - len(run.lstrip(b"\0"))
+        return start - self.base, end - self.base
+
+    # Next-fit: continua de onde a última alocação parou, então escrita
+    # sequencial sai em faixas contíguas
+    def _next_fit(self, count):
+        start, end = self._run_at(self.cursor, count) or self._run_at(0, count)
+        return start, min(count, end - start)
+
+    # Best-fit: a menor faixa que cabe tudo; se nenhuma cabe, a maior
+    def _best_fit(self, count):
+        best = largest = None
+        pos = 0
+        while (run := self._run_at(pos)) is not None:
+            start, end = run
+            length = end - start
+            if length == count:
+                return start, count
+            if length > count and (best is None or length < best[1]):
+                best = (start, length)
+            if largest is None or length > largest[1]:
+                largest = (start, length)
+            pos = end
+        start, length = best or largest
+        return start, min(count, length)
+
+    def alloc_extent(self, count):
+        probe = self.probe
+        if probe is not None:
+            began = probe.start()
+        with self.lock:
+            if not self.free:
+                raise RuntimeError("No free blocks available")
+            if self.policy == "best":
+                start, length = self._best_fit(count)
+            else:
+                start, length = self._next_fit(count)
+            self.reserve(start, length)
+            self.cursor = start + length
+        if probe is not None:
+            probe.stop("alloc", began, length)
+        return start, length
+
+    def alloc_blocks(self, count):
+        with self.lock:
+            if count > self.free:
+                raise RuntimeError("No free blocks available")
+            runs = []
+            while count:
+                start, length = self.alloc_extent(count)
+                runs.append((start, length))
+                count -= length
+            return runs
+
+    def alloc_block(self):
+        return self.alloc_extent(1)[0]
+
+    def reserve(self, start, length=1):
+        pos = self.base + start
+        with self.lock:
+            if self.mark is not None:
+                self.mark(pos, length)
+            self.bitmap[pos:pos + length] = b"\1" * length
+            self.free -= length
+
+    # Tira um dono de cada bloco da faixa; só os que ficam sem dono voltam a
+    # ser livres
+    def free_extent(self, start, length=1):
+        pos = self.base + start
+        probe = self.probe
+        if probe is not None:
+            began = probe.start()
+        with self.lock:
+            if self.mark is not None:
+                self.mark(pos, length)
+            refs = self.bitmap[pos:pos + length]
+            freed = refs.count(1)
+            if freed == length:
+                self.bitmap[pos:pos + length] = bytes(length)
+            else:
+                self.shared -= refs.count(2)
+                self.bitmap[pos:pos + length] = refs.translate(self.DEC)
+            self.free += freed
+            if freed and self.on_free is not None:
+                self.on_free(start, length)
+        if probe is not None:
+            probe.stop("free", began, length)
+
+    # Mais um dono pra cada bloco (já alocado) da faixa
+    def share(self, start, length=1):
+        pos = self.base + start
+        with self.lock:
+            refs = self.bitmap[pos:pos + length]
+            if max(refs, default=0) >= self.MAX_REFS:
+                raise RuntimeError("Too many references to a block")
+            if self.mark is not None:
+                self.mark(pos, length)
+            self.shared += refs.count(1)
+            self.bitmap[pos:pos + length] = refs.translate(self.INC)
+
+    def refcount(self, idx):
+        return self.bitmap[self.base + idx]
+
+    # Se algum bloco da faixa tem mais de um dono
+    def is_shared(self, start, length=1):
+        if not self.shared:
+            return False
+        pos = self.base + start
+        return max(self.bitmap[pos:pos + length], default=0) > 1
+
+    def is_free(self, idx):
+        return not self.bitmap[self.base + idx]
@@ -1,134 +1,600 @@
-import sys
-import time
+import argparse
 import csv
+import io
+import json
+import multiprocessing
 import os
 import random
+import resource
 import statistics as stats
-import matplotlib.pyplot as plt
+import sys
+import time
+from array import array
+from contextlib import redirect_stdout
 
+import instrument
+import regression
 from chainfilesystem import ChainFileSystem
 from inodefilesystem import INodeFileSystem
+from image import mkfs, mount
+
+
+class ChainFileSystemFAT(ChainFileSystem):
+    """ChainFileSystem without the block index: every seek walks next_block."""
+    INDEX_CAPACITY = 0
+
+
+FILESYSTEMS = {
+    "chain": ChainFileSystem,
+    "fat": ChainFileSystemFAT,
+    "inode": INodeFileSystem,
+}
+
+CHUNK = 64 * 1024
+SEQ_FILE = 16 * 1024 * 1024
+RAND_FILE = 4 * 1024 * 1024
+
+
+class Recorder:
+    """Runs the timed operations of a workload, one latency per call.
+
+    ``check`` counts the reads that came back wrong while the workload runs.
+    """
+
+    def __init__(self):
+        self.latencies = array("d")
+        self.errors = 0
+
+    def __call__(self, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.latencies.append(time.perf_counter() - start)
+        return result
+
+    def __len__(self):
+        return len(self.latencies)
+
+    def check(self, ok):
+        if not ok:
+            self.errors += 1
+
+
+# Os comandos do filesystem só imprimem quando dá erro (não tem ls nos
+# workloads), então cada linha que chega aqui é uma falha
+class ErrorSink(io.TextIOBase):
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += text.count("\n")
+        return len(text)
+
+
+# Cada workload faz n operações cronometradas com op(...), com no máximo live
+# objetos vivos ao mesmo tempo (então n pode ir a milhões com o disco do
+# mesmo tamanho), e devolve {caminho: conteúdo} do que tem que estar no
+# disco no fim.
+
+def metadata_storm(fs, rnd, n, live, op):
+    """Small files created, renamed and removed across 16 directories."""
+    dirs = [f"m{i}" for i in range(16)]
+    for d in dirs:
+        op(fs.make_directory, [d])
+    files = {}
+    names = []
+    for i in range(n - len(dirs)):
+        r = rnd.random()
+        if not names or (r < 0.5 and len(names) < live):
+            path = f"{rnd.choice(dirs)}/f{i}"
+            content = f"file {i}"
+            op(fs.make_file, [path, content])
+            files[path] = content.encode()
+            names.append(path)
+        elif r < 0.75:
+            j = rnd.randrange(len(names))
+            new = f"{rnd.choice(dirs)}/r{i}"
+            op(fs.move, [names[j], new])
+            files[new] = files.pop(names[j])
+            names[j] = new
+        else:
+            j = rnd.randrange(len(names))
+            path = names[j]
+            names[j] = names[-1]
+            names.pop()
+            op(fs.remove_file, [path])
+            del files[path]
+    return files
+
+
+def deep_trees(fs, rnd, n, live, op, depth=32):
+    """Chains of *depth* nested directories built, walked and torn down."""
+    files = {}
+    trees = []
+    tree = 0
+    while len(op) < n:
+        levels = []
+        path = f"t{tree}"
+        for level in range(depth):
+            op(fs.make_directory, [path])
+            levels.append(path)
+            path += f"/d{level}"
+        leaf = levels[-1] + "/leaf"
+        content = f"tree {tree}"
+        op(fs.make_file, [leaf, content])
+        files[leaf] = content.encode()
+        for _ in range(depth):
+            op.check(op(fs.get_dir, rnd.choice(levels)) is not None)
+        trees.append((levels, leaf))
+        tree += 1
+        if len(trees) * depth > live:
+            levels, leaf = trees.pop(0)
+            op(fs.remove_file, [leaf])
+            del files[leaf]
+            for path in reversed(levels):
+                op(fs.remove_directory, [path])
+    return files
+
+
+def wide_directory(fs, rnd, n, live, op):
+    """One directory with many entries: create, look up, remove half."""
+    width = max(1, min(live, n // 3))
+    op(fs.make_directory, ["w"])
+    names = [f"w/e{i:07d}" for i in range(width)]
+    for path in names:
+        op(fs.make_file, [path, path])
+    for _ in range(n - len(op) - width // 2):
+        f = op(fs.open, rnd.choice(names))
+        f.close()
+    removed = set(rnd.sample(names, width // 2))
+    for path in removed:
+        op(fs.remove_file, [path])
+    return {path: path.encode() for path in names if path not in removed}
+
+
+def sequential_io(fs, rnd, n, live, op):
+    """A 16 MiB file written and read back in 64 KiB chunks, over and over."""
+    chunks = [rnd.randbytes(CHUNK) for _ in range(8)]
+    per_file = SEQ_FILE // CHUNK
+    f = fs.open("seq.bin", create=True)
+    written = 0
+    while len(op) < n:
+        f.truncate(0)
+        f.seek(0)
+        written = 0
+        for k in range(min(per_file, n - len(op))):
+            op(f.write, chunks[k % 8])
+            written += 1
+        f.seek(0)
+        for k in range(min(written, n - len(op))):
+            op.check(op(f.read, CHUNK) == chunks[k % 8])
+    f.close()
+    return {"seq.bin": b"".join(chunks[k % 8] for k in range(written))}
+
+
+def random_io(fs, rnd, n, live, op):
+    """Reads and writes of 16 B to 4 KiB at random offsets of a 4 MiB file."""
+    model = bytearray(rnd.randbytes(RAND_FILE))
+    f = fs.open("rand.bin", create=True)
+    f.write(bytes(model))
+    for _ in range(n):
+        size = rnd.randrange(16, 4097)
+        offset = rnd.randrange(RAND_FILE - size)
+        if rnd.random() < 0.5:
+            op.check(op(f.pread, offset, size) == model[offset:offset + size])
+        else:
+            data = rnd.randbytes(size)
+            op(f.pwrite, offset, data)
+            model[offset:offset + size] = data
+    f.close()
+    return {"rand.bin": bytes(model)}
 
-def timeit(fn):
-    """Return wall‑clock runtime of *fn()* in seconds."""
-    start = time.perf_counter()
-    fn()
-    return time.perf_counter() - start
 
+def mixed_rw(fs, rnd, n, live, op):
+    """Whole-file reads, in-place writes, appends, creates and removes."""
+    files = {}
+    names = []
 
-def make_random_names(prefix: str, n: int):
-    """Generate *n* unique random identifiers with a given prefix."""
-    return [f"{prefix}{random.getrandbits(48):012x}" for _ in range(n)]
+    def create(i):
+        path = f"x{i}"
+        content = rnd.randbytes(rnd.randrange(1, 2048)).hex()
+        op(fs.make_file, [path, content])
+        files[path] = bytearray(content.encode())
+        names.append(path)
 
+    for i in range(max(1, min(live, n) // 2)):
+        create(i)
+    for i in range(live, live + n - len(op)):
+        r = rnd.random()
+        if r < 0.4:
+            path = rnd.choice(names)
+            f = fs.open(path)
+            op.check(op(f.read) == files[path])
+            f.close()
+        elif r < 0.6:
+            path = rnd.choice(names)
+            data = rnd.randbytes(rnd.randrange(1, 1024))
+            model = files[path]
+            offset = rnd.randrange(len(model) + 1)
+            f = fs.open(path)
+            op(f.pwrite, offset, data)
+            f.close()
+            model[offset:offset + len(data)] = data
+        elif r < 0.7:
+            path = rnd.choice(names)
+            if len(files[path]) > 16 * 1024:
+                continue
+            data = rnd.randbytes(rnd.randrange(1, 1024))
+            f = fs.open(path)
+            op(f.append, data)
+            f.close()
+            files[path] += data
+        elif (r < 0.85 and len(names) < live) or len(names) < 2:
+            create(i)
+        else:
+            j = rnd.randrange(len(names))
+            path = names[j]
+            names[j] = names[-1]
+            names.pop()
+            op(fs.remove_file, [path])
+            del files[path]
+    return {path: bytes(data) for path, data in files.items()}
 
-def one_pass(fs_class, dir_names, file_names, block_size=512):
-    """Run one full operation set on a freshly‑created filesystem."""
-    num_blocks = 4096
-    fs = fs_class(num_blocks=num_blocks, block_size=block_size)
 
-    dir_create = timeit(lambda: [fs.make_directory([name]) for name in dir_names])
-    dir_delete = timeit(lambda: [fs.remove_directory([name]) for name in dir_names])
+def duplicate_content(fs, rnd, n, live, op):
+    """Files of 4 blocks, half of them from 16 shared contents, created and removed.
 
-    file_create = timeit(lambda: [fs.make_file([name, "hello world"]) for name in file_names])
-    file_delete = timeit(lambda: [fs.remove_file([name]) for name in file_names])
+    This is the case ``--dedup`` is for: ``dedup_ratio`` and
+    ``hash_per_saved`` come from here.
+    """
+    def block():
+        return "".join(rnd.choices("abcdef", k=fs.BLOCK_SIZE))
 
-    large_blob = "x" * (block_size * 4)
-    large_write = timeit(lambda: fs.make_file(["large.txt", large_blob]))
-    large_read  = timeit(lambda: fs._cat(["large.txt"]))
+    pool = [block() for _ in range(16)]
+    files = {}
+    names = []
+    for i in range(n):
+        if not names or (rnd.random() < 0.75 and len(names) < live):
+            path = f"d{i}"
+            content = "".join(rnd.choice(pool) if rnd.random() < 0.5 else block()
+                              for _ in range(4))
+            op(fs.make_file, [path, content])
+            files[path] = content.encode()
+            names.append(path)
+        else:
+            j = rnd.randrange(len(names))
+            path = names[j]
+            names[j] = names[-1]
+            names.pop()
+            op(fs.remove_file, [path])
+            del files[path]
+    return files
 
-    return {
-        "dir_create_time":   dir_create,
-        "dir_delete_time":   dir_delete,
-        "file_create_time":  file_create,
-        "file_delete_time":  file_delete,
-        "large_write_time":  large_write,
-        "large_read_time":   large_read,
+
+# Perfil -> (workload, blocos do disco em função de live e do tamanho do bloco)
+PROFILES = {
+    "metadata": (metadata_storm, lambda live, bs: 16 * live + 4096),
+    "deep": (deep_trees, lambda live, bs: 16 * live + 4096),
+    "wide": (wide_directory, lambda live, bs: 16 * live + 4096),
+    "seqio": (sequential_io, lambda live, bs: 2 * SEQ_FILE // bs + 4096),
+    "randio": (random_io, lambda live, bs: 2 * RAND_FILE // bs + 4096),
+    "mixed": (mixed_rw, lambda live, bs: 40 * live + 4096),
+    "dup": (duplicate_content, lambda live, bs: 16 * live + 4096),
+}
+
+
+def verify(fs, expected):
+    """Number of files in *expected* whose content on *fs* is wrong or missing."""
+    wrong = 0
+    for path, content in expected.items():
+        try:
+            f = fs.open(path)
+        except (FileNotFoundError, IsADirectoryError):
+            wrong += 1
+            continue
+        wrong += f.read() != content
+        f.close()
+    return wrong
+
+
+def percentile(ordered, q):
+    """The *q* quantile (0..1) of the sorted sequence *ordered*."""
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process so far, in KiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def one_iteration(fs_key, profile, n, seed, live, block_size=512, image=None, dedup=False,
+                  instrumented=False):
+    """Run *profile* once on a fresh filesystem and return its metrics.
+
+    The workload gets ``random.Random`` seeded from *seed*, so the same
+    arguments always run the same operations. With *instrumented*, the
+    result also has the totals of the filesystem counters (instrument.py).
+    """
+    fs_class = FILESYSTEMS[fs_key]
+    workload, blocks = PROFILES[profile]
+    num_blocks = blocks(live, block_size)
+    if image:
+        fs = mkfs(image, fs_class, num_blocks, block_size, dedup=dedup)
+    else:
+        fs = fs_class(num_blocks, block_size, dedup=dedup)
+    rnd = random.Random(f"{seed}:{profile}")
+    probe = instrument.enable(fs) if instrumented else None
+    op = Recorder()
+    sink = ErrorSink()
+    with redirect_stdout(sink):
+        start = time.perf_counter()
+        expected = workload(fs, rnd, n, live, op)
+        elapsed = time.perf_counter() - start
+        errors = op.errors + sink.lines + verify(fs, expected)
+
+    ordered = sorted(op.latencies)
+    res = {
+        "ops": len(ordered),
+        "ops_per_s": len(ordered) / elapsed,
+        "p50_us": percentile(ordered, 0.50) * 1e6,
+        "p90_us": percentile(ordered, 0.90) * 1e6,
+        "p99_us": percentile(ordered, 0.99) * 1e6,
+        "max_us": ordered[-1] * 1e6,
+        "errors": errors,
     }
+    if probe is not None:
+        res["counters"] = probe.dump()["totals"]
+    if dedup:
+        dedup_stats = fs.dedup.stats()
+        res["dedup_ratio"] = dedup_stats["ratio"]
+        res["hash_per_saved"] = dedup_stats["hash_per_saved"]
+    if image:
+        start = time.perf_counter()
+        fs.sync()
+        res["sync_ms"] = (time.perf_counter() - start) * 1e3
+        fs.close()
+        start = time.perf_counter()
+        fs = mount(image)
+        res["mount_ms"] = (time.perf_counter() - start) * 1e3
+    fs.close()
+    return res
+
 
+def run_case(fs_key, profile, n, seed, live, warmup, iterations, block_size=512, image=None,
+             dedup=False, instrumented=False):
+    """Warm up, then run *iterations* recorded iterations of one case.
 
-def run_benchmarks(op_counts, passes: int = 5):
-    fs_classes = [ChainFileSystem, INodeFileSystem]
-    metrics = [
-        "dir_create_time", "dir_delete_time",
-        "file_create_time", "file_delete_time",
-        "large_write_time", "large_read_time",
+    Returns the per-iteration samples of each metric, the total of
+    correctness errors and the peak RSS of the process, plus the counters
+    of each iteration when *instrumented*.
+    """
+    for i in range(warmup):
+        one_iteration(
+            fs_key, profile, n, f"{seed}:w{i}", live, block_size, image, dedup, instrumented
+        )
+    runs = [
+        one_iteration(
+            fs_key, profile, n, f"{seed}:{i}", live, block_size, image, dedup, instrumented
+        )
+        for i in range(iterations)
     ]
+    samples = {
+        m: [run[m] for run in runs] for m in runs[0] if m not in ("ops", "errors", "counters")
+    }
+    result = {
+        "fs_type": FILESYSTEMS[fs_key].__name__,
+        "profile": profile,
+        "num_ops": n,
+        "samples": samples,
+        "errors": sum(run["errors"] for run in runs),
+        "peak_rss_kb": peak_rss_kb(),
+    }
+    if instrumented:
+        result["counters"] = [run["counters"] for run in runs]
+    return result
+
+
+# Cada caso roda num processo novo (spawn), pra o pico de RSS ser só dele e
+# um caso não herdar lixo do outro
+def run_isolated(*args):
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(run_case, args)
+
 
-    # Prepare output directory & CSV
-    outdir = "benchmark_stats"
+def summarize(result):
+    """Mean and sample standard deviation of each metric of *result*."""
+    out = {}
+    for m, values in result["samples"].items():
+        values = [v for v in values if v is not None]
+        if values:
+            sigma = stats.stdev(values) if len(values) > 1 else 0.0
+            out[m] = (stats.mean(values), sigma)
+    return out
+
+
+def write_results(results, config, outdir):
+    """Write the CSV (means) and the JSON (every sample and counter) into *outdir*."""
     os.makedirs(outdir, exist_ok=True)
     csv_path = os.path.join(outdir, "benchmark_stats.csv")
-
     with open(csv_path, "w", newline="") as f:
         writer = csv.writer(f)
-        writer.writerow(["fs_type", "num_ops", "metric", "mean", "std"])
-
-        # Organise data for plotting
-        means = {cls.__name__: {m: [] for m in metrics} for cls in fs_classes}
-        stds  = {cls.__name__: {m: [] for m in metrics} for cls in fs_classes}
-
-        # Iterate over workload sizes
-        for n in op_counts:
-            print(f"\n▶️  {n} ops × {passes} passes")
-
-            # Pre‑generate random name lists for fairness (same lists for both FSes each pass)
-            dir_name_sets  = [make_random_names("dir_", n)  for _ in range(passes)]
-            file_name_sets = [make_random_names("file_", n) for _ in range(passes)]
-
-            for cls in fs_classes:
-                # Collect timings from each pass
-                samples = {m: [] for m in metrics}
-
-                for p in range(passes):
-                    res = one_pass(cls, dir_name_sets[p], file_name_sets[p])
-                    for m in metrics:
-                        samples[m].append(res[m])
-
-                # Compute mean & std and write CSV rows
-                for m in metrics:
-                    mu = stats.mean(samples[m])
-                    sigma = stats.stdev(samples[m]) if passes > 1 else 0.0
-                    writer.writerow([cls.__name__, n, m, f"{mu:.6f}", f"{sigma:.6f}"])
-
-                    means[cls.__name__][m].append(mu)
-                    stds[cls.__name__][m].append(sigma)
-
-                print(f"  {cls.__name__}: OK")
-
-    print(f"\nCSV salvo em {csv_path}")
-
-    for metric in metrics:
-        plt.figure()
-        for cls in fs_classes:
-            mu  = means[cls.__name__][metric]
-            sig = stds[cls.__name__][metric]
-            plt.errorbar(op_counts, mu, yerr=sig, marker="o", capsize=4, label=cls.__name__)
-        plt.title(f"{metric} – média ± desvio‑padrão (n={passes})")
-        plt.xlabel("Nº de operações")
-        plt.ylabel("Tempo (segundos)")
-        plt.legend()
-        plt.tight_layout()
-        img_path = os.path.join(outdir, f"metric_{metric}.png")
-        plt.savefig(img_path)
-        print(f"  📊  Plot salvo: {img_path}")
-        plt.close()
-
-    print("\n✅  Benchmark completo!")
-
-
-def main():
-    # Parse CLI: allow custom op counts
-    if len(sys.argv) > 1:
+        writer.writerow(["fs_type", "profile", "num_ops", "metric", "mean", "std"])
+        for res in results:
+            for m, (mu, sigma) in summarize(res).items():
+                writer.writerow([
+                    res["fs_type"], res["profile"], res["num_ops"], m, f"{mu:.6f}", f"{sigma:.6f}"
+                ])
+            for m in ("peak_rss_kb", "errors"):
+                writer.writerow([
+                    res["fs_type"], res["profile"], res["num_ops"], m, res[m], f"{0:.6f}"
+                ])
+    json_path = os.path.join(outdir, "benchmark_stats.json")
+    with open(json_path, "w") as f:
+        json.dump({"config": config, "results": results}, f, indent=1)
+    return csv_path, json_path
+
+
+def plot(results, outdir):
+    """One PNG per profile and metric: mean ± std against the op count."""
+    try:
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("matplotlib não está instalado, sem gráficos")
+        return
+    profiles = sorted({res["profile"] for res in results})
+    for profile in profiles:
+        for metric in ("ops_per_s", "p99_us"):
+            plt.figure()
+            for fs_type in sorted({res["fs_type"] for res in results}):
+                rows = sorted(
+                    (res for res in results
+                     if res["profile"] == profile and res["fs_type"] == fs_type),
+                    key=lambda res: res["num_ops"],
+                )
+                points = [(res["num_ops"], summarize(res)[metric]) for res in rows]
+                plt.errorbar(
+                    [n for n, _ in points], [mu for _, (mu, _) in points],
+                    yerr=[sigma for _, (_, sigma) in points],
+                    marker="o", capsize=4, label=fs_type,
+                )
+            plt.title(f"{profile}: {metric} – média ± desvio‑padrão")
+            plt.xlabel("Nº de operações")
+            plt.ylabel(metric)
+            plt.xscale("log")
+            plt.legend()
+            plt.tight_layout()
+            img_path = os.path.join(outdir, f"{profile}_{metric}.png")
+            plt.savefig(img_path)
+            print(f"  📊  Plot salvo: {img_path}")
+            plt.close()
+
+
+def run_suite(config, image=None, isolate=True):
+    """Run every case of *config* (the ``config`` of benchmark_stats.json)."""
+    run = run_isolated if isolate else run_case
+    results = []
+    for n in config["sizes"]:
+        print(f"\n▶️  {n} ops × {config['iterations']} iterações"
+              f" (+{config['warmup']} de aquecimento)")
+        for profile in config["profiles"]:
+            for fs_key in config["fs"]:
+                res = run(
+                    fs_key, profile, n, config["seed"], config["live"], config["warmup"],
+                    config["iterations"], config["block_size"], image, config["dedup"],
+                    config["instrument"],
+                )
+                results.append(res)
+                summary = summarize(res)
+                line = (
+                    f"  {profile:<9} {res['fs_type']:<19}"
+                    f" {summary['ops_per_s'][0]:>12,.0f} ops/s"
+                    f"  p50 {summary['p50_us'][0]:8.1f} µs"
+                    f"  p99 {summary['p99_us'][0]:8.1f} µs"
+                    f"  pico {res['peak_rss_kb'] / 1024:7.1f} MiB"
+                )
+                if "dedup_ratio" in summary:
+                    line += f"  dedup {summary['dedup_ratio'][0]:.2f}x"
+                if res["errors"]:
+                    line += f"  ❌ {res['errors']} erros"
+                print(line)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark suite for the filesystems")
+    parser.add_argument("sizes", nargs="*", type=int, default=[10000],
+                        help="operations per run (several sizes are allowed)")
+    parser.add_argument("--profile", action="append", choices=sorted(PROFILES),
+                        help="workload profile (repeatable; default: all)")
+    parser.add_argument("--fs", action="append", choices=sorted(FILESYSTEMS),
+                        help="filesystem (repeatable; default: all)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--warmup", type=int, default=1, help="unrecorded runs per case")
+    parser.add_argument("--iterations", type=int, default=5, help="recorded runs per case")
+    parser.add_argument("--live", type=int, default=4096,
+                        help="most files or directories alive at once")
+    parser.add_argument("--block-size", type=int, default=512)
+    parser.add_argument("--image", metavar="FILE", help="run on an image file instead of memory")
+    parser.add_argument("--dedup", action="store_true", help="mount with block dedup")
+    parser.add_argument("--instrument", action="store_true",
+                        help="record the filesystem counters (adds overhead to the timings)")
+    parser.add_argument("--out", help="output directory (default: benchmark_stats, or"
+                        " benchmark_stats/candidate with --compare)")
+    parser.add_argument("--plot", action="store_true", help="save plots (needs matplotlib)")
+    parser.add_argument("--no-isolate", action="store_true",
+                        help="run every case in this process (peak RSS becomes cumulative)")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="rerun the cases of this benchmark_stats.json and compare;"
+                        " exits with 1 on a significant slowdown")
+    parser.add_argument("--test", choices=("mwu", "bootstrap"), default="mwu",
+                        help="significance test of --compare (Mann-Whitney or bootstrap CI)")
+    parser.add_argument("--alpha", type=float, default=0.05, help="significance level")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="smallest relative change that counts (0.10 = 10%%)")
+    parser.add_argument("--verbose", action="store_true", help="report unchanged metrics too")
+    args = parser.parse_args(argv)
+    if args.iterations < 1:
+        parser.error("--iterations must be at least 1")
+
+    baseline = None
+    if args.compare:
+        # Mesmos casos, sementes e tamanhos da linha de base
         try:
-            op_counts = [int(x) for x in sys.argv[1:]]
-        except ValueError:
-            print("Uso: python benchmark.py [num_ops1 num_ops2 ...]")
-            return
+            baseline = regression.load(args.compare)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        config = baseline["config"]
+        if config["image"] and not args.image:
+            parser.error("the baseline ran on an image: pass --image")
+        image = args.image if config["image"] else None
+        outdir = args.out or os.path.join("benchmark_stats", "candidate")
     else:
-        op_counts = [10, 20, 40, 80, 160, 320]
+        config = {
+            "sizes": args.sizes, "profiles": args.profile or list(PROFILES),
+            "fs": args.fs or list(FILESYSTEMS), "seed": args.seed,
+            "warmup": args.warmup, "iterations": args.iterations, "live": args.live,
+            "block_size": args.block_size, "image": args.image is not None,
+            "dedup": args.dedup, "instrument": args.instrument,
+        }
+        image = args.image
+        outdir = args.out or "benchmark_stats"
+    if baseline is not None and args.test == "mwu":
+        # Com poucas iterações o Mann-Whitney nunca chega abaixo de alpha,
+        # e a comparação passaria sempre, qualquer que fosse a mudança
+        n = config["iterations"]
+        if regression.min_p_value(n, n) >= args.alpha:
+            parser.error(
+                f"with {n} iterations per case the smallest possible p-value is"
+                f" {regression.min_p_value(n, n):.3g}, not below --alpha {args.alpha}:"
+                " rerun the baseline with more --iterations or use --test bootstrap"
+            )
 
-    run_benchmarks(op_counts, passes=5)
+    results = run_suite(config, image, not args.no_isolate)
+    csv_path, json_path = write_results(results, config, outdir)
+    print(f"\nCSV salvo em {csv_path}, amostras em {json_path}")
+    if args.plot:
+        plot(results, outdir)
+    failed = sum(res["errors"] for res in results)
+    if baseline is not None:
+        rows = regression.compare(
+            baseline["results"], results, args.alpha, args.threshold, args.test,
+            seed=config["seed"],
+        )
+        print()
+        print("\n".join(regression.report(rows, args.verbose)))
+        csv_path, txt_path = regression.write(rows, outdir)
+        print(f"Relatório salvo em {txt_path} e {csv_path}")
+        failed += sum(row["failed"] for row in rows)
+        print("\n❌  Regressão em relação à linha de base!" if failed
+              else "\n✅  Sem regressão em relação à linha de base")
+        return 1 if failed else 0
+    if regression.min_p_value(config["iterations"], config["iterations"]) >= args.alpha:
+        print(f"\n⚠️  Com {config['iterations']} iterações esta rodada não serve de linha de"
+              f" base pro --compare com Mann-Whitney a alpha {args.alpha}")
+    print("\n❌  Benchmark com erros de conteúdo!" if failed else "\n✅  Benchmark completo!")
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
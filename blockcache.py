@@ -0,0 +1,132 @@
+import threading
+from collections import OrderedDict
+
+
+# Cache de blocos na frente do BlockDevice, com a mesma interface: cache[i]
+# lê o bloco i, cache[a:b] os blocos a..b-1 colados e write grava. Os blocos
+# ficam em bytearrays próprios numa LRU de capacity blocos; escrita só marca
+# o bloco como sujo e ele vai pro disco quando sai da LRU ou no flush.
+# Sobrescrever um bloco inteiro nem lê o disco. Os metadados (bitmaps, FAT,
+# tabela de inodes) continuam direto no buffer do disco.
+class BlockCache:
+    def __init__(self, device, capacity=256):
+        if capacity < 1:
+            raise ValueError("cache capacity must be at least one block")
+        self.device = device
+        self.capacity = capacity
+        self.num_blocks = device.num_blocks
+        self.block_size = device.block_size
+        self.buffer = device.buffer
+        self.view = device.view
+        self.entries = OrderedDict()
+        self.dirty = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+        self.lock = threading.RLock()
+        # Contadores (instrument.py), None quando desligados
+        self.probe = None
+
+    def __len__(self):
+        return self.num_blocks
+
+    def _get(self, idx, load=True):
+        with self.lock:
+            return self._load(idx, load)
+
+    def _load(self, idx, load):
+        buf = self.entries.get(idx)
+        if buf is not None:
+            self.entries.move_to_end(idx)
+            self.hits += 1
+            return buf
+        self.misses += 1
+        if load:
+            buf = bytearray(self.device[idx])
+        else:
+            buf = bytearray(self.block_size)
+        self.entries[idx] = buf
+        if len(self.entries) > self.capacity:
+            self._evict()
+        return buf
+
+    def _evict(self):
+        idx, buf = self.entries.popitem(last=False)
+        self.evictions += 1
+        if idx in self.dirty:
+            self.dirty.discard(idx)
+            self.device.write(idx, buf)
+            self.writebacks += 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, _ = idx.indices(self.num_blocks)
+        else:
+            start, stop = idx, idx + 1
+        probe = self.probe
+        if probe is not None:
+            began = probe.start()
+        if stop - start == 1:
+            data = memoryview(self._get(start)).toreadonly()
+        else:
+            data = b"".join(self._get(i) for i in range(start, stop))
+        if probe is not None:
+            probe.stop("block_read", began, stop - start)
+        return data
+
+    def write(self, block, data, offset=0):
+        data = memoryview(data)
+        bs = self.block_size
+        block += offset // bs
+        offset %= bs
+        pos = 0
+        probe = self.probe
+        if probe is not None:
+            began = probe.start()
+            count = -(-(offset + len(data)) // bs)
+        with self.lock:
+            while pos < len(data):
+                n = min(bs - offset, len(data) - pos)
+                buf = self._load(block, load=n < bs)
+                buf[offset:offset + n] = data[pos:pos + n]
+                self.dirty.add(block)
+                pos += n
+                block += 1
+                offset = 0
+        if probe is not None:
+            probe.stop("block_write", began, count)
+
+    # Passa os blocos sujos pro disco sem pedir flush dele
+    def writeback(self):
+        with self.lock:
+            for idx in sorted(self.dirty):
+                self.device.write(idx, self.entries[idx])
+                self.writebacks += 1
+            self.dirty.clear()
+
+    # Esquece todos os blocos, sem gravar: o disco mudou por baixo
+    def drop(self):
+        with self.lock:
+            self.entries.clear()
+            self.dirty.clear()
+
+    def flush(self):
+        self.writeback()
+        self.device.flush()
+
+    def close(self):
+        self.flush()
+        self.entries.clear()
+        self.device.close()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "dirty": len(self.dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "writebacks": self.writebacks,
+        }
@@ -0,0 +1,151 @@
+import mmap
+import os
+import sys
+import threading
+
+
+# Todos os blocos num buffer só (mmap anônimo, ou mmap de um arquivo de
+# imagem). dev[i] devolve um memoryview do bloco i e dev[a:b] um memoryview
+# dos blocos a..b-1 colados, então ler uma faixa contígua não copia nada.
+# Escrita de dado e diretório passa pelo write, pra uma cache na frente poder
+# ver.
+#
+# Nos dois casos o bloco só existe de verdade depois da primeira escrita: o
+# sistema dá a página da memória (ou do arquivo, que é esparso) quando alguém
+# escreve nela, e até lá ela é lida como zero. Criar o disco é O(1) no tamanho
+# dele, e a memória acompanha o que foi gravado. Com create=True a imagem
+# começa vazia, então um disco novo está sempre todo zerado.
+#
+# Com private=True o mmap é cópia privada: nada que muda no buffer chega no
+# arquivo sozinho. Os blocos mudados ficam em dirty (quem escreve direto no
+# buffer avisa com mark) e só vão pro arquivo no flush. É o que o journal
+# precisa pra gravar o registro antes de mexer no lugar.
+#
+# Com snapshots (snapshot.py) o mark também é o copy-on-write: antes da
+# primeira escrita num bloco depois do último snapshot, a imagem antiga do
+# bloco vai pra ele. Por isso quem escreve direto no buffer chama o mark
+# antes de escrever.
+class BlockDevice:
+    # Sem reservar swap pro tamanho inteiro, senão um disco grande em memória
+    # nem é criado. O mmap só expõe MAP_NORESERVE a partir do 3.13; antes
+    # disso, no Linux, vai o valor do asm-generic direto.
+    MAP_NORESERVE = getattr(
+        mmap, "MAP_NORESERVE", 0x4000 if sys.platform.startswith("linux") else 0
+    )
+    ANONYMOUS = mmap.MAP_PRIVATE | MAP_NORESERVE
+
+    def __init__(self, num_blocks, block_size, path=None, private=False, create=False):
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self.path = path
+        self.mmap = None
+        self.file = None
+        self.private = private and path is not None
+        self.dirty = set()
+        self.snapshots = []
+        # keep(idx) diz se algum snapshot ainda precisa do bloco idx
+        self.keep = None
+        self.snap_lock = threading.Lock()
+        # Contadores (instrument.py), None quando desligados
+        self.probe = None
+        size = num_blocks * block_size
+        if path is None:
+            self.buffer = mmap.mmap(-1, size, flags=self.ANONYMOUS)
+        else:
+            with open(path, "w+b" if create else "a+b") as f:
+                if os.fstat(f.fileno()).st_size < size:
+                    f.truncate(size)
+                access = mmap.ACCESS_COPY if self.private else mmap.ACCESS_DEFAULT
+                self.mmap = mmap.mmap(f.fileno(), size, access=access)
+            self.buffer = self.mmap
+            if self.private:
+                self.file = open(path, "r+b")
+        self.view = memoryview(self.buffer)
+
+    def __len__(self):
+        return self.num_blocks
+
+    def __getitem__(self, idx):
+        bs = self.block_size
+        if isinstance(idx, slice):
+            start, stop, _ = idx.indices(self.num_blocks)
+        else:
+            start, stop = idx, idx + 1
+        if self.probe is not None:
+            self.probe.add("block_read", stop - start)
+        return self.view[start * bs : stop * bs]
+
+    # Grava data a partir do byte offset do bloco block; pode passar pros
+    # blocos seguintes
+    def write(self, block, data, offset=0):
+        pos = block * self.block_size + offset
+        probe = self.probe
+        if probe is not None:
+            start = probe.start()
+        self.mark(pos, len(data))
+        self.view[pos:pos + len(data)] = data
+        if probe is not None:
+            bs = self.block_size
+            probe.stop("block_write", start, (pos + len(data) - 1) // bs - pos // bs + 1)
+
+    # Avisa que [pos, pos + length) do buffer vai mudar: guarda a imagem
+    # antiga pro snapshot e marca os blocos como sujos
+    def mark(self, pos, length):
+        if not length or not (self.private or self.snapshots):
+            return
+        bs = self.block_size
+        first, last = pos // bs, (pos + length - 1) // bs + 1
+        if self.snapshots:
+            self._preserve(first, last)
+        if self.private:
+            self.dirty.update(range(first, last))
+
+    def _preserve(self, first, last):
+        with self.snap_lock:
+            if not self.snapshots:
+                return
+            saved = self.snapshots[-1].saved
+            for idx in range(first, last):
+                if idx not in saved:
+                    # None: nenhum snapshot usa o bloco, não precisa guardar
+                    keep = self.keep is None or self.keep(idx)
+                    saved[idx] = bytes(self[idx]) if keep else None
+
+    # Grava sem passar pelos snapshots (rollback)
+    def restore(self, block, data):
+        pos = block * self.block_size
+        self.view[pos:pos + len(data)] = data
+        if self.private:
+            self.dirty.add(block)
+
+    # Grava direto no arquivo, sem passar pelo buffer (registro do journal)
+    def persist(self, block, data):
+        os.pwrite(self.file.fileno(), data, block * self.block_size)
+
+    def fsync(self):
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+
+    # Com blocks (ordenados), grava só esses blocos sujos
+    def flush(self, blocks=None):
+        if self.private:
+            # Junta os blocos sujos em faixas contíguas, uma escrita por faixa
+            bs = self.block_size
+            if blocks is None:
+                blocks = sorted(self.dirty)
+            start = 0
+            for i in range(1, len(blocks) + 1):
+                if i == len(blocks) or blocks[i] != blocks[i - 1] + 1:
+                    first, last = blocks[start], blocks[i - 1] + 1
+                    self.persist(first, self.view[first * bs : last * bs])
+                    start = i
+            self.dirty.difference_update(blocks)
+            self.fsync()
+        elif self.mmap is not None:
+            self.mmap.flush()
+
+    def close(self):
+        self.view.release()
+        self.buffer.close()
+        if self.file is not None:
+            self.file.close()
@@ -1,110 +1,495 @@
-class ChainDirectory:
-    def __init__(self, fs, name, parent=None, first_block=None, size=0):
-        self.fs = fs
-        self.name = name
-        self.parent = parent
-        self.first_block = first_block
-        self.size = size
-        if self.first_block is None:
-            self.write_entries({})
-
-    def read_entries_raw(self):
-        if self.size == 0:
-            return b""
-        return self.fs.read_chain(self.first_block, self.size)
-
-    def get_entries(self):
-        raw = self.read_entries_raw()
-        text = raw.decode("utf-8")
-        entries = {}
-        for line in text.splitlines():
-            if not line.strip():
-                continue
-            name, ftype, first, size = line.split(":")
-            entries[name] = (ftype, int(first), int(size))
-        return entries
-
-    def write_entries(self, entries):
-        lines = [
-            f"{name}:{ftype}:{first}:{size}"
-            for name, (ftype, first, size) in entries.items()
-        ]
-        data = "\n".join(lines).encode("utf-8")
-        if self.first_block is None:
-            self.first_block, self.size = self.fs.write_chain(data)
-        else:
-            self.first_block, self.size = self.fs.rewrite_chain(
-                self.first_block, data
-            )
-        if self.parent:
-            parent_entries = self.parent.get_entries()
-            parent_entries[self.name] = ("directory", self.first_block, self.size)
-            self.parent.write_entries(parent_entries)
-
-    def update_entries(self, entries):
-        self.write_entries(entries)
+import codecs
+import threading
+from collections import OrderedDict
 
-    def get_path(self):
-        if self.parent is None:
-            return "/"
-        parts = []
-        node = self
-        while node.parent is not None:
-            parts.append(node.name)
-            node = node.parent
-        return "/" + "/".join(reversed(parts))
+import snapshot
+import transfer
+from allocator import BlockAllocator
+from blockcache import BlockCache
+from blockdevice import BlockDevice
+from dcache import DentryCache
+from dedup import DedupIndex
+from directory import ChainDirectory, Directory
+from journal import Journal, journaled
+from locks import LockTable, NoLocks
+from openfile import ChainOpenFile
+from superblock import Superblock
 
 
 class ChainFileSystem:
-    def __init__(self, num_blocks, block_size):
-        self.BLOCK_SIZE = block_size
-        self.blocks = [bytearray(block_size) for _ in range(num_blocks)]
-        self.next_block: list[None | int] = [None] * num_blocks
-        self.free_blocks = set(range(num_blocks))
+    KIND = b"L"
+    END = -1
+    INDEX_CAPACITY = 1024
+    # Blocos por memoryview na leitura em stream
+    STREAM_BLOCKS = 64
+
+    def __init__(self, num_blocks, block_size, alloc_policy="next", image=None, cache_size=None,
+                 threadsafe=False, dedup=False):
+        sb = Superblock(
+            self.KIND, block_size, num_blocks, 0, num_blocks * 4,
+            Journal.size_for(num_blocks) if image else 0,
+        )
+        # Disco novo já vem zerado. A FAT fica zerada também: o próximo de um
+        # bloco só é lido depois de ele ser alocado, e quem aloca já escreve
+        # (_link e alloc_block)
+        device = BlockDevice(num_blocks, block_size, image, create=True)
+        self._attach(device, sb, alloc_policy, cache_size, threadsafe, dedup)
+        self.allocator.reserve(0, sb.data_start)
 
         self.root = ChainDirectory(self, "/", None)
+        self.sb.root = self.root.first_block
         self.current_dir = self.root
+        self.sync()
+
+    # Monta uma imagem que já existe: só cria as visões sobre o buffer, a FAT
+    # e os diretórios são lidos direto do disco quando alguém precisa
+    @classmethod
+    def mount(cls, device, sb, alloc_policy="next", cache_size=None, threadsafe=False,
+              dedup=False):
+        fs = cls.__new__(cls)
+        fs._attach(device, sb, alloc_policy, cache_size, threadsafe, dedup)
+        fs.root = ChainDirectory(fs, "/", None, first_block=sb.root)
+        fs.current_dir = fs.root
+        return fs
+
+    # Com cache_size os blocos de dado e diretório passam por uma BlockCache
+    # desse tamanho (em blocos); sem, vão direto no disco. Com threadsafe os
+    # diretórios e arquivos ganham travas (locks.py) e dá pra usar de várias
+    # threads; sem, as travas não fazem nada. Com dedup, arquivo novo
+    # reaproveita blocos iguais aos dos escritos desde a montagem (dedup.py).
+    def _attach(self, device, sb, alloc_policy, cache_size=None, threadsafe=False, dedup=False):
+        self.BLOCK_SIZE = sb.block_size
+        self.device = device
+        self.blocks = device if cache_size is None else BlockCache(device, cache_size)
+        # FAT: next_block[i] é o bloco depois de i na cadeia, ou END
+        self.fat_offset = table = sb.offset(sb.table_start)
+        self.next_block = device.view[table:table + sb.num_blocks * 4].cast("i")
+        self.index_lock = threading.Lock()
+        # Contadores (instrument.py), None quando desligados
+        self.probe = None
+        self._load(sb, alloc_policy, dedup)
+        self.locks = LockTable() if threadsafe else NoLocks()
+        self.session = threading.local()
+        # Só disco montado de imagem com journal tem cópia privada
+        self.journal = None
+        if device.private:
+            self.journal = Journal(
+                device, sb.journal_start, sb.journal_blocks, sb.offset(sb.bitmap_start)
+            )
+
+    # O que é lido do metadado do disco: alocador e caches (a FAT é lida
+    # direto do buffer)
+    def _load(self, sb, alloc_policy, dedup=False):
+        self.sb = sb
+        self.allocator = BlockAllocator(
+            sb.num_blocks, alloc_policy, self.device.buffer,
+            sb.offset(sb.bitmap_start), sb.free_blocks, self.device.mark, sb.shared_blocks,
+        )
+        self.allocator.probe = self.probe
+        self.chain_index = OrderedDict()
+        self.dcache = DentryCache()
+        self.dedup = None
+        if dedup:
+            self.dedup = DedupIndex(self)
+            self.allocator.on_free = self.dedup.forget
+
+    # O disco mudou por baixo (rollback de snapshot): lê tudo de novo e
+    # todas as threads voltam pra raiz
+    def _reload(self):
+        # O superbloco pode ocupar mais de um bloco (bloco pequeno)
+        sb = Superblock.unpack_from(self.device[0:self.sb.bitmap_start])
+        self._load(sb, self.allocator.policy, self.dedup is not None)
+        if self.blocks is not self.device:
+            self.blocks.drop()
+        self.root = ChainDirectory(self, "/", None, first_block=self.sb.root)
+        self.session = threading.local()
+
+    # Diretório atual é de cada thread; thread nova começa na raiz
+    @property
+    def current_dir(self):
+        return getattr(self.session, "cwd", None) or self.root
 
+    @current_dir.setter
+    def current_dir(self, dir):
+        self.session.cwd = dir
+
+    def sync(self):
+        with self.locks.tx.write():
+            self._sync()
+
+    def _sync(self):
+        self.sb.free_blocks = len(self.allocator)
+        self.sb.shared_blocks = self.allocator.shared
+        self.device.mark(0, Superblock.FORMAT.size)
+        self.sb.pack_into(self.device.buffer)
+        if self.blocks is not self.device:
+            self.blocks.writeback()
+        if self.journal is not None:
+            self.journal.commit()
+        else:
+            self.device.flush()
+
+    def close(self):
+        self.sync()
+        self.next_block.release()
+        self.blocks.close()
+
+    # Bloco sozinho, já como fim de cadeia
     def alloc_block(self):
-        if not self.free_blocks:
-            raise RuntimeError("No free blocks available")
-        return self.free_blocks.pop()
+        idx = self.allocator.alloc_block()
+        self._set_next(idx, self.END)
+        return idx
+
+    def alloc_blocks(self, count):
+        return self.allocator.alloc_blocks(count)
+
+    def free_extent(self, start, length=1):
+        self.allocator.free_extent(start, length)
+
+    # Toda escrita na FAT passa por aqui pro journal e os snapshots saberem
+    # o que vai mudar
+    def _set_next(self, idx, nxt):
+        self.device.mark(self.fat_offset + idx * 4, 4)
+        self.next_block[idx] = nxt
+
+    # Com dedup, os blocos saem do índice antes de alguém ver se são
+    # compartilhados e mexer neles no lugar
+    def _forget(self, start, count=1):
+        if self.dedup is not None:
+            self.dedup.forget(start, count)
+
+    # Aloca count blocos de uma vez e já encadeia na ordem das faixas
+    def _alloc_linked(self, count):
+        return self._link(self.alloc_blocks(count))
+
+    # Encadeia as faixas já alocadas, em ordem
+    def _link(self, runs):
+        order = [
+            idx
+            for start, length in runs
+            for idx in range(start, start + length)
+        ]
+        for idx, nxt in zip(order, order[1:]):
+            self._set_next(idx, nxt)
+        self._set_next(order[-1], self.END)
+        return order
 
+    # Índice de blocos por cadeia: primeiro bloco -> lista com todos os blocos
+    # em ordem. É montado na primeira vez que alguém anda na cadeia e mantido
+    # pelo free_chain/resize_chain, então achar o k-ésimo bloco é O(1). Guarda
+    # no máximo INDEX_CAPACITY cadeias (LRU); a FAT continua sendo a verdade,
+    # perder uma entrada só custa andar na cadeia de novo. Com capacidade 0
+    # tudo volta a andar pela FAT. A trava só protege a inserção e o despejo
+    # da LRU; a lista de cada cadeia é de quem tem a trava daquele arquivo ou
+    # diretório.
+    def _chain_index(self, first_block):
+        if not self.INDEX_CAPACITY:
+            return None
+        blocks = self.chain_index.get(first_block)
+        if blocks is not None:
+            try:
+                self.chain_index.move_to_end(first_block)
+            except KeyError:
+                # Outra thread despejou no meio; a lista continua valendo
+                pass
+            return blocks
+        blocks = []
+        idx = first_block
+        while idx != self.END:
+            blocks.append(idx)
+            idx = self.next_block[idx]
+        with self.index_lock:
+            blocks = self.chain_index.setdefault(first_block, blocks)
+            if len(self.chain_index) > self.INDEX_CAPACITY:
+                self.chain_index.popitem(last=False)
+        return blocks
+
+    def chain_block(self, first_block, k):
+        blocks = self._chain_index(first_block)
+        if blocks is not None:
+            return blocks[k]
+        idx = first_block
+        for _ in range(k):
+            idx = self.next_block[idx]
+        return idx
+
+    def chain_blocks(self, first_block):
+        blocks = self._chain_index(first_block)
+        if blocks is not None:
+            return blocks
+        return [
+            idx
+            for start, count in self.chain_runs(first_block)
+            for idx in range(start, start + count)
+        ]
+
+    # Tira um dono de cada bloco da cadeia. Bloco compartilhado com outro
+    # arquivo (cp) continua ligado, porque o resto da cadeia também é dele.
     def free_chain(self, first_block):
+        with self.index_lock:
+            self.chain_index.pop(first_block, None)
         idx = first_block
-        while idx is not None:
+        while idx != self.END:
             nxt = self.next_block[idx]
-            self.next_block[idx] = None
-            self.free_blocks.add(idx)
+            if self.allocator.refcount(idx) == 1:
+                # Confere de novo: o dedup pode ter pego o bloco antes do forget
+                self._forget(idx)
+            if self.allocator.refcount(idx) == 1:
+                self._set_next(idx, self.END)
+            self.free_extent(idx)
             idx = nxt
 
+    # Cópia do cp: a cabeça é copiada, porque ela é o id do arquivo, e o
+    # resto da cadeia fica compartilhado, com mais um dono em cada bloco.
+    # Como a FAT guarda um próximo por bloco, quem compartilha um bloco
+    # compartilha também todos os depois dele: os compartilhados são sempre
+    # um rabo da cadeia.
+    def clone_chain(self, first_block):
+        shared = []
+        head = None
+        try:
+            for start, count in self.chain_runs(first_block, 1):
+                self.allocator.share(start, count)
+                shared.append((start, count))
+            head = self.alloc_block()
+            self.blocks.write(head, self.blocks[first_block])
+            self._set_next(head, self.next_block[first_block])
+        except BaseException:
+            if head is not None:
+                self.free_extent(head)
+            for start, count in shared:
+                self.free_extent(start, count)
+            raise
+        return head
+
+    # Antes de escrever no k-ésimo bloco ou mudar o próximo dele: se ele é
+    # compartilhado, copia o pedaço compartilhado até ele (do primeiro
+    # compartilhado, achado por busca binária, até k) pra blocos novos
+    def _unshare_chain(self, first_block, k):
+        if not self.allocator.shared:
+            return
+        blocks = self.chain_blocks(first_block)
+        if self.allocator.refcount(blocks[k]) < 2:
+            return
+        lo, hi = 1, k
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.allocator.refcount(blocks[mid]) > 1:
+                hi = mid
+            else:
+                lo = mid + 1
+        new = self._alloc_linked(k - lo + 1)
+        for old, idx in zip(blocks[lo:k + 1], new):
+            self.blocks.write(idx, self.blocks[old])
+        self._set_next(new[-1], self.next_block[blocks[k]])
+        self._set_next(blocks[lo - 1], new[0])
+        for old in blocks[lo:k + 1]:
+            self.allocator.free_extent(old)
+        blocks[lo:k + 1] = new
+
     def write_chain(self, data: bytes):
+        if self.dedup is not None:
+            return self._write_chain_dedup(data)
         remaining = memoryview(data)
-        first = last = None
-        while remaining:
-            idx = self.alloc_block()
-            if first is None:
-                first = idx
-            if last is not None:
-                self.next_block[last] = idx
+        order = self._alloc_linked(max(1, -(-len(data) // self.BLOCK_SIZE)))
+        for idx in order:
             chunk = remaining[: self.BLOCK_SIZE]
-            self.blocks[idx][: len(chunk)] = chunk
+            self.blocks.write(idx, chunk)
             remaining = remaining[len(chunk) :]
-            last = idx
-        if first is None:
-            first = self.alloc_block()
-        return first, len(data)
+        return order[0], len(data)
+
+    # write_chain com dedup. Como cada bloco tem um próximo só, dá pra
+    # compartilhar só um rabo inteiro de outra cadeia: a digital do bloco k é
+    # a do conteúdo dele junto com a digital do k+1, e o rabo é casado de trás
+    # pra frente, conferindo também o próximo de cada bloco achado. A cabeça
+    # é o id do arquivo e é sempre nova.
+    def _write_chain_dedup(self, data):
+        dedup = self.dedup
+        bs = self.BLOCK_SIZE
+        data = memoryview(data)
+        n = max(1, -(-len(data) // bs))
+        chunks = [data[k * bs:(k + 1) * bs] for k in range(n)]
+        chunks[-1] = bytes(chunks[-1]).ljust(bs, b"\0")
+        digests = [None] * n
+        tail = b""
+        for k in range(n - 1, 0, -1):
+            tail = digests[k] = dedup.fingerprint(chunks[k], tail)
+        shared = []
+        nxt = self.END
+        try:
+            while n > 1:
+                idx = dedup.find(
+                    digests[n - 1], chunks[n - 1],
+                    lambda idx, nxt=nxt: self.next_block[idx] == nxt,
+                )
+                if idx is None:
+                    break
+                shared.append(idx)
+                nxt = idx
+                n -= 1
+            order = self._alloc_linked(n)
+        except RuntimeError:
+            for idx in shared:
+                self.free_extent(idx)
+            raise
+        for idx, chunk in zip(order, chunks):
+            self.blocks.write(idx, chunk)
+        if shared:
+            self._set_next(order[-1], nxt)
+        for k in range(1, n):
+            dedup.add(digests[k], order[k])
+        dedup.wrote(len(chunks))
+        return order[0], len(data)
+
+    # Faixas (início, n) de blocos consecutivos da cadeia, a partir do
+    # k-ésimo bloco e cobrindo no máximo limit blocos
+    def chain_runs(self, first_block, k=0, limit=None):
+        blocks = self._chain_index(first_block)
+        if blocks is not None:
+            n = len(blocks) if limit is None else min(len(blocks), k + limit)
+            while k < n:
+                start = blocks[k]
+                count = 1
+                while k + count < n and blocks[k + count] == start + count:
+                    count += 1
+                yield start, count
+                k += count
+            return
+        idx = first_block
+        for _ in range(k):
+            idx = self.next_block[idx]
+        left = limit
+        while idx != self.END and left != 0:
+            start = idx
+            count = 1
+            idx = self.next_block[idx]
+            while idx == start + count and count != left:
+                count += 1
+                idx = self.next_block[idx]
+            yield start, count
+            if left is not None:
+                left -= count
 
     def read_chain(self, first_block, size):
-        buf = bytearray()
+        return self.read_at(first_block, size, 0, size)
+
+    # Gera o conteúdo de offset até offset + n (ou até o fim) como
+    # memoryviews direto do buffer do disco, sem copiar: uma por faixa de
+    # blocos consecutivos, com no máximo STREAM_BLOCKS blocos (com cache, a
+    # faixa é copiada, então a memória fica nesse limite). A view só vale até
+    # a próxima escrita no arquivo.
+    def iter_chain(self, first_block, size, offset=0, n=None):
+        end = size if n is None else min(size, offset + n)
+        if offset >= end:
+            return
+        k = offset // self.BLOCK_SIZE
+        pos = k * self.BLOCK_SIZE
+        limit = -(-end // self.BLOCK_SIZE) - k
+        step = self.STREAM_BLOCKS
+        for start, count in self.chain_runs(first_block, k, limit):
+            for first in range(start, start + count, step):
+                run = memoryview(self.blocks[first:min(first + step, start + count)])
+                yield run[max(offset - pos, 0) : end - pos]
+                pos += len(run)
+                if pos >= end:
+                    return
+
+    # Lê n bytes a partir de offset copiando cada faixa direto do buffer do
+    # disco, sem passar pelos blocos de antes
+    def read_at(self, first_block, size, offset, n):
+        end = min(size, offset + n)
+        if offset >= end:
+            return b""
+        k = offset // self.BLOCK_SIZE
+        pos = k * self.BLOCK_SIZE
+        views = []
+        limit = -(-end // self.BLOCK_SIZE) - k
+        for start, count in self.chain_runs(first_block, k, limit):
+            run = self.blocks[start:start + count]
+            views.append(run[max(offset - pos, 0) : end - pos])
+            pos += len(run)
+            if pos >= end:
+                break
+        if len(views) == 1:
+            return bytes(views[0])
+        return b"".join(views)
+
+    def _copy_at(self, first_block, offset, data):
+        data = memoryview(data)
+        k = offset // self.BLOCK_SIZE
+        limit = -(-(offset + len(data)) // self.BLOCK_SIZE) - k
+        if self.dedup is not None:
+            for start, count in self.chain_runs(first_block, k, limit):
+                self._forget(start, count)
+        if data:
+            self._unshare_chain(first_block, (offset + len(data) - 1) // self.BLOCK_SIZE)
+        pos = k * self.BLOCK_SIZE
+        written = 0
+        for start, count in self.chain_runs(first_block, k, limit):
+            if written == len(data):
+                break
+            span = count * self.BLOCK_SIZE
+            lo = offset + written - pos
+            chunk = data[written : written + span - lo]
+            self.blocks.write(start, chunk, lo)
+            written += len(chunk)
+            pos += span
+
+    # Escreve data em offset e devolve o tamanho novo do arquivo. Só mexe nos
+    # blocos que a escrita cobre; se passar do fim, aumenta o rabo da cadeia
+    # e o buraco entre o fim antigo e offset vira zero.
+    def write_at(self, first_block, size, offset, data):
+        end = offset + len(data)
+        if end > size:
+            self.resize_chain(first_block, -(-end // self.BLOCK_SIZE))
+            if offset > size:
+                self._copy_at(first_block, size, bytes(offset - size))
+            size = end
+        self._copy_at(first_block, offset, data)
+        return size
+
+    def truncate_chain(self, first_block, size, new_size):
+        if new_size < size:
+            self.resize_chain(first_block, max(1, -(-new_size // self.BLOCK_SIZE)))
+            return new_size
+        return self.write_at(first_block, size, size, bytes(new_size - size))
+
+    def resize_chain(self, first_block, num_blocks):
+        # Mantém a cabeça e os blocos do começo, só aumenta ou corta o rabo
+        # O bloco que ganha próximo novo não pode ser compartilhado
+        blocks = self._chain_index(first_block)
+        if blocks is not None:
+            if len(blocks) < num_blocks:
+                self._forget(blocks[-1])
+                self._unshare_chain(first_block, len(blocks) - 1)
+                added = self._alloc_linked(num_blocks - len(blocks))
+                self._set_next(blocks[-1], added[0])
+                blocks.extend(added)
+            elif len(blocks) > num_blocks:
+                self._forget(blocks[num_blocks - 1])
+                self._unshare_chain(first_block, num_blocks - 1)
+                self._set_next(blocks[num_blocks - 1], self.END)
+                self.free_chain(blocks[num_blocks])
+                del blocks[num_blocks:]
+            return num_blocks * self.BLOCK_SIZE
         idx = first_block
-        read = 0
-        while idx is not None and read < size:
-            chunk_len = min(self.BLOCK_SIZE, size - read)
-            buf.extend(self.blocks[idx][:chunk_len])
-            read += chunk_len
+        count = 1
+        while count < num_blocks and self.next_block[idx] != self.END:
             idx = self.next_block[idx]
-        return bytes(buf[:size])
+            count += 1
+        self._forget(idx)
+        if self.allocator.refcount(idx) > 1:
+            self._unshare_chain(first_block, count - 1)
+            idx = self.chain_block(first_block, count - 1)
+        if count < num_blocks:
+            self._set_next(idx, self._alloc_linked(num_blocks - count)[0])
+            return num_blocks * self.BLOCK_SIZE
+        tail = self.next_block[idx]
+        if tail == self.END:
+            return num_blocks * self.BLOCK_SIZE
+        self._set_next(idx, self.END)
+        self.free_chain(tail)
+        return num_blocks * self.BLOCK_SIZE
 
     def rewrite_chain(self, first_block, data: bytes):
         self.free_chain(first_block)
@@ -114,13 +499,26 @@ class ChainFileSystem:
         if "/" not in path:
             return "", path
         dir_path, _, base = path.rpartition("/")
-        return dir_path, base
+        # "/nome" é na raiz, não no diretório atual
+        return dir_path or "/", base
 
+    # Com os contadores ligados, conta a profundidade de cada caminho
     def get_dir(self, path: str):
+        if self.probe is None:
+            return self._get_dir(path)
+        began = self.probe.start()
+        dir = self._get_dir(path)
+        depth = sum(part not in ("", ".") for part in path.split("/"))
+        self.probe.stop("path_walk", began, depth)
+        return dir
+
+    def _get_dir(self, path: str):
         if path in ("", "."):
             return self.current_dir
         if path == "/":
             return self.root
+        if path.startswith(snapshot.ROOT + "/"):
+            return snapshot.get_dir(self, path)
         parts = path.strip("/").split("/")
         node = self.root if path.startswith("/") else self.current_dir
         for part in parts:
@@ -129,8 +527,7 @@ class ChainFileSystem:
             if part == "..":
                 node = node.parent or node
                 continue
-            entries = node.get_entries()
-            meta = entries.get(part)
+            meta = node.lookup(part)
             if not meta or meta[0] != "directory":
                 return None
             node = ChainDirectory(self, part, node, first_block=meta[1], size=meta[2])
@@ -141,9 +538,12 @@ class ChainFileSystem:
             self.current_dir = self.root
             return
         target = self.get_dir(args[0])
-        if target:
+        if target and target.fs is not self:
+            print(f"cd: '{args[0]}': snapshots can only be browsed by path")
+        elif target:
             self.current_dir = target
 
+    @journaled
     def make_directory(self, args):
         if not args:
             print("mkdir: missing operand")
@@ -153,14 +553,17 @@ class ChainFileSystem:
         if not parent:
             print(f"mkdir: cannot access '{dir_path}': No such directory")
             return
-        entries = parent.get_entries()
-        if name in entries:
-            print(f"mkdir: '{name}' already exists")
+        if len(name.encode("utf-8")) > Directory.NAME_MAX:
+            print(f"mkdir: '{name}': File name too long")
             return
-        new_dir = ChainDirectory(self, name, parent)
-        entries[name] = ("directory", new_dir.first_block, new_dir.size)
-        parent.update_entries(entries)
+        with self.locks.write(parent.ident()):
+            if parent.lookup(name) is not None:
+                print(f"mkdir: '{name}' already exists")
+                return
+            new_dir = ChainDirectory(self, name, parent)
+            parent.add_entry(name, ("directory", new_dir.first_block, 0))
 
+    @journaled
     def remove_directory(self, args):
         if not args:
             print("rmdir: missing operand")
@@ -168,11 +571,11 @@ class ChainFileSystem:
         target = self.get_dir(args[0])
         if not target or target.parent is None:
             return
-        entries = target.parent.get_entries()
-        del entries[target.name]
-        self.free_chain(target.first_block)
-        target.parent.update_entries(entries)
+        with self.locks.write(target.parent.ident(), target.ident()):
+            if target.parent.remove_entry(target.name) is not None:
+                self.free_chain(target.first_block)
 
+    @journaled
     def make_file(self, args):
         if len(args) < 2:
             print("mkfile: Not enough arguments")
@@ -183,14 +586,150 @@ class ChainFileSystem:
         if not parent:
             print(f"mkfile: cannot access '{dir_path}': No such directory")
             return
-        entries = parent.get_entries()
-        if name in entries:
-            print(f"mkfile: '{name}' already exists")
+        if len(name.encode("utf-8")) > Directory.NAME_MAX:
+            print(f"mkfile: '{name}': File name too long")
             return
-        first, size = self.write_chain(content.encode("utf-8"))
-        entries[name] = ("file", first, size)
-        parent.update_entries(entries)
+        with self.locks.write(parent.ident()):
+            if parent.lookup(name) is not None:
+                print(f"mkfile: '{name}' already exists")
+                return
+            parent.add_entry(name, self._new_file(content.encode("utf-8")))
+
+    def _new_file(self, data):
+        first, size = self.write_chain(data)
+        return ("file", first, size)
+
+    def _free_file(self, first_block):
+        # Espera quem ainda está lendo o arquivo antes de soltar os blocos
+        with self.locks.write(first_block):
+            self.free_chain(first_block)
+
+    # Versões em lote do mkfile/mkdir/rm pro Shell.run: tudo no mesmo
+    # diretório, com uma atualização só na tabela de entradas. Devolvem uma
+    # mensagem de erro (ou None) por item.
+    @journaled
+    def make_files(self, dir_path, items):
+        return self._make_entries(
+            dir_path, items, "mkfile",
+            lambda parent, name, data: self._new_file(data.encode("utf-8")),
+        )
+
+    @journaled
+    def make_directories(self, dir_path, names):
+        return self._make_entries(
+            dir_path, [(name, None) for name in names], "mkdir",
+            lambda parent, name, _: (
+                "directory", ChainDirectory(self, name, parent).first_block, 0
+            ),
+        )
+
+    def _make_entries(self, dir_path, items, cmd, create):
+        parent = self.get_dir(dir_path)
+        if not parent:
+            return [f"{cmd}: cannot access '{dir_path}': No such directory"] * len(items)
+        errors, entries, seen = [], [], set()
+        with self.locks.write(parent.ident()):
+            for name, arg in items:
+                if len(name.encode("utf-8")) > Directory.NAME_MAX:
+                    errors.append(f"{cmd}: '{name}': File name too long")
+                elif name in seen or parent.lookup(name) is not None:
+                    errors.append(f"{cmd}: '{name}' already exists")
+                else:
+                    try:
+                        entries.append((name, create(parent, name, arg)))
+                    except RuntimeError as e:
+                        # Acabou o espaço: o que já foi criado fica
+                        errors.append(f"{cmd}: {e}")
+                        continue
+                    seen.add(name)
+                    errors.append(None)
+            parent.add_entries(entries)
+        return errors
+
+    # Cópia em lote de/para o host, pasta ou tar (transfer.py)
+    @journaled
+    def import_tree(self, host_path, fs_path=""):
+        return transfer.import_tree(self, host_path, fs_path)
+
+    @journaled
+    def import_tar(self, source, fs_path=""):
+        return transfer.import_tar(self, source, fs_path)
+
+    def export_tree(self, fs_path, host_path):
+        return transfer.export_tree(self, fs_path, host_path)
+
+    def export_tar(self, fs_path, target):
+        return transfer.export_tar(self, fs_path, target)
+
+    # Snapshots do filesystem inteiro (snapshot.py)
+    def snapshot(self, name):
+        snapshot.take(self, name)
+
+    def list_snapshots(self):
+        return snapshot.list_snapshots(self)
+
+    def delete_snapshot(self, name):
+        snapshot.delete(self, name)
+
+    def rollback(self, name):
+        snapshot.rollback(self, name)
+
+    # cp [-r] origem destino, sem copiar dado (blocos compartilhados)
+    @journaled
+    def copy(self, args):
+        recursive = "-r" in args
+        args = [arg for arg in args if arg != "-r"]
+        if len(args) < 2:
+            print("cp: Not enough arguments")
+            return
+        try:
+            transfer.copy_tree(self, args[0], args[1], recursive)
+        except (OSError, ValueError, RuntimeError) as e:
+            print(f"cp: {e}")
+
+    # Ganchos do transfer.py
+    def _file_blocks(self, size):
+        return max(1, -(-size // self.BLOCK_SIZE))
+
+    def _new_file_at(self, runs, size):
+        return ("file", self._link(runs)[0], size)
 
+    def _new_directory(self, parent, name):
+        dir = ChainDirectory(self, name, parent)
+        return ("directory", dir.first_block, 0), dir
+
+    def _child_dir(self, parent, name, meta):
+        if meta[0] != "directory":
+            return None
+        return ChainDirectory(self, name, parent, first_block=meta[1], size=meta[2])
+
+    def _open_entry(self, parent, name, meta):
+        return ChainOpenFile(self, parent, name, meta[1])
+
+    def _clone_file(self, parent, name, meta):
+        first_block = meta[1]
+        with self.locks.read(first_block):
+            # O rm pode ter passado entre o lookup e a trava
+            meta = parent.lookup(name)
+            if meta is None or meta[1] != first_block:
+                raise FileNotFoundError(f"No such file: '{name}'")
+            return ("file", self.clone_chain(first_block), meta[2])
+
+    @journaled
+    def remove_files(self, dir_path, names):
+        parent = self.get_dir(dir_path)
+        if not parent:
+            return [f"rm: cannot access '{dir_path}': No such directory"] * len(names)
+        errors = []
+        for name, meta in zip(names, parent.remove_entries(names)):
+            if not meta:
+                errors.append(f"rm: '{name}' not found")
+                continue
+            self._free_file(meta[1])
+            errors.append(None)
+        return errors
+
+    @journaled
     def remove_file(self, args):
         if not args:
             print("rm: Not enough arguments")
@@ -199,24 +738,25 @@ class ChainFileSystem:
         parent = self.get_dir(dir_path)
         if not parent:
             return
-        entries = parent.get_entries()
-        if name in entries:
-            meta = entries.pop(name)
-            self.free_chain(meta[1])
-            parent.update_entries(entries)
+        meta = parent.remove_entry(name)
+        if meta:
+            self._free_file(meta[1])
 
+    @journaled
     def move(self, args):
         if len(args) < 2:
             print("mv: Not enough arguments")
             return
         src, dst = args
         s_dir, s_name = self.split_path(src)
-        src_parent = self.get_dir(s_dir) or self.current_dir
-        entries_src = src_parent.get_entries()
-        if s_name not in entries_src:
+        src_parent = self.get_dir(s_dir)
+        if not src_parent:
+            # Inclui /.snapshots/..., que o mv não enxerga
+            print(f"mv: source directory '{s_dir}' not found")
+            return
+        if not src_parent.lookup(s_name):
             print(f"mv: source '{s_name}' not found")
             return
-        meta = entries_src.pop(s_name)
         dst_parent = self.get_dir(dst)
         if dst_parent:
             d_name = s_name
@@ -226,32 +766,90 @@ class ChainFileSystem:
             if not dst_parent:
                 print(f"mv: destination '{d_dir}' not found")
                 return
-        entries_dst = dst_parent.get_entries()
-        if d_name in entries_dst:
-            print(f"mv: destination '{d_name}' already exists")
+        if len(d_name.encode("utf-8")) > Directory.NAME_MAX:
+            print(f"mv: '{d_name}': File name too long")
             return
-        entries_dst[d_name] = meta
-        dst_parent.update_entries(entries_dst)
-        src_parent.update_entries(entries_src)
+        with self.locks.write(src_parent.ident(), dst_parent.ident()):
+            # Confere de novo segurando as travas
+            meta = src_parent.lookup(s_name)
+            if not meta:
+                print(f"mv: source '{s_name}' not found")
+                return
+            if dst_parent.lookup(d_name) is not None:
+                print(f"mv: destination '{d_name}' already exists")
+                return
+            dst_parent.add_entry(d_name, meta)
+            src_parent.remove_entry(s_name)
 
+    # Imprime em pedaços, sem juntar o arquivo inteiro na memória
     def cat(self, args):
-        data = self._cat(args)
-        if data:
-            print(data.decode("utf-8"))
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        printed = False
+        for view in self._cat_views(args) or ():
+            print(decoder.decode(view), end="")
+            printed = True
+        if printed:
+            print(decoder.decode(b"", final=True))
 
     def _cat(self, args):
+        views = self._cat_views(args)
+        return None if views is None else b"".join(views)
+
+    # Gerador com o conteúdo do arquivo, ou None se ele não existe
+    def _cat_views(self, args):
         if not args:
             print("cat: missing operand")
-            return
+            return None
         dir_path, name = self.split_path(args[0])
-        parent = self.get_dir(dir_path) or self.current_dir
-        entries = parent.get_entries()
-        if name not in entries:
+        parent = self.get_dir(dir_path)
+        if not parent:
+            print(f"cat: cannot access '{dir_path}': No such directory")
+            return None
+        meta = parent.lookup(name)
+        if not meta:
             print(f"cat: '{name}' not found")
+            return None
+        return parent.fs._locked_views(parent, name, meta[1])
+
+    def _locked_views(self, parent, name, first_block):
+        with self.locks.read(first_block):
+            # O rm pode ter passado entre o lookup e a trava
+            meta = parent.lookup(name)
+            if not meta or meta[1] != first_block:
+                print(f"cat: '{name}' not found")
+                return
+            yield from self.iter_chain(first_block, meta[2])
+
+    def open(self, path, create=False):
+        if path.startswith(snapshot.ROOT + "/"):
+            return snapshot.open_file(self, path, create)
+        dir_path, name = self.split_path(path)
+        parent = self.get_dir(dir_path or ("/" if path.startswith("/") else ""))
+        if not parent:
+            raise FileNotFoundError(f"No such directory: '{dir_path}'")
+        with self.locks.write(parent.ident()):
+            meta = parent.lookup(name)
+            if not meta:
+                if not create:
+                    raise FileNotFoundError(f"No such file: '{path}'")
+                meta = self._new_file(b"")
+                parent.add_entry(name, meta)
+        if meta[0] == "directory":
+            raise IsADirectoryError(f"Is a directory: '{path}'")
+        return ChainOpenFile(self, parent, name, meta[1])
+
+    @journaled
+    def append_file(self, args):
+        if len(args) < 2:
+            print("append: Not enough arguments")
+            return
+        try:
+            f = self.open(args[0], create=True)
+        except (OSError, ValueError) as e:
+            print(f"append: {e}")
             return
-        meta = entries[name]
-        data = self.read_chain(meta[1], meta[2])
-        return data
+        f.append(" ".join(args[1:]).encode("utf-8"))
+        f.close()
 
     def list_directory(self, args=None):
         target = self.current_dir if not args else self.get_dir(args[0])
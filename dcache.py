@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict
+
+
+# Cache de resolução de nomes: (id do diretório pai, nome) -> valor da entrada.
+# Guarda também as entradas negativas (nome que não existe) como None. Uma
+# trava só protege a LRU, os diretórios cuidam da própria consistência.
+#
+# A chave leva também a geração do diretório: invalidar um diretório é só
+# subir a geração dele, e o que estava guardado com a antiga nunca mais é
+# achado e sai pela ponta da LRU.
+class DentryCache:
+    MISSING = object()
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, dir_id, name):
+        with self.lock:
+            key = (dir_id, self.generations.get(dir_id, 0), name)
+            value = self.entries.get(key, self.MISSING)
+            if value is self.MISSING:
+                self.misses += 1
+                return value
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, dir_id, name, value):
+        with self.lock:
+            key = (dir_id, self.generations.get(dir_id, 0), name)
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    # O id de um diretório apagado pode ser reaproveitado por outro, então
+    # quando isso acontece tudo que estava pendurado nele tem que sair. O(1):
+    # não varre a cache.
+    def invalidate_dir(self, dir_id):
+        with self.lock:
+            self.generations[dir_id] = self.generations.get(dir_id, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generations.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,98 @@
+import hashlib
+import threading
+import time
+
+
+# Índice de deduplicação: impressão digital (blake2b de 16 bytes) do conteúdo
+# de um bloco -> o bloco que tem esse conteúdo. Com dedup ligado, quem escreve
+# um arquivo novo procura cada bloco aqui e, se acha, só ganha mais um dono
+# nele (o mesmo contador do cp), em vez de alocar e escrever. O índice fica
+# só na memória e começa vazio a cada montagem.
+#
+# Um bloco indexado ainda pode ser escrito no lugar pelo único dono dele, então
+# antes de escrever ou mudar o próximo de um bloco, quem escreve tira ele do
+# índice (forget) e só depois confere o contador. find e forget pegam a trava
+# do alocador, então um bloco nunca ganha dono pelo índice entre as duas
+# coisas. Bloco que volta a ser livre sai do índice pelo on_free do alocador.
+class DedupIndex:
+    def __init__(self, fs):
+        self.fs = fs
+        self.by_digest = {}
+        self.by_block = {}
+        self.lock = threading.Lock()
+        self.written = 0
+        self.deduped = 0
+        self.hash_ns = 0
+
+    # Impressão digital de data; com tail, do data seguido de tail (a cadeia
+    # usa pra digital de um bloco cobrir também os blocos depois dele)
+    def fingerprint(self, data, tail=b""):
+        start = time.perf_counter_ns()
+        h = hashlib.blake2b(data, digest_size=16)
+        if tail:
+            h.update(tail)
+        digest = h.digest()
+        self.hash_ns += time.perf_counter_ns() - start
+        return digest
+
+    # Bloco já usado com o conteúdo data (o bloco inteiro, com os zeros do
+    # fim) e que passa em check(idx), já com mais um dono; ou None
+    def find(self, digest, data, check=None):
+        allocator = self.fs.allocator
+        with allocator.lock:
+            with self.lock:
+                idx = self.by_digest.get(digest)
+            if idx is None or not allocator.refcount(idx):
+                return None
+            if self.fs.blocks[idx] != data or (check is not None and not check(idx)):
+                return None
+            try:
+                allocator.share(idx)
+            except RuntimeError:
+                return None
+            self.deduped += 1
+            return idx
+
+    # Bloco novo escrito com conteúdo de digital digest
+    def add(self, digest, idx):
+        with self.lock:
+            old = self.by_block.pop(idx, None)
+            if old is not None and self.by_digest.get(old) == idx:
+                del self.by_digest[old]
+            self.by_digest[digest] = idx
+            self.by_block[idx] = digest
+
+    # Conta count blocos de arquivo escritos com dedup ligado, achados no
+    # índice ou não
+    def wrote(self, count):
+        with self.lock:
+            self.written += count
+
+    # Tira do índice os blocos start..start+length-1
+    def forget(self, start, length=1):
+        if not self.by_block:
+            return
+        with self.fs.allocator.lock, self.lock:
+            if length > len(self.by_block):
+                blocks = [idx for idx in self.by_block if start <= idx < start + length]
+            else:
+                blocks = range(start, start + length)
+            for idx in blocks:
+                digest = self.by_block.pop(idx, None)
+                if digest is not None and self.by_digest.get(digest) == idx:
+                    del self.by_digest[digest]
+
+    # ratio: blocos escritos por bloco ocupado de verdade. hash_per_saved:
+    # segundos de hash gastos por bloco economizado.
+    def stats(self):
+        stored = self.written - self.deduped
+        hash_seconds = self.hash_ns / 1e9
+        return {
+            "indexed": len(self.by_block),
+            "written_blocks": self.written,
+            "deduped_blocks": self.deduped,
+            "saved_bytes": self.deduped * self.fs.BLOCK_SIZE,
+            "ratio": self.written / stored if stored else 1.0,
+            "hash_seconds": hash_seconds,
+            "hash_per_saved": hash_seconds / self.deduped if self.deduped else None,
+        }
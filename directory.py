@@ -1,19 +1,312 @@
-# Diretório salva as entradas no próprio inode e depois lé, coisa engraçada
+import struct
+import zlib
+from itertools import islice
+
+
+# Diretório salva as entradas nos próprios blocos e depois lê, coisa engraçada
+#
+# Formato em disco: o bloco lógico 0 é o cabeçalho e os blocos 1..n são os
+# buckets de uma tabela hash. Cada bucket é um bloco cheio de registros de
+# tamanho fixo; o nome cai no bucket crc32(nome) % n e, se o bucket estiver
+# cheio, vai pro próximo (endereçamento aberto). Assim lookup/insert/delete
+# só leem e escrevem os blocos que precisam.
+#
+# Remover deixa uma lápide (DELETED) no slot, que é reaproveitado pelo próximo
+# insert que passar por ali. A tabela só é reconstruída quando enche ou quando
+# as lápides passam de 3/4 dos slots usados; a reconstrução reaproveita os
+# blocos que o diretório já tem, crescendo ou encolhendo só o rabo.
+#
+# Quem lê pega a trava de leitura do diretório (fs.locks) e quem muda pega a
+# de escrita; as duas deixam quem já tem a escrita entrar de novo.
 class Directory:
+    MAGIC = b"\x00HDR"
+    HEADER = struct.Struct("<4sIII")  # magic, buckets, vivos, usados
+    RECORD = struct.Struct("<BB46sQQ")  # status, tipo, nome, a, b
+    NAME_MAX = 46
+    EMPTY, LIVE, DELETED = 0, 1, 2
+    TYPES = {1: "file", 2: "directory"}
+    TYPE_CODES = {"file": 1, "directory": 2}
+    MAX_LOAD = 0.75
+
     def __init__(self):
         self.parent = None
         self.name = None
         self.fs = None
 
-    def get_entries(self):
+    # Ganchos de cada backend
+    def ident(self):
         raise NotImplementedError
-    def update_entries(self, entries: dict):
+    def _block(self, k):
         raise NotImplementedError
-    def write_entries(self, entries: dict):
+    def _blocks(self):
         raise NotImplementedError
-    def get_path(self):
+    def _resize(self, num_blocks):
+        raise NotImplementedError
+    def _raw_size(self):
+        raise NotImplementedError
+    def _read_raw(self):
+        raise NotImplementedError
+    def _parse_legacy(self, text):
+        raise NotImplementedError
+    def _encode(self, value):
+        raise NotImplementedError
+    def _decode(self, ftype, a, b):
         raise NotImplementedError
 
+    def _slots(self):
+        return self.fs.BLOCK_SIZE // self.RECORD.size
+
+    def _header(self):
+        if self.is_legacy():
+            self.migrate()
+        _, buckets, live, used = self.HEADER.unpack_from(self.fs.blocks[self._block(0)])
+        return buckets, live, used
+
+    def _write_header(self, buckets, live, used):
+        self.fs.blocks.write(
+            self._block(0), self.HEADER.pack(self.MAGIC, buckets, live, used)
+        )
+
+    def _find(self, key, buckets):
+        # Devolve (registro achado, primeiro slot livre); slot = (bloco, i)
+        padded = key.ljust(self.NAME_MAX, b"\0")
+        span = self._slots() * self.RECORD.size
+        free = None
+        b = zlib.crc32(key) % buckets
+        for _ in range(buckets):
+            k = 1 + b
+            blk = memoryview(self.fs.blocks[self._block(k)])[:span]
+            has_empty = False
+            for i, (status, ftype, name, x, y) in enumerate(self.RECORD.iter_unpack(blk)):
+                if status == self.LIVE:
+                    if name == padded:
+                        return (k, i, ftype, x, y), free
+                    continue
+                if free is None:
+                    free = (k, i)
+                if status == self.EMPTY:
+                    has_empty = True
+            # Se tinha slot nunca usado, ninguém passou daqui na sondagem
+            if has_empty:
+                break
+            b = (b + 1) % buckets
+        return None, free
+
+    def _put(self, slot, status, key, ftype=0, a=0, b=0):
+        k, i = slot
+        self.fs.blocks.write(
+            self._block(k), self.RECORD.pack(status, ftype, key, a, b),
+            i * self.RECORD.size,
+        )
+
+    # Blocos (cabeçalho + buckets) que uma tabela com n entradas ocupa
+    @classmethod
+    def blocks_for(cls, n, block_size):
+        slots = block_size // cls.RECORD.size
+        buckets = 1
+        while n + 1 > buckets * slots * cls.MAX_LOAD / 2:
+            buckets *= 2
+        return buckets + 1
+
+    def _rebuild(self, records):
+        # Monta a tabela inteira em memória e grava por cima dos blocos atuais
+        probe = self.fs.probe
+        if probe is not None:
+            began = probe.start()
+        slots = self._slots()
+        buckets = self.blocks_for(len(records), self.fs.BLOCK_SIZE) - 1
+        table = [[] for _ in range(buckets)]
+        for name, (ftype, a, b) in records.items():
+            key = name.encode("utf-8")
+            i = zlib.crc32(key) % buckets
+            while len(table[i]) == slots:
+                i = (i + 1) % buckets
+            table[i].append(self.RECORD.pack(self.LIVE, ftype, key, a, b))
+        block_size = self.fs.BLOCK_SIZE
+        n = len(records)
+        self._resize(buckets + 1)
+        blocks = self._blocks()
+        write = self.fs.blocks.write
+        write(next(blocks), self.HEADER.pack(self.MAGIC, buckets, n, n).ljust(block_size, b"\0"))
+        for bucket, idx in zip(table, blocks):
+            write(idx, b"".join(bucket).ljust(block_size, b"\0"))
+        if probe is not None:
+            probe.stop("dir_rewrite", began, n)
+
+    def _records(self):
+        probe = self.fs.probe
+        if probe is not None:
+            began = probe.start()
+        buckets, _, _ = self._header()
+        span = self._slots() * self.RECORD.size
+        records = {}
+        for idx in islice(self._blocks(), 1, buckets + 1):
+            blk = memoryview(self.fs.blocks[idx])[:span]
+            for status, ftype, name, a, b in self.RECORD.iter_unpack(blk):
+                if status == self.LIVE:
+                    records[name.rstrip(b"\0").decode("utf-8")] = (ftype, a, b)
+        if probe is not None:
+            probe.stop("dir_parse", began, len(records))
+        return records
+
+    def is_legacy(self):
+        if self._raw_size() < self.HEADER.size:
+            return True
+        return bytes(self.fs.blocks[self._block(0)][:4]) != self.MAGIC
+
+    def migrate(self):
+        # Converte diretório no formato antigo (texto "um por linha") pra tabela hash
+        text = self._read_raw().decode("utf-8")
+        entries = self._parse_legacy(text)
+        self._rebuild({name: self._encode(value) for name, value in entries.items()})
+
+    def lookup(self, name):
+        dcache = self.fs.dcache
+        value = dcache.get(self.ident(), name)
+        if value is not dcache.MISSING:
+            return value
+        with self.fs.locks.read(self.ident()):
+            buckets, _, _ = self._header()
+            found, _ = self._find(name.encode("utf-8"), buckets)
+            value = None if found is None else self._decode(*found[2:])
+            dcache.put(self.ident(), name, value)
+        return value
+
+    def add_entry(self, name, value):
+        key = name.encode("utf-8")
+        if len(key) > self.NAME_MAX:
+            raise ValueError(f"name too long: '{name}'")
+        with self.fs.locks.write(self.ident()):
+            return self._add_entry(name, key, value)
+
+    def _add_entry(self, name, key, value):
+        buckets, live, used = self._header()
+        found, free = self._find(key, buckets)
+        if found is not None:
+            return False
+        record = self._encode(value)
+        if free is None or used + 1 > buckets * self._slots() * self.MAX_LOAD:
+            records = self._records()
+            records[name] = record
+            self._rebuild(records)
+            self.fs.dcache.put(self.ident(), name, value)
+            return True
+        k, i = free
+        status = self.RECORD.unpack_from(self.fs.blocks[self._block(k)], i * self.RECORD.size)[0]
+        if status == self.EMPTY:
+            used += 1
+        self._put(free, self.LIVE, key, *record)
+        self._write_header(buckets, live + 1, used)
+        self.fs.dcache.put(self.ident(), name, value)
+        return True
+
+    def remove_entry(self, name):
+        with self.fs.locks.write(self.ident()):
+            return self._remove_entry(name)
+
+    def _remove_entry(self, name):
+        key = name.encode("utf-8")
+        buckets, live, used = self._header()
+        found, _ = self._find(key, buckets)
+        if found is None:
+            return None
+        k, i, ftype, a, b = found
+        self._put((k, i), self.DELETED, key, ftype, a, b)
+        self._write_header(buckets, live - 1, used)
+        self.fs.dcache.put(self.ident(), name, None)
+        if buckets > 1 and (live - 1) * 4 < used:
+            self.compact()
+        return self._decode(ftype, a, b)
+
+    # Várias entradas de uma vez. Se forem muitas perto do que o diretório
+    # já tem, uma reconstrução só sai mais barato que inserir uma a uma.
+    # Devolve, pra cada uma, se entrou (False = nome já existia).
+    def add_entries(self, entries):
+        keys = [name.encode("utf-8") for name, _ in entries]
+        for (name, _), key in zip(entries, keys):
+            if len(key) > self.NAME_MAX:
+                raise ValueError(f"name too long: '{name}'")
+        with self.fs.locks.write(self.ident()):
+            _, live, _ = self._header()
+            if len(entries) * 4 < live:
+                return [self._add_entry(name, key, value) for (name, value), key in zip(entries, keys)]
+            records = self._records()
+            added = []
+            for name, value in entries:
+                if name in records:
+                    added.append(False)
+                    continue
+                records[name] = self._encode(value)
+                added.append(True)
+            self._rebuild(records)
+            for (name, value), ok in zip(entries, added):
+                if ok:
+                    self.fs.dcache.put(self.ident(), name, value)
+            return added
+
+    # Igual, pra remover: devolve o valor de cada nome, ou None se não tinha
+    def remove_entries(self, names):
+        with self.fs.locks.write(self.ident()):
+            _, live, _ = self._header()
+            if len(names) * 4 < live:
+                return [self._remove_entry(name) for name in names]
+            records = self._records()
+            removed = []
+            for name in names:
+                record = records.pop(name, None)
+                removed.append(None if record is None else self._decode(*record))
+            self._rebuild(records)
+            for name in names:
+                self.fs.dcache.put(self.ident(), name, None)
+            return removed
+
+    def compact(self):
+        # Joga fora as lápides e encolhe a tabela se sobrou espaço demais
+        with self.fs.locks.write(self.ident()):
+            self._rebuild(self._records())
+
+    def set_entry(self, name, value):
+        with self.fs.locks.write(self.ident()):
+            return self._set_entry(name, value)
+
+    def _set_entry(self, name, value):
+        key = name.encode("utf-8")
+        buckets, _, _ = self._header()
+        found, _ = self._find(key, buckets)
+        if found is None:
+            return self.add_entry(name, value)
+        self._put(found[:2], self.LIVE, key, *self._encode(value))
+        self.fs.dcache.put(self.ident(), name, value)
+        return True
+
+    def get_entries(self):
+        with self.fs.locks.read(self.ident()):
+            records = self._records()
+        return {name: self._decode(*rec) for name, rec in records.items()}
+
+    def update_entries(self, entries: dict):
+        with self.fs.locks.write(self.ident()):
+            self._rebuild({name: self._encode(value) for name, value in entries.items()})
+            # Também roda quando o diretório é criado, e o id pode ser de um apagado
+            self.fs.dcache.invalidate_dir(self.ident())
+
+    def write_entries(self, entries: dict):
+        self.update_entries(entries)
+
+    def get_path(self):
+        if self.parent is None:
+            return "/"
+        parts = []
+        node = self
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        return "/" + "/".join(reversed(parts))
+
+
+# A identidade do diretório é o bloco cabeça, que nunca muda (o resize só mexe
+# no rabo da cadeia). Por isso a entrada no pai guarda só o primeiro bloco e
+# alterar um filho não suja o pai. O size só serve pra ler diretório antigo.
 class ChainDirectory(Directory):
     def __init__(self, fs, name, parent=None, first_block=None, size=0):
         self.fs = fs
@@ -22,16 +315,34 @@ class ChainDirectory(Directory):
         self.first_block = first_block
         self.size = size
         if self.first_block is None:
+            # A cabeça sai antes pra o id já valer na criação
+            self.first_block = fs.alloc_block()
             self.write_entries({})
 
-    def _read_entries_raw(self):
+    def ident(self):
+        return self.first_block
+
+    def _block(self, k):
+        return self.fs.chain_block(self.first_block, k)
+
+    def _blocks(self):
+        return iter(self.fs.chain_blocks(self.first_block))
+
+    def _resize(self, num_blocks):
+        self.fs.resize_chain(self.first_block, num_blocks)
+
+    def is_legacy(self):
+        return bytes(self.fs.blocks[self.first_block][:4]) != self.MAGIC
+
+    def _raw_size(self):
+        return self.size
+
+    def _read_raw(self):
         if self.size == 0:
             return b""
         return self.fs.read_chain(self.first_block, self.size)
 
-    def get_entries(self):
-        raw = self._read_entries_raw()
-        text = raw.decode("utf-8")
+    def _parse_legacy(self, text):
         entries = {}
         for line in text.splitlines():
             if not line.strip():
@@ -40,36 +351,12 @@ class ChainDirectory(Directory):
             entries[name] = (ftype, int(first), int(size))
         return entries
 
-    def write_entries(self, entries):
-        lines = [
-            f"{name}:{ftype}:{first}:{size}"
-            for name, (ftype, first, size) in entries.items()
-        ]
-        data = "\n".join(lines).encode("utf-8")
-        if self.first_block is None:
-            self.first_block, self.size = self.fs.write_chain(data)
-        else:
-            self.first_block, self.size = self.fs.rewrite_chain(
-                self.first_block, data
-            )
-        if self.parent:
-            parent_entries = self.parent.get_entries()
-            parent_entries[self.name] = ("directory", self.first_block, self.size)
-            self.parent.write_entries(parent_entries)
-
-    def update_entries(self, entries):
-        self.write_entries(entries)
-
-    def get_path(self):
-        if self.parent is None:
-            return "/"
-        parts = []
-        node = self
-        while node.parent is not None:
-            parts.append(node.name)
-            node = node.parent
-        return "/" + "/".join(reversed(parts))
+    def _encode(self, value):
+        ftype, first, size = value
+        return self.TYPE_CODES[ftype], first, size
 
+    def _decode(self, ftype, first, size):
+        return self.TYPES[ftype], first, size
 
 
 class INodeDirectory(Directory):
@@ -77,46 +364,47 @@ class INodeDirectory(Directory):
         self.name = name
         self.parent = parent
         self.fs = fs
-        self.entries = {}
 
         if inode_idx is not None:
             self.inode_idx = inode_idx
-            self._get_entries()
+            self.inode = fs.inodes[inode_idx]
             return
 
         self.inode_idx = fs.alloc_inode()
-        inode = fs.inodes[self.inode_idx]
-        inode.used = True
-        inode.file_type = "directory"
-        inode.write_bytes(fs, b"")
-
-    def _get_entries(self):
-        inode = self.fs.inodes[self.inode_idx]
-        raw = inode.get_data(self.fs)
-        lines = raw.decode('utf-8').splitlines()
-        for line in lines:
+        self.inode = fs.inodes[self.inode_idx]
+        self.inode.used = True
+        self.inode.file_type = "directory"
+        self.update_entries({})
+
+    def ident(self):
+        return self.inode_idx
+
+    def _block(self, k):
+        return self.inode.block_at(self.fs, k)
+
+    def _blocks(self):
+        return self.inode.iter_blocks(self.fs)
+
+    def _resize(self, num_blocks):
+        self.inode.resize(self.fs, num_blocks)
+
+    def _raw_size(self):
+        return self.inode.size
+
+    def _read_raw(self):
+        return self.inode.get_data(self.fs)
+
+    def _parse_legacy(self, text):
+        entries = {}
+        for line in text.splitlines():
             if not line.strip():
                 continue
             name, idx = line.split(":")
-            self.entries[name] = int(idx)
-
-    def get_entries(self):
-        return self.entries
+            entries[name] = int(idx)
+        return entries
 
-    def update_entries(self, entries: dict):
-        self.entries = entries
-        lines = [f"{name}:{idx}" for name, idx in entries.items()]
-        raw = "\n".join(lines).encode('utf-8')
-        inode = self.fs.inodes[self.inode_idx]
-        inode.update_data(self.fs, raw)
+    def _encode(self, idx):
+        return self.TYPE_CODES[self.fs.inodes[idx].file_type], idx, 0
 
-    def get_path(self):
-        if self.parent is None:
-            return "/"
-        parts = []
-        node = self
-        while node.parent is not None:
-            parts.append(node.name)
-            node = node.parent
-        return "/" + "/".join(reversed(parts))
-    
+    def _decode(self, ftype, idx, _):
+        return idx
@@ -0,0 +1,34 @@
+from blockdevice import BlockDevice
+from chainfilesystem import ChainFileSystem
+from inodefilesystem import INodeFileSystem
+from journal import Journal
+from superblock import Superblock
+
+FILESYSTEMS = {cls.KIND: cls for cls in (INodeFileSystem, ChainFileSystem)}
+
+
+def mkfs(path, fs_class, num_blocks, block_size, alloc_policy="next", cache_size=None,
+         threadsafe=False, dedup=False):
+    """Format the image at *path* and return the mounted filesystem."""
+    fs_class(num_blocks, block_size, alloc_policy, image=path).close()
+    return mount(path, alloc_policy, cache_size, threadsafe, dedup)
+
+
+def mount(path, alloc_policy="next", cache_size=None, threadsafe=False, dedup=False):
+    """Mount an existing image.
+
+    Only the superblock and the journal are read up front. A committed
+    journal record left by a crash is replayed before the filesystem is
+    attached. With *dedup*, new files share identical blocks with the
+    files written since the mount (see dedup.py).
+    """
+    with open(path, "rb") as f:
+        sb = Superblock.unpack_from(f.read(Superblock.FORMAT.size))
+    fs_class = FILESYSTEMS.get(sb.kind)
+    if fs_class is None:
+        raise ValueError(f"Unknown filesystem type: {sb.kind!r}")
+    journaled = sb.journal_blocks > 0
+    device = BlockDevice(sb.num_blocks, sb.block_size, path, private=journaled)
+    if journaled and Journal(device, sb.journal_start, sb.journal_blocks).replay():
+        sb = Superblock.unpack_from(device[0:sb.bitmap_start])
+    return fs_class.mount(device, sb, alloc_policy, cache_size, threadsafe, dedup)
@@ -1,30 +1,230 @@
+import struct
+from array import array
+
 #class File:
 #    def __init__(self, name, content) -> None:
 #        self.name = name
 #        datablob = content.encode('utf-8')
 #        self.inode = INode(name, len(datablob), datablob) 
 
+# Os blocos do arquivo ficam em extents [início, tamanho], que são faixas
+# contíguas do disco. Quando acabam os MAX_EXTENTS o resto vai pra um inode
+# extra encadeado pelo next_inode.
+#
+# O INode não guarda nada: é só uma visão (tabela, índice) do registro dele
+# na tabela do disco, e cada campo é lido e escrito direto lá. Duas visões do
+# mesmo índice veem a mesma coisa. extents devolve uma cópia; pra mudar tem
+# que atribuir a lista inteira de volta.
 class INode:
-    MAX_BLOCKS = 8
-    def __init__(self):
-        self.reset()
+    MAX_EXTENTS = 8
+    __slots__ = ("table", "idx", "word")
+
+    def __init__(self, table, idx):
+        self.table = table
+        self.idx = idx
+        # Primeira palavra de 32 bits do registro na tabela
+        self.word = idx * table.WORDS
 
+    # Zera o registro, menos a geração
     def reset(self):
-        self.used = False
-        self.name = ""
-        self.size = 0
-        self.file_type = ""
-        self.blocks = []
-        self.next_inode = None
+        start = self.word * 4
+        raw = self.table.raw
+        self.table.put(
+            raw, start,
+            bytes(2) + raw[start + 2:start + 4].tobytes() + bytes(self.table.RECORD.size - 4),
+        )
+
+    # Zera próximo, tamanho e extents de uma vez, mantendo usado e tipo
+    def _empty(self):
+        self.table.put(self.table.raw, self.word * 4 + 4, bytes(self.table.RECORD.size - 4))
+
+    @property
+    def used(self):
+        return bool(self.table.raw[self.word * 4])
+
+    @used.setter
+    def used(self, value):
+        self.table.set(self.table.raw, self.word * 4, 1 if value else 0)
+
+    @property
+    def file_type(self):
+        return self.table.TYPES[self.table.raw[self.word * 4 + 1]]
+
+    @file_type.setter
+    def file_type(self, value):
+        self.table.set(self.table.raw, self.word * 4 + 1, self.table.TYPES.index(value))
+
+    # Sobe cada vez que o número é solto (free_inode), pra um arquivo aberto
+    # saber que o inode agora pode ser de outro arquivo. Dá a volta em 65536.
+    @property
+    def generation(self):
+        return self.table.halves[self.word * 2 + 1]
+
+    @generation.setter
+    def generation(self, value):
+        self.table.set(self.table.halves, self.word * 2 + 1, value & 0xFFFF)
+
+    # Vai com +1 no disco, pra tabela zerada já ser uma tabela de inodes vazios
+    @property
+    def next_inode(self):
+        nxt = self.table.words[self.word + 1]
+        return nxt - 1 if nxt else None
+
+    @next_inode.setter
+    def next_inode(self, value):
+        self.table.set(self.table.words, self.word + 1, 0 if value is None else value + 1)
+
+    @property
+    def size(self):
+        return self.table.sizes[self.word // 2 + 1]
+
+    @size.setter
+    def size(self, value):
+        self.table.set(self.table.sizes, self.word // 2 + 1, value)
+
+    @property
+    def extents(self):
+        flat = self.table.words[self.word + 4:self.word + self.table.WORDS].tolist()
+        return [[flat[i], flat[i + 1]] for i in range(0, len(flat), 2) if flat[i + 1]]
+
+    @extents.setter
+    def extents(self, extents):
+        flat = [n for extent in extents for n in extent]
+        flat += [0] * (2 * INode.MAX_EXTENTS - len(flat))
+        self.table.put(self.table.words, self.word + 4, array("I", flat))
 
+    def iter_extents(self, fs):
+        words = self.table.words
+        first = self.word
+        while True:
+            for i in range(first + 4, first + self.table.WORDS, 2):
+                if not words[i + 1]:
+                    break
+                yield words[i], words[i + 1]
+            nxt = words[first + 1]
+            if not nxt:
+                return
+            first = (nxt - 1) * self.table.WORDS
+
+    def iter_blocks(self, fs):
+        for start, length in self.iter_extents(fs):
+            yield from range(start, start + length)
+
+    def block_at(self, fs, k):
+        for start, length in self.iter_extents(fs):
+            if k < length:
+                return start + k
+            k -= length
+        raise IndexError("block index out of range")
+
+    # Faixas (início, n) de blocos contíguos do arquivo a partir do k-ésimo
+    def runs_from(self, fs, k):
+        for start, length in self.iter_extents(fs):
+            if k >= length:
+                k -= length
+                continue
+            yield start + k, length - k
+            k = 0
+
+    # Gera o conteúdo de offset até offset + n (ou até o fim) como
+    # memoryviews direto do buffer do disco, sem copiar: uma por faixa
+    # contígua de no máximo fs.STREAM_BLOCKS blocos (com cache, a faixa é
+    # copiada, então a memória fica nesse limite). A view só vale até a
+    # próxima escrita no arquivo.
+    def iter_views(self, fs, offset=0, n=None):
+        end = self.size if n is None else min(self.size, offset + n)
+        if offset >= end:
+            return
+        k = offset // fs.BLOCK_SIZE
+        pos = k * fs.BLOCK_SIZE
+        step = fs.STREAM_BLOCKS
+        for start, length in self.runs_from(fs, k):
+            for first in range(start, start + length, step):
+                run = memoryview(fs.blocks[first:min(first + step, start + length)])
+                yield run[max(offset - pos, 0):end - pos]
+                pos += len(run)
+                if pos >= end:
+                    return
+
+    def read_at(self, fs, offset, n):
+        end = min(self.size, offset + n)
+        if offset >= end:
+            return b""
+        k = offset // fs.BLOCK_SIZE
+        pos = k * fs.BLOCK_SIZE
+        views = []
+        for start, length in self.runs_from(fs, k):
+            run = fs.blocks[start:start + length]
+            views.append(run[max(offset - pos, 0):end - pos])
+            pos += len(run)
+            if pos >= end:
+                break
+        if len(views) == 1:
+            return bytes(views[0])
+        return b"".join(views)
+
+    def _copy_at(self, fs, offset, data):
+        data = memoryview(data)
+        k = offset // fs.BLOCK_SIZE
+        end = -(-(offset + len(data)) // fs.BLOCK_SIZE)
+        if fs.dedup is not None:
+            # Os blocos saem do índice antes de ver se são compartilhados
+            left = end - k
+            for start, length in self.runs_from(fs, k):
+                if left <= 0:
+                    break
+                fs.dedup.forget(start, min(length, left))
+                left -= length
+        self._unshare(fs, k, end)
+        pos = k * fs.BLOCK_SIZE
+        written = 0
+        for start, length in self.runs_from(fs, k):
+            if written == len(data):
+                break
+            span = length * fs.BLOCK_SIZE
+            lo = offset + written - pos
+            chunk = data[written:written + span - lo]
+            fs.blocks.write(start, chunk, lo)
+            written += len(chunk)
+            pos += span
+
+    # Escreve data em offset mexendo só nos blocos cobertos. Se passar do fim
+    # aloca o que falta no rabo, e o buraco entre o fim antigo e offset vira zero.
+    def write_at(self, fs, offset, data):
+        end = offset + len(data)
+        size = self.size
+        if end > size:
+            have = sum(length for _, length in self.iter_extents(fs))
+            need = -(-end // fs.BLOCK_SIZE)
+            if need > have:
+                self._extend(fs, self._tail(fs), need - have)
+            if offset > size:
+                self._copy_at(fs, size, bytes(offset - size))
+            self.size = end
+        self._copy_at(fs, offset, data)
+        self.used = True
+
+    def truncate(self, fs, size):
+        if size < self.size:
+            self.resize(fs, -(-size // fs.BLOCK_SIZE))
+            self.size = size
+        elif size > self.size:
+            self.write_at(fs, self.size, bytes(size - self.size))
+
+    # Cada extent é um pedaço contíguo do buffer do disco, então só copia
+    # uma vez, no join
     def get_data(self, fs):
-        data = bytearray()
-        inode = self
-        while inode:
-            for blk_idx in inode.blocks:
-                data.extend(fs.blocks[blk_idx])
-            inode = fs.inodes[inode.next_inode] if inode.next_inode is not None else None
-        return bytes(data[: self.size])
+        views = []
+        remaining = self.size
+        for start, length in self.iter_extents(fs):
+            if remaining <= 0:
+                break
+            view = fs.blocks[start:start + length][:remaining]
+            views.append(view)
+            remaining -= len(view)
+        if len(views) == 1:
+            return bytes(views[0])
+        return b"".join(views)
 
     # Do jeito que tá agora ele apaga e reescreve. O que não sei se é massa
     # Solta todo o rabo e escreve
@@ -35,31 +235,259 @@ class INode:
     def free_chain(self, fs):
         inode = self
         while inode:
-            for blk_idx in inode.blocks:
-                fs.free_blocks.add(blk_idx)
-            inode.blocks.clear()
-            inode.size = 0
+            for start, length in inode.extents:
+                fs.free_extent(start, length)
             nxt = inode.next_inode
-            if nxt is not None:
-                fs.free_inodes.add(nxt)
-                fs.inodes[nxt].reset()
-            inode.next_inode = None
+            # Só zera depois de soltar os blocos, senão eles vazam
+            if inode is self:
+                inode._empty()
+            else:
+                fs.free_inode(inode.idx)
             inode = fs.inodes[nxt] if nxt is not None else None
 
-    def write_bytes(self, fs, data: bytes):
-        remaining = memoryview(data)
+    # Mexe só nas palavras do último extent (ou do primeiro livre)
+    def _append_extent(self, start, length):
+        table = self.table
+        words = table.words
+        first = i = self.word + 4
+        end = self.word + table.WORDS
+        while i < end and words[i + 1]:
+            i += 2
+        if i > first and words[i - 2] + words[i - 1] == start:
+            table.set(words, i - 1, words[i - 1] + length)
+            return True
+        if i == end:
+            return False
+        table.put(words, i, array("I", (start, length)))
+        return True
+
+    def _tail(self, fs):
         inode = self
-        while remaining:
-            while len(inode.blocks) < INode.MAX_BLOCKS and remaining:
-                blk_idx = fs.alloc_block()
-                chunk = remaining[:fs.BLOCK_SIZE]
-                fs.blocks[blk_idx][:len(chunk)] = chunk
-                inode.blocks.append(blk_idx)
-                remaining = remaining[len(chunk):]
-            if remaining:
+        while inode.next_inode is not None:
+            inode = fs.inodes[inode.next_inode]
+        return inode
+
+    # Aloca num_blocks depois do último extent de inode, em faixas o mais
+    # longas que o alocador conseguir
+    def _extend(self, fs, inode, num_blocks):
+        runs = fs.alloc_blocks(num_blocks)
+        self._add_runs(fs, inode, runs)
+        return runs
+
+    # Pendura faixas já alocadas depois do último extent de inode
+    def _add_runs(self, fs, inode, runs):
+        for start, length in runs:
+            if not inode._append_extent(start, length):
                 nxt = fs.alloc_inode()
                 inode.next_inode = nxt
                 inode = fs.inodes[nxt]
+                inode.used = True
+                inode._append_extent(start, length)
+
+    # Arquivo novo em cima de faixas que já foram alocadas (importação)
+    def adopt_runs(self, fs, runs, size):
+        self._add_runs(fs, self._tail(fs), runs)
+        self.size = size
+        self.used = True
+
+    # Cópia do cp: other fica com os mesmos blocos deste inode, e cada bloco
+    # ganha mais um dono. Nenhum dado é copiado; quem escrever depois num
+    # bloco compartilhado leva uma cópia só pra ele (_unshare).
+    # Se faltar inode pros extents no meio do caminho, devolve os donos a
+    # mais e os inodes de continuação que other já tinha pegado.
+    def clone_into(self, fs, other):
+        runs = [(start, length) for start, length in self.iter_extents(fs)]
+        shared = []
+        try:
+            for start, length in runs:
+                fs.allocator.share(start, length)
+                shared.append((start, length))
+            other.file_type = self.file_type
+            other.adopt_runs(fs, runs, self.size)
+        except BaseException:
+            for start, length in shared:
+                fs.free_extent(start, length)
+            nxt = other.next_inode
+            while nxt is not None:
+                after = fs.inodes[nxt].next_inode
+                fs.free_inode(nxt)
+                nxt = after
+            raise
+
+    # Antes de escrever nos blocos k0..k1-1 do arquivo: os trechos com bloco
+    # compartilhado vão pra blocos novos só deste arquivo, e os antigos
+    # perdem um dono
+    def _unshare(self, fs, k0, k1):
+        if k0 >= k1 or not fs.allocator.shared:
+            return
+        runs = []
+        changed = False
+        pos = 0
+        for start, length in self.iter_extents(fs):
+            lo, hi = max(k0 - pos, 0), min(k1 - pos, length)
+            pos += length
+            if lo >= hi or not fs.allocator.is_shared(start + lo, hi - lo):
+                runs.append((start, length))
+                continue
+            if lo:
+                runs.append((start, lo))
+            old = start + lo
+            for new, n in fs.alloc_blocks(hi - lo):
+                fs.blocks.write(new, fs.blocks[old:old + n])
+                runs.append((new, n))
+                old += n
+            fs.free_extent(start + lo, hi - lo)
+            if hi < length:
+                runs.append((start + hi, length - hi))
+            changed = True
+        if changed:
+            self._relay(fs, runs)
+
+    # Troca os extents do arquivo por runs, usando os inodes extras que já
+    # tem e alocando ou soltando o que mudar
+    def _relay(self, fs, runs):
+        self.extents = []
+        inode = self
+        for start, length in runs:
+            if inode._append_extent(start, length):
+                continue
+            if inode.next_inode is None:
+                inode.next_inode = fs.alloc_inode()
+            inode = fs.inodes[inode.next_inode]
+            inode.used = True
+            inode.extents = [[start, length]]
+        nxt = inode.next_inode
+        inode.next_inode = None
+        while nxt is not None:
+            after = fs.inodes[nxt].next_inode
+            fs.free_inode(nxt)
+            nxt = after
+
+    # Diferente do update_data, mantém os blocos que já tem e só aloca ou
+    # solta o que passar de num_blocks. O conteúdo dos blocos novos é lixo.
+    def resize(self, fs, num_blocks):
+        inode = self
+        count = 0
+        while True:
+            kept = []
+            for start, length in inode.extents:
+                take = min(length, num_blocks - count)
+                if take:
+                    kept.append([start, take])
+                    count += take
+                if take < length:
+                    fs.free_extent(start + take, length - take)
+            inode.extents = kept
+            if count == num_blocks or inode.next_inode is None:
+                break
+            inode = fs.inodes[inode.next_inode]
+
+        nxt = inode.next_inode
+        if nxt is not None:
+            fs.inodes[nxt].free_chain(fs)
+            fs.free_inode(nxt)
+            inode.next_inode = None
+        self._extend(fs, inode, num_blocks - count)
+
+        self.size = num_blocks * fs.BLOCK_SIZE
+        self.used = True
+
+    def write_bytes(self, fs, data: bytes):
+        if fs.dedup is not None:
+            return self._write_dedup(fs, data)
+        remaining = memoryview(data)
+        num_blocks = -(-len(data) // fs.BLOCK_SIZE)
+        for start, length in self._extend(fs, self._tail(fs), num_blocks):
+            chunk = remaining[:length * fs.BLOCK_SIZE]
+            fs.blocks.write(start, chunk)
+            remaining = remaining[len(chunk):]
 
         self.size = len(data)
         self.used = True
+
+    # write_bytes com dedup: bloco que já existe (noutro arquivo ou antes
+    # neste) ganha mais um dono, o resto é alocado e entra no índice
+    def _write_dedup(self, fs, data):
+        dedup = fs.dedup
+        bs = fs.BLOCK_SIZE
+        data = memoryview(data)
+        blocks = []
+        try:
+            for pos in range(0, len(data), bs):
+                chunk = bytes(data[pos:pos + bs]).ljust(bs, b"\0")
+                digest = dedup.fingerprint(chunk)
+                idx = dedup.find(digest, chunk)
+                if idx is None:
+                    idx = fs.alloc_block()
+                    fs.blocks.write(idx, chunk)
+                    dedup.add(digest, idx)
+                blocks.append(idx)
+        except RuntimeError:
+            for idx in blocks:
+                fs.free_extent(idx)
+            raise
+        dedup.wrote(len(blocks))
+        runs = []
+        for idx in blocks:
+            if runs and sum(runs[-1]) == idx:
+                runs[-1][1] += 1
+            else:
+                runs.append([idx, 1])
+        self._add_runs(fs, self._tail(fs), runs)
+        self.size = len(data)
+        self.used = True
+
+
+# Tabela de inodes guardada no disco como registros de tamanho fixo (usado,
+# tipo, próximo, tamanho e os extents de cada inode, lado a lado), vista em
+# colunas tipadas sobre o buffer do disco, igual à FAT do encadeado (na ordem
+# de bytes da máquina, little-endian como o journal). Não tem objeto por
+# inode: inodes[idx] só cria a visão INode, e toda mudança vai direto pro
+# buffer, com mark antes. Por isso o sync não tem nada pra gravar e a memória
+# não cresce com os inodes usados.
+class InodeTable:
+    TYPES = ("", "file", "directory")
+    # usado, tipo, geração, próximo, tamanho, extents
+    RECORD = struct.Struct(f"<BBHIQ{2 * INode.MAX_EXTENTS}I")
+    WORDS = RECORD.size // 4
+
+    # view é o pedaço do buffer com a tabela, que começa no byte offset do disco
+    def __init__(self, view, offset, count, mark=None):
+        self.offset = offset
+        self.count = count
+        self.mark = mark
+        self.raw = view
+        self.halves = view.cast("H")
+        self.words = view.cast("I")
+        self.sizes = view.cast("Q")
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < self.count:
+            raise IndexError("inode index out of range")
+        return INode(self, idx)
+
+    # Só marca (e escreve) se mudou alguma coisa, então um campo regravado
+    # igual não suja o bloco nem falha num snapshot
+    def set(self, column, i, value):
+        if column[i] != value:
+            if self.mark is not None:
+                self.mark(self.offset + i * column.itemsize, column.itemsize)
+            column[i] = value
+
+    # set de vários itens seguidos de column, a partir do i; data tem que
+    # ser do tipo da coluna (bytes pra raw, array("I") pra words)
+    def put(self, column, i, data):
+        end = i + len(data)
+        if column[i:end] != data:
+            if self.mark is not None:
+                self.mark(self.offset + i * column.itemsize, len(data) * column.itemsize)
+            column[i:end] = data
+
+    def release(self):
+        self.sizes.release()
+        self.words.release()
+        self.halves.release()
+        self.raw.release()
@@ -1,38 +1,186 @@
-from directory import Directory
-from inode import INode
+import codecs
+import threading
+
+import snapshot
+import transfer
+from allocator import BlockAllocator
+from blockcache import BlockCache
+from blockdevice import BlockDevice
+from dcache import DentryCache
+from dedup import DedupIndex
+from directory import Directory, INodeDirectory
+from inode import INode, InodeTable
+from journal import Journal, journaled
+from locks import LockTable, NoLocks
+from openfile import INodeOpenFile
+from superblock import Superblock
 
 
 class INodeFileSystem:
-    def __init__(self, num_blocks, block_size):
-        self.NUM_BLOCKS = num_blocks
-        self.BLOCK_SIZE = block_size
-        self.NUM_INODES = (num_blocks // INode.MAX_BLOCKS) + 16
+    KIND = b"I"
+    # Blocos por memoryview na leitura em stream
+    STREAM_BLOCKS = 64
+
+    def __init__(self, num_blocks, block_size, alloc_policy="next", image=None, cache_size=None,
+                 threadsafe=False, dedup=False):
+        num_inodes = (num_blocks // INode.MAX_EXTENTS) + 16
+        sb = Superblock(
+            self.KIND, block_size, num_blocks, num_inodes,
+            num_inodes * InodeTable.RECORD.size,
+            Journal.size_for(num_blocks) if image else 0,
+        )
+        # Disco novo já vem zerado: bitmaps e tabela vazios sem escrever nada
+        device = BlockDevice(num_blocks, block_size, image, create=True)
+        self._attach(device, sb, alloc_policy, cache_size, threadsafe, dedup)
+        self.allocator.reserve(0, sb.data_start)
+
+        self.root = INodeDirectory(self, "/")
+        self.sb.root = self.root.inode_idx
 
-        self.blocks = [bytearray(block_size) for _ in range(num_blocks)]
-        self.free_blocks = set(range(num_blocks))
+        self.current_dir = self.root
+        self.sync()
+
+    # Monta uma imagem que já existe: só cria as visões sobre o buffer, os
+    # inodes e diretórios são lidos do disco quando alguém precisa
+    @classmethod
+    def mount(cls, device, sb, alloc_policy="next", cache_size=None, threadsafe=False,
+              dedup=False):
+        fs = cls.__new__(cls)
+        fs._attach(device, sb, alloc_policy, cache_size, threadsafe, dedup)
+        fs.root = INodeDirectory(fs, "/", inode_idx=sb.root)
+        fs.current_dir = fs.root
+        return fs
+
+    # Com cache_size os blocos de dado e diretório passam por uma BlockCache
+    # desse tamanho (em blocos); sem, vão direto no disco. Com threadsafe os
+    # diretórios e arquivos ganham travas (locks.py) e dá pra usar de várias
+    # threads; sem, as travas não fazem nada. Com dedup, arquivo novo
+    # reaproveita blocos iguais aos dos escritos desde a montagem (dedup.py).
+    def _attach(self, device, sb, alloc_policy, cache_size=None, threadsafe=False, dedup=False):
+        self.NUM_BLOCKS = sb.num_blocks
+        self.BLOCK_SIZE = sb.block_size
+        self.NUM_INODES = sb.num_inodes
+        self.device = device
+        self.blocks = device if cache_size is None else BlockCache(device, cache_size)
+        table = sb.offset(sb.table_start)
+        self.inodes = InodeTable(
+            device.view[table:table + sb.num_inodes * InodeTable.RECORD.size],
+            table, sb.num_inodes, device.mark,
+        )
+        # Contadores (instrument.py), None quando desligados
+        self.probe = None
+        self._load(sb, alloc_policy, dedup)
+        self.locks = LockTable() if threadsafe else NoLocks()
+        self.session = threading.local()
+        # Só disco montado de imagem com journal tem cópia privada
+        self.journal = None
+        if device.private:
+            self.journal = Journal(
+                device, sb.journal_start, sb.journal_blocks, sb.offset(sb.bitmap_start)
+            )
+
+    # O que é lido do metadado do disco: alocadores e caches
+    def _load(self, sb, alloc_policy, dedup=False):
+        device = self.device
+        self.sb = sb
+        self.allocator = BlockAllocator(
+            sb.num_blocks, alloc_policy, device.buffer,
+            sb.offset(sb.bitmap_start), sb.free_blocks, device.mark, sb.shared_blocks,
+        )
+        self.allocator.probe = self.probe
+        self.inode_allocator = BlockAllocator(
+            sb.num_inodes, "next", device.buffer,
+            sb.offset(sb.inode_bitmap_start), sb.free_inodes, device.mark,
+        )
+        self.dcache = DentryCache()
+        self.dedup = None
+        if dedup:
+            self.dedup = DedupIndex(self)
+            self.allocator.on_free = self.dedup.forget
+
+    # O disco mudou por baixo (rollback de snapshot): lê tudo de novo e
+    # todas as threads voltam pra raiz
+    def _reload(self):
+        # O superbloco pode ocupar mais de um bloco (bloco pequeno)
+        sb = Superblock.unpack_from(self.device[0:self.sb.bitmap_start])
+        self._load(sb, self.allocator.policy, self.dedup is not None)
+        if self.blocks is not self.device:
+            self.blocks.drop()
+        self.root = INodeDirectory(self, "/", inode_idx=self.sb.root)
+        self.session = threading.local()
+
+    # Diretório atual é de cada thread; thread nova começa na raiz
+    @property
+    def current_dir(self):
+        return getattr(self.session, "cwd", None) or self.root
+
+    @current_dir.setter
+    def current_dir(self, dir):
+        self.session.cwd = dir
+
+    def sync(self):
+        with self.locks.tx.write():
+            self._sync()
+
+    def _sync(self):
+        self.sb.free_blocks = len(self.allocator)
+        self.sb.shared_blocks = self.allocator.shared
+        self.sb.free_inodes = len(self.inode_allocator)
+        self.device.mark(0, Superblock.FORMAT.size)
+        self.sb.pack_into(self.device.buffer)
+        if self.blocks is not self.device:
+            self.blocks.writeback()
+        if self.journal is not None:
+            self.journal.commit()
+        else:
+            self.device.flush()
 
-        self.inodes = [INode() for _ in range(self.NUM_INODES)]
-        self.free_inodes = set(range(self.NUM_INODES))
+    def close(self):
+        self.sync()
+        self.inodes.release()
+        self.blocks.close()
 
-        self.root = Directory(self, "/")
+    def alloc_block(self):
+        return self.allocator.alloc_block()
 
-        self.current_dir = self.root
+    def alloc_blocks(self, count):
+        return self.allocator.alloc_blocks(count)
 
-    def alloc_block(self):
-        if not self.free_blocks:
-            raise RuntimeError("No free blocks available")
-        return self.free_blocks.pop()
+    def free_extent(self, start, length=1):
+        self.allocator.free_extent(start, length)
 
     def alloc_inode(self):
-        if not self.free_inodes:
-            raise RuntimeError("No free inodes available")
-        idx = self.free_inodes.pop()
+        with self.inode_allocator.lock:
+            if not len(self.inode_allocator):
+                raise RuntimeError("No free inodes available")
+            idx = self.inode_allocator.alloc_block()
         self.inodes[idx].reset()
         return idx
 
+    # Zera o registro antes de soltar o número: depois de solto, outra
+    # thread pode pegar o mesmo inode e um reset atrasado apagaria o dela.
+    # A geração sobe, pra quem ainda tem o arquivo aberto ver que ele se foi.
+    def free_inode(self, idx):
+        inode = self.inodes[idx]
+        inode.reset()
+        inode.generation += 1
+        self.inode_allocator.free_extent(idx)
+
+    # Com os contadores ligados, conta a profundidade de cada caminho
     def get_dir(self, path: str):
+        if self.probe is None:
+            return self._get_dir(path)
+        began = self.probe.start()
+        dir = self._get_dir(path)
+        depth = sum(part not in ("", ".") for part in path.split("/"))
+        self.probe.stop("path_walk", began, depth)
+        return dir
+
+    def _get_dir(self, path: str):
         if path == "/":
             return self.root
+        if path.startswith(snapshot.ROOT + "/"):
+            return snapshot.get_dir(self, path)
 
         if path.startswith("/"):
             dir = self.root
@@ -50,20 +198,19 @@ class INodeFileSystem:
                     dir = dir.parent
                 continue
 
-            entries = dir.get_entries()
+            inode_idx = dir.lookup(part)
 
-            if part not in entries:
+            if inode_idx is None:
                 # print(f"Directory '{part}' not found.")
                 return None
 
-            inode_idx = entries[part]
             inode = self.inodes[inode_idx]
 
             if inode.file_type != "directory":
                 # print(f"Path error: '{part}' is not a directory")
                 return None
 
-            dir = Directory(name=part, parent=dir, inode_idx=inode_idx, fs=self)
+            dir = INodeDirectory(name=part, parent=dir, inode_idx=inode_idx, fs=self)
 
         return dir
 
@@ -71,8 +218,13 @@ class INodeFileSystem:
         if not args:
             self.current_dir = self.root
             return
-        self.current_dir = self.get_dir(args[0]) or self.current_dir
+        dir = self.get_dir(args[0])
+        if dir is not None and dir.fs is not self:
+            print(f"cd: '{args[0]}': snapshots can only be browsed by path")
+            return
+        self.current_dir = dir or self.current_dir
 
+    @journaled
     def make_directory(self, path):
         if not path:
             print("mkdir: missing operand")
@@ -85,33 +237,36 @@ class INodeFileSystem:
             dirname = name
         else:
             p = name.rpartition("/")
-            dir = self.get_dir(p[0])
+            # "/nome" é na raiz, não no diretório atual
+            dir = self.get_dir(p[0] or p[1])
             if dir is None:
                 return
             dirname = p[-1]
 
-        entries = dir.get_entries()
-        if dirname in entries:
-            print(f"mkdir: '{dirname}' already exists")
+        if len(dirname.encode("utf-8")) > Directory.NAME_MAX:
+            print(f"mkdir: '{dirname}': File name too long")
             return
 
-        new_dir = Directory(self, dirname, parent=dir)
-        entries[dirname] = new_dir.inode_idx
-        dir.update_entries(entries)
+        with self.locks.write(dir.ident()):
+            if dir.lookup(dirname) is not None:
+                print(f"mkdir: '{dirname}' already exists")
+                return
 
+            new_dir = INodeDirectory(self, dirname, parent=dir)
+            dir.add_entry(dirname, new_dir.inode_idx)
+
+    @journaled
     def remove_directory(self, path):
         dir = self.get_dir(path[0])
         if dir is None or dir.parent is None:
             return
-        entries = dir.parent.get_entries()
-        if dir.name in entries:
-            inode_idx = entries.pop(dir.name)
-            inode = self.inodes[inode_idx]
-            inode.free_chain(self)
-            self.free_inodes.add(inode_idx)
-            inode.reset()
-            dir.parent.update_entries(entries)
+        with self.locks.write(dir.parent.ident(), dir.ident()):
+            inode_idx = dir.parent.remove_entry(dir.name)
+            if inode_idx is not None:
+                self.inodes[inode_idx].free_chain(self)
+                self.free_inode(inode_idx)
 
+    @journaled
     def make_file(self, path):
         if len(path) < 2:
             print("mkfile: Not enough arguments")
@@ -124,23 +279,179 @@ class INodeFileSystem:
             fname = name
         else:
             p = name.rpartition("/")
-            dir = self.get_dir(p[0])
+            # "/nome" é na raiz, não no diretório atual
+            dir = self.get_dir(p[0] or p[1])
             if dir is None:
                 return
             fname = p[-1]
 
-        entries = dir.get_entries()
-        if fname in entries:
-            print(f"mkfile: '{fname}' already exists")
+        if len(fname.encode("utf-8")) > Directory.NAME_MAX:
+            print(f"mkfile: '{fname}': File name too long")
             return
 
+        with self.locks.write(dir.ident()):
+            if dir.lookup(fname) is not None:
+                print(f"mkfile: '{fname}' already exists")
+                return
+
+            dir.add_entry(fname, self._new_file(content.encode("utf-8")))
+
+    def _new_file(self, data):
         inode_idx = self.alloc_inode()
         inode = self.inodes[inode_idx]
         inode.file_type = "file"
-        inode.update_data(self, content.encode("utf-8"))
-        entries[fname] = inode_idx
-        dir.update_entries(entries)
+        inode.update_data(self, data)
+        return inode_idx
+
+    def _free_file(self, inode_idx):
+        # Espera quem ainda está lendo o arquivo antes de soltar o inode
+        with self.locks.write(inode_idx):
+            self.inodes[inode_idx].free_chain(self)
+            self.free_inode(inode_idx)
+
+    # Versões em lote do mkfile/mkdir/rm pro Shell.run: tudo no mesmo
+    # diretório, com uma atualização só na tabela de entradas. Devolvem uma
+    # mensagem de erro (ou None) por item.
+    @journaled
+    def make_files(self, dir_path, items):
+        return self._make_entries(
+            dir_path, items, "mkfile",
+            lambda dir, name, data: self._new_file(data.encode("utf-8")),
+        )
+
+    @journaled
+    def make_directories(self, dir_path, names):
+        return self._make_entries(
+            dir_path, [(name, None) for name in names], "mkdir",
+            lambda dir, name, _: INodeDirectory(self, name, parent=dir).inode_idx,
+        )
+
+    def _make_entries(self, dir_path, items, cmd, create):
+        dir = self.get_dir(dir_path)
+        if dir is None:
+            return [f"{cmd}: cannot access '{dir_path}': No such directory"] * len(items)
+        errors, entries, seen = [], [], set()
+        with self.locks.write(dir.ident()):
+            for name, arg in items:
+                if len(name.encode("utf-8")) > Directory.NAME_MAX:
+                    errors.append(f"{cmd}: '{name}': File name too long")
+                elif name in seen or dir.lookup(name) is not None:
+                    errors.append(f"{cmd}: '{name}' already exists")
+                else:
+                    try:
+                        entries.append((name, create(dir, name, arg)))
+                    except RuntimeError as e:
+                        # Acabou o espaço: o que já foi criado fica
+                        errors.append(f"{cmd}: {e}")
+                        continue
+                    seen.add(name)
+                    errors.append(None)
+            dir.add_entries(entries)
+        return errors
+
+    # Cópia em lote de/para o host, pasta ou tar (transfer.py)
+    @journaled
+    def import_tree(self, host_path, fs_path=""):
+        return transfer.import_tree(self, host_path, fs_path)
+
+    @journaled
+    def import_tar(self, source, fs_path=""):
+        return transfer.import_tar(self, source, fs_path)
+
+    def export_tree(self, fs_path, host_path):
+        return transfer.export_tree(self, fs_path, host_path)
+
+    def export_tar(self, fs_path, target):
+        return transfer.export_tar(self, fs_path, target)
+
+    # Snapshots do filesystem inteiro (snapshot.py)
+    def snapshot(self, name):
+        snapshot.take(self, name)
+
+    def list_snapshots(self):
+        return snapshot.list_snapshots(self)
+
+    def delete_snapshot(self, name):
+        snapshot.delete(self, name)
+
+    def rollback(self, name):
+        snapshot.rollback(self, name)
+
+    # cp [-r] origem destino, sem copiar dado (blocos compartilhados)
+    @journaled
+    def copy(self, args):
+        recursive = "-r" in args
+        args = [arg for arg in args if arg != "-r"]
+        if len(args) < 2:
+            print("cp: Not enough arguments")
+            return
+        try:
+            transfer.copy_tree(self, args[0], args[1], recursive)
+        except (OSError, ValueError, RuntimeError) as e:
+            print(f"cp: {e}")
+
+    # Ganchos do transfer.py
+    def _file_blocks(self, size):
+        return -(-size // self.BLOCK_SIZE)
 
+    def _new_file_at(self, runs, size):
+        inode_idx = self.alloc_inode()
+        inode = self.inodes[inode_idx]
+        inode.file_type = "file"
+        try:
+            inode.adopt_runs(self, runs, size)
+        except RuntimeError:
+            # Acabaram os inodes extras: solta os inodes, as faixas ficam
+            # com quem chamou
+            nxt = inode.next_inode
+            while nxt is not None:
+                after = self.inodes[nxt].next_inode
+                self.free_inode(nxt)
+                nxt = after
+            self.free_inode(inode_idx)
+            raise
+        return inode_idx
+
+    def _new_directory(self, parent, name):
+        dir = INodeDirectory(self, name, parent=parent)
+        return dir.inode_idx, dir
+
+    def _child_dir(self, parent, name, inode_idx):
+        if self.inodes[inode_idx].file_type != "directory":
+            return None
+        return INodeDirectory(self, name, parent=parent, inode_idx=inode_idx)
+
+    def _open_entry(self, parent, name, inode_idx):
+        return INodeOpenFile(self, inode_idx)
+
+    def _clone_file(self, parent, name, inode_idx):
+        with self.locks.read(inode_idx):
+            # O rm pode ter passado entre o lookup e a trava
+            if parent.lookup(name) != inode_idx:
+                raise FileNotFoundError(f"No such file: '{name}'")
+            copy_idx = self.alloc_inode()
+            try:
+                self.inodes[inode_idx].clone_into(self, self.inodes[copy_idx])
+            except BaseException:
+                self.free_inode(copy_idx)
+                raise
+        return copy_idx
+
+    @journaled
+    def remove_files(self, dir_path, names):
+        dir = self.get_dir(dir_path)
+        if dir is None:
+            return [f"rm: cannot access '{dir_path}': No such directory"] * len(names)
+        errors = []
+        for name, inode_idx in zip(names, dir.remove_entries(names)):
+            if inode_idx is None:
+                errors.append(f"rm: '{name}' not found")
+                continue
+            self._free_file(inode_idx)
+            errors.append(None)
+        return errors
+
+    @journaled
     def remove_file(self, path):
         if not path:
             print("rm: Not enough arguments")
@@ -153,20 +464,17 @@ class INodeFileSystem:
             fname = name
         else:
             p = name.rpartition("/")
-            dir = self.get_dir(p[0])
+            # "/nome" é na raiz, não no diretório atual
+            dir = self.get_dir(p[0] or p[1])
             if dir is None:
                 return
             fname = p[-1]
 
-        entries = dir.get_entries()
-        if fname in entries:
-            inode_idx = entries.pop(fname)
-            inode = self.inodes[inode_idx]
-            inode.free_chain(self)
-            self.free_inodes.add(inode_idx)
-            inode.reset()
-            dir.update_entries(entries)
+        inode_idx = dir.remove_entry(fname)
+        if inode_idx is not None:
+            self._free_file(inode_idx)
 
+    @journaled
     def move(self, args):
         if len(args) < 2:
             print("mv: Not enough arguments")
@@ -176,19 +484,17 @@ class INodeFileSystem:
 
         # pega o path do source e dps o inode
         p_src = src.rpartition("/")
-        src_dir = self.get_dir(p_src[0]) if p_src[0] else self.current_dir
+        src_dir = self.get_dir(p_src[0] or p_src[1]) if p_src[1] else self.current_dir
         if src_dir is None:
             print(f"mv: source directory '{p_src[0]}' not found")
             return
         src_name = p_src[-1]
 
-        src_entries = src_dir.get_entries()
-        if src_name not in src_entries:
+        inode_idx = src_dir.lookup(src_name)
+        if inode_idx is None:
             print(f"mv: source '{src_name}' not found")
             return
 
-        inode_idx = src_entries[src_name]
-
         # pega o path do dst, dst_candidate pode ser um arquivo, ou um path
         dst_dir_candidate = self.get_dir(dst)
         if dst_dir_candidate is not None:
@@ -197,41 +503,96 @@ class INodeFileSystem:
         else:
             dst = dst.rstrip("/")
             p_dst = dst.rpartition("/")
-            dst_dir = self.get_dir(p_dst[0]) if p_dst[0] else self.current_dir
+            dst_dir = self.get_dir(p_dst[0] or p_dst[1]) if p_dst[1] else self.current_dir
             if dst_dir is None:
                 print(f"mv: destination directory '{p_dst[0]}' not found")
                 return
             dst_name = p_dst[-1] or src_name
 
-        dst_entries = dst_dir.get_entries()
-        if dst_name in dst_entries:
-            print(f"mv: destination '{dst_name}' already exists")
+        if len(dst_name.encode("utf-8")) > Directory.NAME_MAX:
+            print(f"mv: '{dst_name}': File name too long")
             return
 
-        # mantem o tal do inode
-        del src_entries[src_name]
-        src_dir.update_entries(src_entries)
+        with self.locks.write(src_dir.ident(), dst_dir.ident()):
+            # Confere de novo segurando as travas
+            inode_idx = src_dir.lookup(src_name)
+            if inode_idx is None:
+                print(f"mv: source '{src_name}' not found")
+                return
+            if dst_dir.lookup(dst_name) is not None:
+                print(f"mv: destination '{dst_name}' already exists")
+                return
 
-        dst_entries[dst_name] = inode_idx
-        dst_dir.update_entries(dst_entries)
+            # mantem o tal do inode; entra no destino antes de sair da origem,
+            # igual ao encadeado
+            dst_dir.add_entry(dst_name, inode_idx)
+            src_dir.remove_entry(src_name)
 
+    # Imprime em pedaços, sem juntar o arquivo inteiro na memória
     def cat(self, path):
-        data = self._cat(path)
-        if data:
-            print(data.decode("utf-8"))
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        printed = False
+        for view in self._cat_views(path) or ():
+            print(decoder.decode(view), end="")
+            printed = True
+        if printed:
+            print(decoder.decode(b"", final=True))
 
     def _cat(self, path):
+        views = self._cat_views(path)
+        return None if views is None else b"".join(views)
+
+    # Gerador com o conteúdo do arquivo, ou None se ele não existe
+    def _cat_views(self, path):
         p = path[0].rpartition("/")
-        dir = self.get_dir(p[0])
+        dir = self.get_dir(p[0] or p[1])
         if dir is None:
-            return
-        entries = dir.get_entries()
-        if p[-1] not in entries:
+            return None
+        inode_idx = dir.lookup(p[-1])
+        if inode_idx is None:
             print(f"cat: '{p[-1]}' not found")
+            return None
+        return dir.fs._locked_views(dir, p[-1], inode_idx)
+
+    def _locked_views(self, dir, name, inode_idx):
+        with self.locks.read(inode_idx):
+            # O rm pode ter passado entre o lookup e a trava
+            if dir.lookup(name) != inode_idx:
+                print(f"cat: '{name}' not found")
+                return
+            yield from self.inodes[inode_idx].iter_views(self)
+
+    def open(self, path, create=False):
+        if path.startswith(snapshot.ROOT + "/"):
+            return snapshot.open_file(self, path, create)
+        p = path.rpartition("/")
+        dir = self.get_dir(p[0] or p[1])
+        if dir is None:
+            raise FileNotFoundError(f"No such directory: '{p[0]}'")
+        with self.locks.write(dir.ident()):
+            inode_idx = dir.lookup(p[-1])
+            if inode_idx is None:
+                if not create:
+                    raise FileNotFoundError(f"No such file: '{path}'")
+                inode_idx = self._new_file(b"")
+                dir.add_entry(p[-1], inode_idx)
+                return INodeOpenFile(self, inode_idx)
+        if self.inodes[inode_idx].file_type == "directory":
+            raise IsADirectoryError(f"Is a directory: '{path}'")
+        return INodeOpenFile(self, inode_idx)
+
+    @journaled
+    def append_file(self, args):
+        if len(args) < 2:
+            print("append: Not enough arguments")
             return
-        inode_idx = entries[p[-1]]
-        data = self.inodes[inode_idx].get_data(self)
-        return data
+        try:
+            f = self.open(args[0], create=True)
+        except (OSError, ValueError) as e:
+            print(f"append: {e}")
+            return
+        f.append(" ".join(args[1:]).encode("utf-8"))
+        f.close()
 
     def list_directory(self, path=None):
         dir = self.current_dir if not path else self.get_dir(path[0])
@@ -243,7 +604,7 @@ class INodeFileSystem:
         string = ""
         for name in sorted(entries.keys()):
             inode_idx = entries[name]
-            inode = self.inodes[inode_idx]
+            inode = dir.fs.inodes[inode_idx]
             if inode.file_type == "file":
                 string += f"\033[32m{name}\033[0m "
             if inode.file_type == "directory":
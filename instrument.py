@@ -0,0 +1,110 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Contadores de desempenho, que só existem quando alguém liga (stats on no
+# shell, --instrument no benchmark). Desligado, fs.probe e o probe do disco
+# (ou da cache) e do alocador são None, e cada ponto de medida custa só um
+# "is not None". Ligado, cada ponto soma no contador dele as chamadas, a
+# quantidade (blocos, entradas, profundidade) e o tempo, na conta do comando
+# do shell que está rodando na thread ("-" fora de comando).
+#
+#   block_read, block_write  blocos lidos e escritos em fs.blocks
+#   alloc, free              blocos alocados e donos soltos no alocador
+#   dir_parse, dir_rewrite   entradas lidas da tabela inteira de um diretório
+#                            e gravadas numa reconstrução dela
+#   path_walk                componentes andados num get_dir
+#   command                  o comando inteiro
+class Probe:
+    start = staticmethod(time.perf_counter)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # comando -> contador -> [chamadas, quantidade, segundos, maior quantidade]
+        self.commands = {}
+
+    def add(self, name, amount=1, seconds=0.0):
+        command = getattr(self.local, "command", "-")
+        with self.lock:
+            counters = self.commands.setdefault(command, {})
+            c = counters.get(name)
+            if c is None:
+                counters[name] = [1, amount, seconds, amount]
+            else:
+                c[0] += 1
+                c[1] += amount
+                c[2] += seconds
+                if amount > c[3]:
+                    c[3] = amount
+
+    # start vem do self.start() de antes da operação
+    def stop(self, name, start, amount=1):
+        self.add(name, amount, time.perf_counter() - start)
+
+    # O que rodar dentro conta pro comando name
+    @contextmanager
+    def command(self, name):
+        outer = getattr(self.local, "command", "-")
+        self.local.command = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stop("command", start)
+            self.local.command = outer
+
+    def reset(self):
+        with self.lock:
+            self.commands = {}
+
+    def dump(self):
+        """Counters as plain dicts: ``{"totals": {...}, "commands": {...}}``.
+
+        Each counter has ``calls``, ``amount``, ``seconds`` and ``max``
+        (the largest amount of a single call).
+        """
+        with self.lock:
+            commands = {
+                command: {name: list(c) for name, c in counters.items()}
+                for command, counters in self.commands.items()
+            }
+        totals = {}
+        for counters in commands.values():
+            for name, (calls, amount, seconds, most) in counters.items():
+                if name == "command":
+                    continue
+                t = totals.setdefault(name, [0, 0, 0.0, 0])
+                t[0] += calls
+                t[1] += amount
+                t[2] += seconds
+                t[3] = max(t[3], most)
+
+        def fields(c):
+            return {"calls": c[0], "amount": c[1], "seconds": c[2], "max": c[3]}
+        return {
+            "totals": {name: fields(c) for name, c in sorted(totals.items())},
+            "commands": {
+                command: {name: fields(c) for name, c in sorted(counters.items())}
+                for command, counters in sorted(commands.items())
+            },
+        }
+
+
+def _attach(fs, probe):
+    fs.probe = probe
+    fs.blocks.probe = probe
+    fs.allocator.probe = probe
+
+
+def enable(fs):
+    """Turn the counters of *fs* on (keeping the ones it already has) and return them."""
+    probe = fs.probe or Probe()
+    _attach(fs, probe)
+    return probe
+
+
+def disable(fs):
+    """Turn the counters of *fs* off; nothing is measured afterwards."""
+    _attach(fs, None)
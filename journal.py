@@ -0,0 +1,191 @@
+import os
+import struct
+import threading
+import warnings
+import zlib
+from array import array
+from functools import wraps
+
+
+# Journal de redo numa região fixa da imagem. O disco montado é cópia privada
+# (BlockDevice com private=True), então nenhuma mudança chega no arquivo antes
+# do commit. No commit vai um registro só com a lista de blocos sujos e a
+# imagem de cada um, com crc, e um fsync; depois os blocos são gravados no
+# lugar e o registro é apagado. Se cair no meio, o mount reaplica o registro
+# (se o crc bate) ou joga fora (se não bate, o commit nunca terminou). A
+# recuperação só lê o journal, não importa o tamanho do disco.
+#
+# Cada comando que mexe em metadado (@journaled) é uma transação, e várias
+# vão juntas no mesmo commit: ele só acontece no sync, a cada GROUP_SIZE
+# transações ou quando os blocos sujos passam da metade do journal. Como o
+# commit só cai entre comandos, um mv nunca fica pela metade no disco.
+#
+# Bloco de dado que está livre no bitmap já gravado no arquivo não entra no
+# registro (modo ordered, como o ext4): nada do que está no disco aponta pra
+# ele, então ele é gravado no lugar antes do registro, e se cair no meio é só
+# lixo num bloco livre. Assim escrever um arquivo novo grande não enche o
+# journal. No registro vai o metadado e a reescrita de bloco em uso. Se mesmo
+# assim não couber, o grupo é gravado direto no lugar e sem garantia, mas com
+# um RuntimeWarning e contado em stats()["unprotected"].
+class Journal:
+    MAGIC = b"TFSJ"
+    # magic, sequência, número de blocos, crc
+    HEADER = struct.Struct("<4sQII")
+    GROUP_SIZE = 64
+
+    # bitmap: offset em bytes do bitmap de blocos (um byte por bloco); sem
+    # ele tudo vai pro registro
+    def __init__(self, device, start, num_blocks, bitmap=None):
+        self.device = device
+        self.start = start
+        self.num_blocks = num_blocks
+        self.bitmap = bitmap
+        self.seq = 0
+        self.pending = 0
+        self.commits = 0
+        self.logged = 0
+        self.ordered = 0
+        self.unprotected = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def size_for(num_blocks):
+        return max(16, num_blocks // 32)
+
+    # Blocos que um registro com count imagens ocupa no journal
+    def _record_blocks(self, count):
+        bs = self.device.block_size
+        return -(-(self.HEADER.size + 4 * count) // bs) + count
+
+    # Conta uma transação terminada e diz se já é hora do commit
+    def end_transaction(self, blocks):
+        with self.lock:
+            self.pending += 1
+            pending = self.pending
+        dirty = len(self.device.dirty)
+        if blocks is not self.device:
+            dirty += len(blocks.dirty)
+        return (
+            pending >= self.GROUP_SIZE
+            or self._record_blocks(dirty) > self.num_blocks // 2
+        )
+
+    # Blocos de dado sujos que estão livres no bitmap do arquivo (o do último
+    # commit), em ordem
+    def _unreferenced(self, dirty):
+        data_start = self.start + self.num_blocks
+        blocks = [idx for idx in dirty if idx >= data_start]
+        if self.bitmap is None or not blocks:
+            return []
+        lo, hi = blocks[0], blocks[-1]
+        refs = os.pread(self.device.file.fileno(), hi - lo + 1, self.bitmap + lo)
+        return [idx for idx in blocks if idx - lo >= len(refs) or not refs[idx - lo]]
+
+    def commit(self):
+        self.pending = 0
+        dirty = sorted(self.device.dirty)
+        if not dirty:
+            return
+        free = self._unreferenced(dirty)
+        if free:
+            # Dado primeiro: tem que estar no disco antes do registro que
+            # aponta pra ele
+            self.device.flush(free)
+            self.ordered += len(free)
+            dirty = sorted(self.device.dirty)
+            if not dirty:
+                return
+        if self._record_blocks(len(dirty)) > self.num_blocks:
+            # Não cabe no journal: vai direto pro lugar, sem garantia
+            warnings.warn(
+                f"journal: {len(dirty)} blocks do not fit in {self.num_blocks}; "
+                "written in place without atomicity",
+                RuntimeWarning,
+                stacklevel=2,
+            )
+            self.unprotected += len(dirty)
+            self.device.flush()
+            return
+        bs = self.device.block_size
+        numbers = array("I", dirty).tobytes()
+        images = b"".join(self.device[idx] for idx in dirty)
+        self.seq += 1
+        header = self.HEADER.pack(
+            self.MAGIC, self.seq, len(dirty), zlib.crc32(images, zlib.crc32(numbers))
+        )
+        desc = self._record_blocks(len(dirty)) - len(dirty)
+        self.device.persist(self.start, (header + numbers).ljust(desc * bs, b"\0") + images)
+        self.device.fsync()
+        self.device.flush()
+        self._clear()
+        self.commits += 1
+        self.logged += len(dirty)
+
+    def _clear(self):
+        self.device.persist(self.start, bytes(self.device.block_size))
+        self.device.fsync()
+
+    # Reaplica o último registro, se tiver um completo. Devolve quantos
+    # blocos foram regravados.
+    def replay(self):
+        bs = self.device.block_size
+        magic, seq, count, crc = self.HEADER.unpack_from(self.device[self.start])
+        if magic != self.MAGIC:
+            return 0
+        desc = self._record_blocks(count) - count
+        if desc + count > self.num_blocks:
+            self._clear()
+            return 0
+        record = self.device[self.start:self.start + desc + count]
+        numbers = record[self.HEADER.size:self.HEADER.size + 4 * count]
+        images = record[desc * bs:]
+        if zlib.crc32(images, zlib.crc32(numbers)) != crc:
+            self._clear()
+            return 0
+        for i, idx in enumerate(array("I", bytes(numbers))):
+            self.device.write(idx, images[i * bs:(i + 1) * bs])
+        self.device.flush()
+        self._clear()
+        self.seq = seq
+        return count
+
+    def stats(self):
+        return {
+            "size": self.num_blocks,
+            "pending": self.pending,
+            "commits": self.commits,
+            "logged_blocks": self.logged,
+            "ordered_blocks": self.ordered,
+            "unprotected": self.unprotected,
+        }
+
+
+# Marca um comando do filesystem como uma transação do journal. O comando
+# roda com a leitura de fs.locks.tx, e o sync (escrita) espera ele acabar.
+# fs.session.tx conta as transações abertas na thread: quem muda o
+# filesystem não enxerga os snapshots, que são só leitura.
+def journaled(method):
+    @wraps(method)
+    def wrapper(fs, *args, **kwargs):
+        session = fs.session
+        depth = getattr(session, "tx", 0)
+        session.tx = depth + 1
+        try:
+            with fs.locks.tx.read():
+                return method(fs, *args, **kwargs)
+        finally:
+            session.tx = depth
+            if not depth:
+                end_write(fs)
+    return wrapper
+
+
+# Fecha uma transação fora de comando (pwrite, append e truncate de um
+# OpenFile): sem isso os blocos sujos dos handles só iam pro disco no
+# próximo comando. Dentro de um @journaled não faz nada, quem conta é ele.
+def end_write(fs):
+    journal = fs.journal
+    if getattr(fs.session, "tx", 0) or journal is None:
+        return
+    if journal.end_transaction(fs.blocks):
+        fs.sync()
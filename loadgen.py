@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+
+class Client:
+    """One connection to server.py, sending a command and waiting for its status line."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=7070, path=None):
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def call(self, line):
+        """Send *line* and return ``(output lines, status line)``."""
+        self.writer.write(line.encode("utf-8") + b"\n")
+        await self.writer.drain()
+        out = []
+        while True:
+            reply = (await self.reader.readline()).decode("utf-8")
+            if not reply:
+                raise ConnectionError("server closed the connection")
+            reply = reply.rstrip("\n")
+            if reply.startswith("| "):
+                out.append(reply[2:])
+            else:
+                return out, reply
+
+    async def close(self):
+        self.writer.write(b"exit\n")
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def worker(cid, ops, payload, latencies, errors, connect):
+    client = await Client.connect(**connect)
+    await client.call(f"mkdir /c{cid}")
+    await client.call(f"cd /c{cid}")
+    for i in range(ops):
+        for line in (
+            f"mkfile f{i} {payload}",
+            f"cat f{i}",
+            f"append f{i} {payload}",
+            "ls",
+            f"rm f{i}",
+        ):
+            start = time.perf_counter()
+            _, status = await client.call(line)
+            latencies.append(time.perf_counter() - start)
+            if not status.startswith("OK"):
+                errors.append((line, status))
+    await client.close()
+
+
+async def run(clients, ops, payload_size, connect):
+    latencies, errors = [], []
+    payload = "x" * payload_size
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        worker(cid, ops, payload, latencies, errors, connect) for cid in range(clients)
+    ))
+    elapsed = time.perf_counter() - start
+    cuts = statistics.quantiles(latencies, n=100)
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": cuts[49] * 1000,
+        "p99_ms": cuts[98] * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load generator for server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7070)
+    parser.add_argument("--unix", metavar="PATH")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=100, help="file cycles per client")
+    parser.add_argument("--payload", type=int, default=64, help="bytes per mkfile/append")
+    args = parser.parse_args()
+
+    connect = {"host": args.host, "port": args.port, "path": args.unix}
+    res = asyncio.run(run(args.clients, args.ops, args.payload, connect))
+    print(f"{res['requests']} requests in {res['elapsed']:.2f}s, {res['errors']} errors")
+    print(f"throughput: {res['throughput']:.0f} req/s")
+    print(f"latency: p50 {res['p50_ms']:.2f} ms, p99 {res['p99_ms']:.2f} ms")
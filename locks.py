@@ -0,0 +1,119 @@
+import threading
+from contextlib import contextmanager, nullcontext
+
+
+# Trava de leitura/escrita. Vários leitores juntos ou um escritor só. Quem
+# já tem a escrita pode pegar de novo (escrita ou leitura) sem travar, e
+# leitor pode pegar leitura de novo; só não dá pra subir de leitura pra
+# escrita. Não dá preferência pro escritor, então leitura aninhada nunca
+# trava.
+class RWLock:
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = None
+        self.depth = 0
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        with self.cond:
+            if self.writer == me:
+                self.depth += 1
+                return
+            while self.writer is not None:
+                self.cond.wait()
+            self.readers += 1
+
+    def release_read(self):
+        with self.cond:
+            if self.writer == threading.get_ident():
+                self.depth -= 1
+                return
+            self.readers -= 1
+            if not self.readers:
+                self.cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self.cond:
+            if self.writer == me:
+                self.depth += 1
+                return
+            while self.writer is not None or self.readers:
+                self.cond.wait()
+            self.writer = me
+            self.depth = 1
+
+    def release_write(self):
+        with self.cond:
+            self.depth -= 1
+            if not self.depth:
+                self.writer = None
+                self.cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+# Uma RWLock por diretório/arquivo, pelo id (inode ou bloco cabeça), criada
+# na primeira vez que alguém pede. tx é a trava do filesystem inteiro: os
+# comandos pegam leitura e o sync pega escrita, pra commit nunca cair no meio
+# de um comando.
+#
+# Ordem pra não dar deadlock: tx, depois arquivo, depois diretórios (vários
+# de uma vez vão em ordem de id, pelo write). Quem segura um arquivo pode
+# pegar a trava do diretório pai: a leitura confere o nome com lookup e o
+# handle do encadeado grava o tamanho novo na entrada. O contrário nunca: o
+# rm tira a entrada, solta o diretório e só então espera o arquivo pra
+# soltar os blocos.
+class LockTable:
+    def __init__(self):
+        self.locks = {}
+        self.tx = RWLock()
+
+    def get(self, key):
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks.setdefault(key, RWLock())
+        return lock
+
+    def read(self, key):
+        return self.get(key).read()
+
+    @contextmanager
+    def write(self, *keys):
+        locks = [self.get(key) for key in sorted(set(keys))]
+        for lock in locks:
+            lock.acquire_write()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release_write()
+
+
+# Mesmo jeito da LockTable, mas não trava nada (modo de uma thread só)
+class NoLocks:
+    NULL = nullcontext()
+
+    def __init__(self):
+        self.tx = self
+
+    def read(self, *keys):
+        return self.NULL
+
+    def write(self, *keys):
+        return self.NULL
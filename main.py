@@ -1,7 +1,9 @@
 from shell import Shell
 from inodefilesystem import INodeFileSystem
 from chainfilesystem import ChainFileSystem
-from sys import argv
+from image import mkfs, mount, FILESYSTEMS
+from sys import argv, stdin
+import os
 
 types = {
     'i': {
@@ -14,18 +16,55 @@ types = {
     }
 }
 
+# Blocos em cache quando roda em cima de um arquivo de imagem
+CACHE_SIZE = 256
+
 types_message = "Types:\n'i': i-node\n'l': linked list"
 
+# Roda um script (arquivo, ou "-" pra stdin) sem o prompt: só mostra os
+# comandos que falharam e um resumo no fim
+def run_script(shell, path):
+    if path == "-":
+        results = shell.run_script(stdin)
+    else:
+        with open(path) as f:
+            results = shell.run_script(f)
+    failed = [(number, out) for number, ok, out in results if not ok]
+    for number, out in failed:
+        print(f"line {number}: {out}")
+    print(f"{len(results)} commands, {len(failed)} failed")
+    shell.fs.close()
+    return 1 if failed else 0
+
 if __name__ == "__main__":
+    script = None
+    dedup = "--dedup" in argv
+    if dedup:
+        argv.remove("--dedup")
+    if "--script" in argv[1:-1]:
+        i = argv.index("--script")
+        script = argv[i + 1]
+        del argv[i:i + 2]
     if len(argv) < 2:
-        print(f"Usage: {argv[0]} <type>\n{types_message}")
+        print(f"Usage: {argv[0]} <type> [image] [--script FILE|-] [--dedup]\n{types_message}")
         exit(1)
     type_selected_arg = argv[1]
     if type_selected_arg not in types:
         print(f"Type '{type_selected_arg}' not exist\n{types_message}") 
         exit(2)
     type_selected = types[type_selected_arg]
-    print(f"{type_selected["name"]} selected!")
-    fs = type_selected["cls"](1024, 512)
+    if len(argv) > 2 and os.path.exists(argv[2]):
+        fs = mount(argv[2], cache_size=CACHE_SIZE, dedup=dedup)
+        if FILESYSTEMS[fs.sb.kind] is not type_selected["cls"]:
+            print(f"Image '{argv[2]}' has a different type, mounting it anyway")
+        print(f"{argv[2]} mounted!")
+    elif len(argv) > 2:
+        fs = mkfs(argv[2], type_selected["cls"], 1024, 512, cache_size=CACHE_SIZE, dedup=dedup)
+        print(f"{type_selected["name"]} created at {argv[2]}!")
+    else:
+        print(f"{type_selected["name"]} selected!")
+        fs = type_selected["cls"](1024, 512, dedup=dedup)
     shell = Shell(fs)
+    if script is not None:
+        exit(run_script(shell, script))
     shell.start()
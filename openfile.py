@@ -0,0 +1,182 @@
+import errno
+import os
+
+from journal import end_write
+
+
+# Arquivo aberto, com posição própria. read/write andam com a posição e
+# pread/pwrite leem e escrevem em qualquer offset sem mexer nela. Todas as
+# operações só tocam os blocos do pedaço pedido. Leitura pega a trava de
+# leitura do arquivo e escrita a de escrita (mais a leitura de fs.locks.tx,
+# pra não cair no meio de um commit). Cada escrita fora de comando conta como
+# uma transação do journal. A posição é de quem abriu, não é compartilhada
+# entre threads.
+class OpenFile:
+    def __init__(self, fs):
+        self.fs = fs
+        self.pos = 0
+
+    # Ganchos de cada backend
+    def ident(self):
+        raise NotImplementedError
+    def size(self):
+        raise NotImplementedError
+    def _read_at(self, offset, n):
+        raise NotImplementedError
+    def _views(self, offset, n):
+        raise NotImplementedError
+    def _write_at(self, offset, data):
+        raise NotImplementedError
+    def _truncate(self, size):
+        raise NotImplementedError
+
+    def pread(self, offset, n):
+        with self.fs.locks.read(self.ident()):
+            return self._read_at(offset, n)
+
+    # Lê de offset em diante (n bytes, ou até o fim) sem copiar: gera
+    # memoryviews dos blocos, no máximo STREAM_BLOCKS por vez. Segura a trava
+    # de leitura até o gerador acabar, então consuma (ou feche) antes de
+    # escrever no mesmo arquivo.
+    def stream(self, offset=0, n=None):
+        with self.fs.locks.read(self.ident()):
+            yield from self._views(offset, n)
+
+    def pwrite(self, offset, data: bytes):
+        if offset < 0:
+            raise ValueError("negative offset")
+        with self.fs.locks.tx.read(), self.fs.locks.write(self.ident()):
+            self._write_at(offset, data)
+        end_write(self.fs)
+        return len(data)
+
+    def read(self, n=-1):
+        # O tamanho é lido já com a trava, senão um truncate no meio deixa a
+        # conta errada
+        with self.fs.locks.read(self.ident()):
+            if n < 0:
+                n = max(self.size() - self.pos, 0)
+            data = self._read_at(self.pos, n)
+        self.pos += len(data)
+        return data
+
+    def write(self, data: bytes):
+        self.pwrite(self.pos, data)
+        self.pos += len(data)
+        return len(data)
+
+    def append(self, data: bytes):
+        # O fim é lido já com a trava, senão dois appends caem no mesmo lugar
+        with self.fs.locks.tx.read(), self.fs.locks.write(self.ident()):
+            self._write_at(self.size(), data)
+            self.pos = self.size()
+        end_write(self.fs)
+        return len(data)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.size()
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self.pos = offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def truncate(self, size=None):
+        if size is None:
+            size = self.pos
+        if size < 0:
+            raise ValueError("negative size")
+        with self.fs.locks.tx.read(), self.fs.locks.write(self.ident()):
+            self._truncate(size)
+        end_write(self.fs)
+        return size
+
+    def close(self):
+        self.fs = None
+
+
+# O arquivo é o inode na geração em que foi aberto: depois do rm o número
+# pode voltar pra outro arquivo, e aí toda operação dá ESTALE em vez de mexer
+# no arquivo novo. O mv não muda nada, o handle continua valendo.
+class INodeOpenFile(OpenFile):
+    def __init__(self, fs, inode_idx):
+        super().__init__(fs)
+        self.inode_idx = inode_idx
+        self.inode = fs.inodes[inode_idx]
+        self.generation = self.inode.generation
+
+    def ident(self):
+        return self.inode_idx
+
+    def _live(self):
+        inode = self.inode
+        if not inode.used or inode.generation != self.generation:
+            raise OSError(errno.ESTALE, f"Stale file handle: inode {self.inode_idx}")
+        return inode
+
+    def size(self):
+        return self._live().size
+
+    def _read_at(self, offset, n):
+        return self._live().read_at(self.fs, offset, n)
+
+    def _views(self, offset, n):
+        return self._live().iter_views(self.fs, offset, n)
+
+    def _write_at(self, offset, data):
+        self._live().write_at(self.fs, offset, data)
+
+    def _truncate(self, size):
+        self._live().truncate(self.fs, size)
+
+
+# No encadeado o tamanho do arquivo mora na entrada do diretório pai, então
+# toda mudança de tamanho volta pra lá com set_entry. O arquivo é o bloco
+# cabeça: se o nome não aponta mais pra ele (mv, ou rm e outro arquivo com o
+# mesmo nome), o handle ficou velho e toda operação dá ESTALE, sem tocar na
+# entrada que agora tem esse nome.
+class ChainOpenFile(OpenFile):
+    def __init__(self, fs, parent, name, first_block):
+        super().__init__(fs)
+        self.parent = parent
+        self.name = name
+        self.first_block = first_block
+
+    def ident(self):
+        return self.first_block
+
+    def _entry(self):
+        meta = self.parent.lookup(self.name)
+        if meta is None or meta[0] != "file" or meta[1] != self.first_block:
+            raise OSError(errno.ESTALE, f"Stale file handle: '{self.name}'")
+        return meta
+
+    def size(self):
+        return self._entry()[2]
+
+    def _set_size(self, size, old):
+        if size != old:
+            # Confere de novo com a trava do diretório: o mv e o rm não pegam
+            # a do arquivo
+            with self.fs.locks.write(self.parent.ident()):
+                self._entry()
+                self.parent.set_entry(self.name, ("file", self.first_block, size))
+
+    def _read_at(self, offset, n):
+        return self.fs.read_at(self.first_block, self.size(), offset, n)
+
+    def _views(self, offset, n):
+        return self.fs.iter_chain(self.first_block, self.size(), offset, n)
+
+    def _write_at(self, offset, data):
+        old = self.size()
+        self._set_size(self.fs.write_at(self.first_block, old, offset, data), old)
+
+    def _truncate(self, size):
+        old = self.size()
+        self._set_size(self.fs.truncate_chain(self.first_block, old, size), old)
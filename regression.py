@@ -0,0 +1,255 @@
+import csv
+import json
+import math
+import os
+import random
+import statistics as stats
+
+# Comparação de uma rodada do benchmark com uma linha de base guardada (o
+# benchmark_stats.json de uma rodada anterior, com as amostras de cada
+# iteração). Pra cada métrica de cada caso (filesystem, perfil, nº de ops),
+# testa se a mudança é de verdade e não ruído: Mann-Whitney unilateral nas
+# amostras (ou intervalo de confiança por bootstrap da razão das medianas)
+# e, além disso, a mudança tem que passar de threshold pra contar.
+
+# Métricas em que maior é melhor; nas outras (latência, tempo) menor é melhor
+HIGHER_BETTER = ("ops_per_s", "dedup_ratio")
+# Métricas que derrubam a comparação quando pioram
+GATED = ("ops_per_s", "p50_us", "p99_us", "sync_ms", "mount_ms")
+
+
+def load(path):
+    """Read a ``benchmark_stats.json`` written by benchmark.py."""
+    with open(path) as f:
+        data = json.load(f)
+    if "config" not in data or "results" not in data:
+        raise ValueError(f"'{path}' is not a benchmark_stats.json file")
+    return data
+
+
+def _ranks(values):
+    # Posto de cada valor (1..n), com empate levando a média dos postos
+    order = sorted(range(len(values)), key=values.__getitem__)
+    ranks = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2 + 1
+        i = j + 1
+    return ranks
+
+
+# Quantas ordenações de m x's e n y's dão cada U (nº de pares com y > x)
+def _u_counts(m, n):
+    # counts[j][u] pra m' = o laço atual e n' = j
+    counts = [[1] for _ in range(n + 1)]
+    for i in range(1, m + 1):
+        row = [[1]]
+        for j in range(1, n + 1):
+            # O maior valor é um x (tira um x, U igual) ou um y (tira um y,
+            # e ele passa todos os i x's)
+            left, down = counts[j], row[j - 1]
+            size = i * j + 1
+            cur = [0] * size
+            for u, c in enumerate(left):
+                cur[u] += c
+            for u, c in enumerate(down):
+                cur[u + i] += c
+            row.append(cur)
+        counts = row
+    return counts[n]
+
+
+def mann_whitney(x, y):
+    """One-sided Mann-Whitney U test that *y* tends to be larger than *x*.
+
+    Returns the p-value: exact when there are no ties and both samples are
+    small, from the normal approximation (with tie and continuity
+    corrections) otherwise.
+    """
+    m, n = len(x), len(y)
+    ranks = _ranks(list(x) + list(y))
+    u = sum(ranks[m:]) - n * (n + 1) / 2
+    tied = len(set(ranks)) < m + n
+    if not tied and m <= 50 and n <= 50:
+        counts = _u_counts(m, n)
+        return sum(counts[math.ceil(u):]) / sum(counts)
+    mean = m * n / 2
+    ties = {}
+    for r in ranks:
+        ties[r] = ties.get(r, 0) + 1
+    correction = sum(t ** 3 - t for t in ties.values()) / ((m + n) * (m + n - 1))
+    var = m * n / 12 * (m + n + 1 - correction)
+    if var <= 0:
+        return 1.0
+    z = (u - mean - 0.5) / math.sqrt(var)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def min_p_value(m, n):
+    """Smallest p-value :func:`mann_whitney` can give for samples of *m* and *n*.
+
+    It comes from the one ordering where every *y* is above every *x*. When
+    it is not below alpha, no change can be significant.
+    """
+    return 1 / math.comb(m + n, m)
+
+
+def bootstrap_ci(x, y, rnd, rounds=2000, confidence=0.95):
+    """Percentile bootstrap interval of ``median(y) / median(x)``."""
+    ratios = []
+    for _ in range(rounds):
+        mx = stats.median(rnd.choices(x, k=len(x)))
+        my = stats.median(rnd.choices(y, k=len(y)))
+        if mx:
+            ratios.append(my / mx)
+    if not ratios:
+        return None
+    ratios.sort()
+    tail = (1 - confidence) / 2
+    return (
+        ratios[int(tail * (len(ratios) - 1))],
+        ratios[int((1 - tail) * (len(ratios) - 1))],
+    )
+
+
+def compare(baseline, current, alpha=0.05, threshold=0.10, test="mwu", gated=GATED, seed=0):
+    """Compare every metric of *current* results against *baseline*.
+
+    Both are the ``results`` lists of benchmark_stats.json. Each row of the
+    answer has the medians, the relative change, the p-value (``mwu``) or
+    the bootstrap interval of the median ratio (``bootstrap``), and a
+    verdict: ``regression`` or ``improvement`` when the change is
+    significant at *alpha* and larger than *threshold*, ``same`` otherwise.
+    A metric in *gated* whose verdict is ``regression`` fails the run;
+    so does a case with content errors or missing from *current*.
+    """
+    rnd = random.Random(seed)
+    now = {(r["fs_type"], r["profile"], r["num_ops"]): r for r in current}
+    rows = []
+    for base in baseline:
+        key = (base["fs_type"], base["profile"], base["num_ops"])
+        new = now.get(key)
+        if new is None:
+            rows.append(_row(key, "-", verdict="missing", failed=True))
+            continue
+        if new["errors"]:
+            rows.append(_row(key, "errors", verdict=f"{new['errors']} errors", failed=True))
+        for metric, before in base["samples"].items():
+            before = [v for v in before if v is not None]
+            after = [v for v in new["samples"].get(metric, []) if v is not None]
+            if not before or not after:
+                continue
+            rows.append(_compare_metric(
+                key, metric, before, after, alpha, threshold, test, metric in gated, rnd
+            ))
+        rows.append(_rss_row(key, base, new, threshold))
+    return rows
+
+
+def _row(key, metric, **fields):
+    row = {
+        "fs_type": key[0], "profile": key[1], "num_ops": key[2], "metric": metric,
+        "base": None, "new": None, "change": None, "p_value": None,
+        "ci_low": None, "ci_high": None, "verdict": "same", "failed": False,
+    }
+    row.update(fields)
+    return row
+
+
+def _compare_metric(key, metric, before, after, alpha, threshold, test, gated, rnd):
+    higher = metric in HIGHER_BETTER
+    base, new = stats.median(before), stats.median(after)
+    change = new / base - 1 if base else None
+    row = _row(key, metric, base=base, new=new, change=change)
+    if change is None:
+        return row
+    worse = -change if higher else change
+    if test == "bootstrap":
+        ci = bootstrap_ci(before, after, rnd)
+        if ci is None:
+            return row
+        row["ci_low"], row["ci_high"] = ci
+        # Significativo quando o intervalo inteiro fica de um lado do 1
+        sig_worse = ci[1] < 1 if higher else ci[0] > 1
+        sig_better = ci[0] > 1 if higher else ci[1] < 1
+    else:
+        # Pior é "depois" maior (latência) ou menor (ops/s) que "antes"
+        p_worse = mann_whitney(after, before) if higher else mann_whitney(before, after)
+        p_better = mann_whitney(before, after) if higher else mann_whitney(after, before)
+        row["p_value"] = min(p_worse, p_better)
+        sig_worse, sig_better = p_worse < alpha, p_better < alpha
+    if sig_worse and worse > threshold:
+        row["verdict"] = "regression"
+        row["failed"] = gated
+    elif sig_better and -worse > threshold:
+        row["verdict"] = "improvement"
+    return row
+
+
+# O pico de RSS é uma amostra só por caso, então não tem teste: só aparece
+# no relatório quando muda mais que threshold, e não derruba a rodada
+def _rss_row(key, base, new, threshold):
+    before, after = base.get("peak_rss_kb"), new.get("peak_rss_kb")
+    row = _row(key, "peak_rss_kb", base=before, new=after)
+    if before and after:
+        row["change"] = after / before - 1
+        if abs(row["change"]) > threshold:
+            row["verdict"] = "larger" if row["change"] > 0 else "smaller"
+    return row
+
+
+def report(rows, verbose=False):
+    """Lines of the diff report; without *verbose*, only the rows that changed."""
+    lines = [
+        f"{'fs_type':<19} {'profile':<9} {'ops':>9} {'metric':<13}"
+        f" {'base':>12} {'new':>12} {'change':>8}  {'p / CI':<15} verdict"
+    ]
+    for row in rows:
+        if not verbose and row["verdict"] == "same":
+            continue
+        change = "" if row["change"] is None else f"{row['change'] * 100:+.1f}%"
+        if row["p_value"] is not None:
+            test = f"p={row['p_value']:.3g}"
+        elif row["ci_low"] is not None:
+            test = f"[{row['ci_low']:.3f}, {row['ci_high']:.3f}]"
+        else:
+            test = ""
+        verdict = row["verdict"] + (" ❌" if row["failed"] else "")
+        lines.append(
+            f"{row['fs_type']:<19} {row['profile']:<9} {row['num_ops']:>9} {row['metric']:<13}"
+            f" {_num(row['base']):>12} {_num(row['new']):>12} {change:>8}  {test:<15} {verdict}"
+        )
+    failed = sum(row["failed"] for row in rows)
+    changed = sum(row["verdict"] != "same" for row in rows)
+    lines.append(f"{len(rows)} comparisons, {changed} changed, {failed} failing")
+    return lines
+
+
+def _num(value):
+    if value is None:
+        return "-"
+    if isinstance(value, int) or abs(value) >= 1000:
+        return f"{value:,.0f}"
+    return f"{value:.3f}"
+
+
+def write(rows, outdir):
+    """Write ``compare.csv`` (every row) and ``compare.txt`` (the report) into *outdir*."""
+    os.makedirs(outdir, exist_ok=True)
+    csv_path = os.path.join(outdir, "compare.csv")
+    fields = [
+        "fs_type", "profile", "num_ops", "metric", "base", "new", "change",
+        "p_value", "ci_low", "ci_high", "verdict", "failed",
+    ]
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    txt_path = os.path.join(outdir, "compare.txt")
+    with open(txt_path, "w") as f:
+        f.write("\n".join(report(rows, verbose=True)) + "\n")
+    return csv_path, txt_path
@@ -0,0 +1,149 @@
+import argparse
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from image import mkfs, mount
+from main import types
+from shell import Shell
+
+# Protocolo de linha: o cliente manda um comando por linha, igual no Shell
+# ("mkdir a", "cat a/x"...). A resposta é a saída do comando, uma linha
+# "| texto" por linha, e no fim uma linha de status: "OK <cwd>" ou
+# "ERR <mensagem>". Como no Shell.run, um comando que imprimiu um erro também
+# volta ERR. "exit" fecha a conexão.
+
+# Só os comandos que mexem dentro do filesystem. import/export leem e
+# escrevem arquivos da máquina do servidor, e stats, snapshot, rollback e
+# sync são de quem administra a imagem, não de um cliente.
+COMMANDS = ("ls", "cd", "mkdir", "rmdir", "mkfile", "rm", "cat", "mv", "cp", "append")
+
+
+# Os comandos escrevem com print, então o stdout vira um despachante: cada
+# thread do pool escreve no buffer que ela mesma abriu com capture, e o
+# resto vai pro stdout de verdade.
+class ThreadOutput(io.TextIOBase):
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.local = threading.local()
+
+    def write(self, text):
+        buf = getattr(self.local, "buf", None)
+        (self.fallback if buf is None else buf).write(text)
+        return len(text)
+
+    def flush(self):
+        self.fallback.flush()
+
+    @contextmanager
+    def capture(self):
+        self.local.buf = io.StringIO()
+        try:
+            yield self.local.buf
+        finally:
+            self.local.buf = None
+
+
+# Estado de cada cliente. O cwd do filesystem é por thread, então antes de
+# cada comando a thread do pool assume o cwd da sessão e depois devolve.
+class Session:
+    def __init__(self, fs):
+        self.cwd = fs.root
+
+
+class Server:
+    def __init__(self, fs, workers=8):
+        self.fs = fs
+        shell = Shell(fs)
+        self.commands = {name: shell.commands[name] for name in COMMANDS}
+        self.pool = ThreadPoolExecutor(workers)
+        self.output = ThreadOutput(sys.stdout)
+
+    # Roda numa thread do pool
+    def run_command(self, session, cmd, args):
+        self.fs.current_dir = session.cwd
+        with self.output.capture() as buf:
+            try:
+                self.commands[cmd](args)
+                out = buf.getvalue()
+                if Shell.failed(cmd, out.rstrip("\n")):
+                    status = f"ERR {out.splitlines()[0]}"
+                else:
+                    status = f"OK {self.fs.current_dir.get_path()}"
+            except Exception as e:
+                status = f"ERR {e}"
+        session.cwd = self.fs.current_dir
+        return buf.getvalue(), status
+
+    async def handle(self, reader, writer):
+        session = Session(self.fs)
+        loop = asyncio.get_running_loop()
+        try:
+            while line := await reader.readline():
+                words = line.decode("utf-8", "replace").split()
+                if words and words[0] == "exit":
+                    break
+                if not words:
+                    out, status = "", f"OK {session.cwd.get_path()}"
+                elif words[0] not in self.commands:
+                    out, status = "", f"ERR Command not found: {words[0]}"
+                else:
+                    out, status = await loop.run_in_executor(
+                        self.pool, self.run_command, session, words[0], words[1:]
+                    )
+                reply = [f"| {text}" for text in out.splitlines()] + [status]
+                writer.write(("\n".join(reply) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=7070, path=None):
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        stdout, sys.stdout = sys.stdout, self.output
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            sys.stdout = stdout
+            self.pool.shutdown()
+
+
+def open_fs(type_, image=None, num_blocks=1024, block_size=512):
+    cls = types[type_]["cls"]
+    if image is None:
+        return cls(num_blocks, block_size, threadsafe=True)
+    if os.path.exists(image):
+        return mount(image, threadsafe=True)
+    return mkfs(image, cls, num_blocks, block_size, threadsafe=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a filesystem over a line protocol")
+    parser.add_argument("type", choices=sorted(types), help="'i': i-node, 'l': linked list")
+    parser.add_argument("image", nargs="?", help="image file (in memory if omitted)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7070)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--blocks", type=int, default=1024)
+    parser.add_argument("--block-size", type=int, default=512)
+    args = parser.parse_args()
+
+    fs = open_fs(args.type, args.image, args.blocks, args.block_size)
+    where = args.unix or f"{args.host}:{args.port}"
+    print(f"Serving {types[args.type]['name']} on {where}")
+    try:
+        asyncio.run(Server(fs, args.workers).serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fs.close()
@@ -1,4 +1,12 @@
+import json
 import os
+import tarfile
+import time
+from contextlib import nullcontext, redirect_stdout
+from io import StringIO
+
+import instrument
+import transfer
 
 class Shell:
     def __init__(self, fs) -> None:
@@ -14,8 +22,28 @@ class Shell:
             "cat": self.fs.cat,
             "clear": self.clear,
             "mv": self.fs.move,
+            "cp": self.fs.copy,
+            "append": self.fs.append_file,
+            "sync": self.sync,
+            "import": self.import_,
+            "export": self.export,
+            "snapshot": self.snapshot,
+            "rollback": self.rollback,
+            "stats": self.stats,
+        }
+        self.commands = {name: self._counted(name, func) for name, func in self.commands.items()}
+        # Comandos que rodam em lote quando vêm seguidos no mesmo diretório:
+        # (mínimo de argumentos, função em lote, monta o item de cada um)
+        self.batch = {
+            "mkfile": (2, self.fs.make_files, lambda name, args: (name, " ".join(args[1:]))),
+            "mkdir": (1, self.fs.make_directories, lambda name, args: name),
+            "rm": (1, self.fs.remove_files, lambda name, args: name),
         }
 
+    # ls, cat e snapshot (a lista) escrevem o resultado; os outros só
+    # escrevem quando dá erro (o erro sempre começa com "comando: ")
+    READ_ONLY = ("ls", "cat", "snapshot", "stats")
+
     def start(self):
         while True:
             user_input = input(f"{self.fs.current_dir.get_path()} > ").strip().split()
@@ -27,8 +55,202 @@ class Shell:
                 continue
             func(user_input[1:])
 
+    # Roda uma lista de comandos já separados, ex.: [("mkdir", "a"),
+    # ("mkfile", "a/x", "oi")], sem imprimir nada. Devolve (ok, saída) de cada
+    # comando; para no exit. mkfile/mkdir/rm seguidos no mesmo diretório viram
+    # uma chamada só, com uma atualização só na tabela de entradas.
+    def run(self, commands):
+        results = []
+        i = 0
+        while i < len(commands):
+            cmd, *args = commands[i]
+            if cmd == "exit":
+                break
+            key = self._batch_key(cmd, args)
+            if key is not None:
+                _, func, item = self.batch[cmd]
+                j = i + 1
+                while j < len(commands) and commands[j][0] == cmd and \
+                        self._batch_key(cmd, commands[j][1:]) == key:
+                    j += 1
+                items = [
+                    item(c[1].rpartition("/")[2], c[1:]) for c in commands[i:j]
+                ]
+                try:
+                    with self._measure(cmd):
+                        errors = func(key, items)
+                except Exception as e:
+                    errors = [f"{cmd}: {e}"] * len(items)
+                results += [(err is None, err or "") for err in errors]
+                i = j
+                continue
+            results.append(self._run_one(cmd, args))
+            i += 1
+        return results
+
+    # Com os contadores ligados (stats on), o que roda dentro conta pro
+    # comando name; desligados, não faz nada
+    def _measure(self, name):
+        probe = self.fs.probe
+        return nullcontext() if probe is None else probe.command(name)
+
+    def _counted(self, name, func):
+        def run(args):
+            with self._measure(name):
+                return func(args)
+        return run
+
+    # Diretório do comando, se ele entra num lote
+    def _batch_key(self, cmd, args):
+        if cmd not in self.batch or len(args) < self.batch[cmd][0]:
+            return None
+        dir_path, slash, name = args[0].rpartition("/")
+        # "/nome" é na raiz, não no diretório atual
+        return (dir_path or slash) if name else None
+
+    def _run_one(self, cmd, args):
+        if cmd == "clear":
+            return True, ""
+        func = self.commands.get(cmd)
+        if func is None:
+            return False, f"Command not found: {cmd}"
+        out = StringIO()
+        try:
+            with redirect_stdout(out):
+                func(list(args))
+        except Exception as e:
+            return False, f"{cmd}: {e}"
+        out = out.getvalue().rstrip("\n")
+        return not self.failed(cmd, out), out
+
+    # Os comandos não devolvem nada, só imprimem: os de leitura falham se a
+    # saída é um "cmd: erro", os outros se imprimiram qualquer coisa
+    @classmethod
+    def failed(cls, cmd, out):
+        if cmd in cls.READ_ONLY:
+            return out.startswith(f"{cmd}: ")
+        return bool(out)
+
+    # Roda um script, um comando por linha (linha vazia e # são ignorados).
+    # Devolve (número da linha, ok, saída) de cada comando que rodou.
+    def run_script(self, lines):
+        numbers, commands = [], []
+        for number, line in enumerate(lines, 1):
+            words = line.split()
+            if words and not words[0].startswith("#"):
+                numbers.append(number)
+                commands.append(words)
+        return [
+            (number, ok, out)
+            for number, (ok, out) in zip(numbers, self.run(commands))
+        ]
+
     def exit_(self, _):
+        self.fs.close()
         exit()
 
+    # import <caminho no host> [diretório]: pasta, arquivo ou .tar
+    def import_(self, args):
+        if not args:
+            print("import: Not enough arguments")
+            return
+        func = self.fs.import_tar if transfer.is_tar(args[0]) else self.fs.import_tree
+        try:
+            stats = func(args[0], args[1] if len(args) > 1 else "")
+        except (OSError, ValueError, RuntimeError, tarfile.TarError) as e:
+            print(f"import: {e}")
+            return
+        for path in stats["skipped"]:
+            print(f"import: skipped '{path}'")
+
+    # export <caminho> <pasta no host ou .tar>
+    def export(self, args):
+        if len(args) < 2:
+            print("export: Not enough arguments")
+            return
+        func = self.fs.export_tar if transfer.is_tar(args[1]) else self.fs.export_tree
+        try:
+            func(args[0], args[1])
+        except (OSError, tarfile.TarError) as e:
+            print(f"export: {e}")
+
+    # snapshot: lista; snapshot <nome>: tira um; snapshot -d <nome>: apaga.
+    # O conteúdo fica em /.snapshots/<nome>/...
+    def snapshot(self, args):
+        try:
+            if not args:
+                for name, created, blocks in self.fs.list_snapshots():
+                    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created))
+                    print(f"{name}  {when}  {blocks} blocks saved")
+            elif args[0] == "-d":
+                if len(args) < 2:
+                    print("snapshot: Not enough arguments")
+                    return
+                self.fs.delete_snapshot(args[1])
+            else:
+                self.fs.snapshot(args[0])
+        except (OSError, ValueError) as e:
+            print(f"snapshot: {e}")
+
+    def rollback(self, args):
+        if not args:
+            print("rollback: Not enough arguments")
+            return
+        try:
+            self.fs.rollback(args[0])
+        except OSError as e:
+            print(f"rollback: {e}")
+
+    # stats: mostra os contadores por comando; stats on|off|reset;
+    # stats --json [arquivo]: tudo em JSON, na tela ou no arquivo
+    def stats(self, args):
+        action = args[0] if args else ""
+        if action == "on":
+            instrument.enable(self.fs)
+            return
+        if action == "off":
+            instrument.disable(self.fs)
+            return
+        probe = self.fs.probe
+        if probe is None:
+            print("stats: counters are off (use 'stats on')")
+            return
+        if action == "reset":
+            probe.reset()
+            return
+        if action == "--json":
+            text = json.dumps(probe.dump(), indent=1)
+            if len(args) < 2:
+                print(text)
+                return
+            try:
+                with open(args[1], "w") as f:
+                    f.write(text + "\n")
+            except OSError as e:
+                print(f"stats: {e}")
+            return
+        if action:
+            print(f"stats: unknown option '{action}'")
+            return
+        dump = probe.dump()
+        print(f"{'':<14}{'calls':>10}{'amount':>12}{'max':>8}{'ms':>12}")
+        for command, counters in dump["commands"].items():
+            total = counters.get("command")
+            if total is not None:
+                print(f"{command:<14}{total['calls']:>10}{'':>20}{total['seconds'] * 1e3:>12.3f}")
+            else:
+                print(command)
+            for name, c in counters.items():
+                if name != "command":
+                    print(f"  {name:<12}{c['calls']:>10}{c['amount']:>12}{c['max']:>8}"
+                          f"{c['seconds'] * 1e3:>12.3f}")
+        print("total")
+        for name, c in dump["totals"].items():
+            print(f"  {name:<12}{c['calls']:>10}{c['amount']:>12}{c['max']:>8}"
+                  f"{c['seconds'] * 1e3:>12.3f}")
+
+    def sync(self, _):
+        self.fs.sync()
+
     def clear(self, _):
         os.system("clear")
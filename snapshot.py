@@ -0,0 +1,231 @@
+import errno
+import time
+
+from superblock import Superblock
+
+# Snapshots do disco inteiro, guardados na memória. Tirar um snapshot é só
+# pôr uma marca no fim de device.snapshots (depois de um sync, pra o disco
+# estar em dia): O(1), não copia nada. Daí em diante o BlockDevice guarda a
+# imagem antiga de cada bloco na primeira vez que ele muda (copy-on-write no
+# nível do bloco, igual ao LVM), então quem escreve paga só pelos blocos que
+# muda. Bloco de dado livre em todos os snapshots nem é guardado.
+#
+# O bloco idx como era no snapshot i é o primeiro saved[idx] dele ou de um
+# mais novo; se nenhum tem, o bloco não mudou desde então e vale o do disco.
+# Um snapshot é visto montando o filesystem (só leitura) em cima de um
+# SnapshotDevice, e aparece em /.snapshots/<nome>/...
+
+ROOT = "/.snapshots"
+
+MISSING = object()
+
+
+class Snapshot:
+    def __init__(self, name):
+        self.name = name
+        self.created = time.time()
+        # bloco -> imagem de antes da primeira escrita depois deste snapshot,
+        # ou None se nenhum snapshot precisava dele
+        self.saved = {}
+        # Montagem só leitura, criada no primeiro acesso
+        self.fs = None
+
+
+# O bloco idx visto pelo primeiro snapshot de chain (que vai até o mais
+# novo). None: nenhum snapshot usa o bloco. Chamado com device.snap_lock.
+def _resolve(device, chain, idx):
+    for snap in chain:
+        data = snap.saved.get(idx, MISSING)
+        if data is not MISSING:
+            return data
+    return device[idx]
+
+
+# Disco só leitura com o conteúdo de um snapshot. O metadado antes do journal
+# (superbloco, bitmaps, tabela) é copiado na montagem, porque o filesystem
+# precisa dele num buffer só; os blocos de dado são lidos na hora.
+class SnapshotDevice:
+    def __init__(self, device, snap, meta_blocks):
+        self.device = device
+        self.snap = snap
+        self.num_blocks = device.num_blocks
+        self.block_size = device.block_size
+        self.path = None
+        self.private = False
+        self.dirty = set()
+        self.meta_blocks = meta_blocks
+        self.buffer = self._read(0, meta_blocks)
+        self.view = memoryview(self.buffer)
+
+    def __len__(self):
+        return self.num_blocks
+
+    def _read(self, start, stop):
+        device = self.device
+        bs = self.block_size
+        out = bytearray()
+        with device.snap_lock:
+            chain = device.snapshots[device.snapshots.index(self.snap):]
+            for idx in range(start, stop):
+                data = _resolve(device, chain, idx)
+                out += bytes(bs) if data is None else data
+        return out
+
+    def __getitem__(self, idx):
+        bs = self.block_size
+        if isinstance(idx, slice):
+            start, stop, _ = idx.indices(self.num_blocks)
+        else:
+            start, stop = idx, idx + 1
+        if stop <= self.meta_blocks:
+            return self.view[start * bs : stop * bs]
+        return memoryview(self._read(start, stop)).toreadonly()
+
+    def write(self, block, data, offset=0):
+        raise OSError(errno.EROFS, "Read-only file system")
+
+    def mark(self, pos, length):
+        if length:
+            raise OSError(errno.EROFS, "Read-only file system")
+
+    def fsync(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _find(device, name):
+    for snap in device.snapshots:
+        if snap.name == name:
+            return snap
+    raise FileNotFoundError(f"No such snapshot: '{name}'")
+
+
+# keep(idx) do BlockDevice: metadado sempre vale guardar; bloco de dado só
+# se está ocupado no bitmap de algum snapshot
+def _keeper(device, sb):
+    bitmap = sb.offset(sb.bitmap_start)
+    bs = sb.block_size
+
+    def keep(idx):
+        if idx < sb.data_start:
+            return True
+        block, off = divmod(bitmap + idx, bs)
+        # Do mais novo pro mais velho, cada um vê o seu saved ou o do seguinte
+        data = device[block]
+        for snap in reversed(device.snapshots):
+            data = snap.saved.get(block, data)
+            if data[off]:
+                return True
+        return False
+    return keep
+
+
+def take(fs, name):
+    """Record the current state of *fs* as the snapshot *name*.
+
+    Nothing is copied now; blocks are saved as they are first overwritten.
+    Snapshots live in memory and are lost when the filesystem is closed.
+    """
+    if not name or "/" in name or name in (".", ".."):
+        raise ValueError(f"Invalid snapshot name: '{name}'")
+    device = fs.device
+    with fs.locks.tx.write():
+        if any(snap.name == name for snap in device.snapshots):
+            raise FileExistsError(f"Snapshot exists: '{name}'")
+        fs._sync()
+        if device.keep is None:
+            device.keep = _keeper(device, fs.sb)
+        with device.snap_lock:
+            device.snapshots.append(Snapshot(name))
+
+
+def list_snapshots(fs):
+    """Return ``(name, creation time, saved blocks)`` for each snapshot, oldest first."""
+    with fs.device.snap_lock:
+        return [
+            (snap.name, snap.created, sum(data is not None for data in snap.saved.values()))
+            for snap in fs.device.snapshots
+        ]
+
+
+def delete(fs, name):
+    """Drop the snapshot *name*; the blocks an older snapshot still needs move to it."""
+    device = fs.device
+    with device.snap_lock:
+        snap = _find(device, name)
+        i = device.snapshots.index(snap)
+        if i:
+            older = device.snapshots[i - 1].saved
+            for idx, data in snap.saved.items():
+                older.setdefault(idx, data)
+        del device.snapshots[i]
+        snap.fs = None
+
+
+def rollback(fs, name):
+    """Bring *fs* back to the snapshot *name*.
+
+    The snapshot is kept and the newer ones are dropped. Every thread goes
+    back to the root directory.
+    """
+    device = fs.device
+    with fs.locks.tx.write():
+        fs._sync()
+        with device.snap_lock:
+            snap = _find(device, name)
+            i = device.snapshots.index(snap)
+            chain = device.snapshots[i:]
+            changed = set().union(*(s.saved for s in chain))
+            images = {idx: _resolve(device, chain, idx) for idx in changed}
+            for newer in chain[1:]:
+                newer.fs = None
+            del device.snapshots[i + 1:]
+            snap.saved = {}
+        for idx, data in images.items():
+            if data is not None:
+                device.restore(idx, data)
+        fs._reload()
+        fs._sync()
+
+
+# O filesystem do snapshot de path (/.snapshots/<nome>/...) e o caminho
+# dentro dele, ou (None, None)
+def _mounted(fs, path):
+    name, _, rest = path[len(ROOT) + 1:].partition("/")
+    device = fs.device
+    with device.snap_lock:
+        snap = next((s for s in device.snapshots if s.name == name), None)
+    if snap is None:
+        return None, None
+    snap_fs = snap.fs
+    if snap_fs is None:
+        # Duas threads podem montar juntas; tanto faz qual fica
+        snap_device = SnapshotDevice(device, snap, fs.sb.journal_start)
+        sb = Superblock.unpack_from(snap_device[0:fs.sb.bitmap_start])
+        snap_fs = snap.fs = type(fs).mount(snap_device, sb)
+    return snap_fs, "/" + rest
+
+
+def get_dir(fs, path):
+    """Directory at ``/.snapshots/<name>/<path>``, or None.
+
+    Commands that change the filesystem (inside a journaled transaction)
+    get None, since snapshots are read-only.
+    """
+    if getattr(fs.session, "tx", 0):
+        return None
+    snap_fs, rest = _mounted(fs, path)
+    return None if snap_fs is None else snap_fs.get_dir(rest)
+
+
+def open_file(fs, path, create=False):
+    """Open a file of a snapshot; writing to it fails with EROFS."""
+    snap_fs, rest = _mounted(fs, path)
+    if snap_fs is None:
+        raise FileNotFoundError(f"No such snapshot: '{path}'")
+    return snap_fs.open(rest, create)
@@ -0,0 +1,59 @@
+import struct
+
+
+# Layout da imagem, em blocos:
+#   [superbloco][bitmap de blocos][bitmap de inodes][tabela][journal][dados...]
+# A tabela é a de inodes no INodeFileSystem e a FAT (next_block) no
+# ChainFileSystem. O journal só existe em imagem (journal_blocks 0 fora dela,
+# e nas imagens de antes dele, que têm esses campos zerados). Os blocos de metadado ficam marcados como usados no bitmap,
+# então os índices de bloco continuam sendo absolutos no disco.
+class Superblock:
+    MAGIC = b"TFS\x01"
+    FORMAT = struct.Struct("<4s1sIQQQQQQQQQQQQ")
+
+    def __init__(self, kind, block_size, num_blocks, num_inodes, table_bytes, journal_blocks=0):
+        self.kind = kind
+        self.block_size = block_size
+        self.num_blocks = num_blocks
+        self.num_inodes = num_inodes
+        self.bitmap_start = self.blocks_for(self.FORMAT.size)
+        self.inode_bitmap_start = self.bitmap_start + self.blocks_for(num_blocks)
+        self.table_start = self.inode_bitmap_start + self.blocks_for(num_inodes)
+        self.journal_start = self.table_start + self.blocks_for(table_bytes)
+        self.journal_blocks = journal_blocks
+        self.data_start = self.journal_start + journal_blocks
+        if self.data_start >= num_blocks:
+            raise ValueError("Device too small for filesystem metadata")
+        # O mkfs reserva os blocos de metadado no bitmap depois
+        self.free_blocks = num_blocks
+        self.free_inodes = num_inodes
+        # Blocos com mais de um dono (cp), pro alocador não precisar contar
+        self.shared_blocks = 0
+        self.root = 0
+
+    def blocks_for(self, nbytes):
+        return -(-nbytes // self.block_size)
+
+    def offset(self, block):
+        return block * self.block_size
+
+    def pack_into(self, buffer):
+        self.FORMAT.pack_into(
+            buffer, 0, self.MAGIC, self.kind, self.block_size,
+            self.num_blocks, self.num_inodes, self.bitmap_start,
+            self.inode_bitmap_start, self.table_start, self.data_start,
+            self.free_blocks, self.free_inodes, self.root,
+            self.journal_start, self.journal_blocks, self.shared_blocks,
+        )
+
+    @classmethod
+    def unpack_from(cls, buffer):
+        fields = cls.FORMAT.unpack_from(buffer)
+        if fields[0] != cls.MAGIC:
+            raise ValueError("Not a filesystem image")
+        sb = cls.__new__(cls)
+        (_, sb.kind, sb.block_size, sb.num_blocks, sb.num_inodes,
+         sb.bitmap_start, sb.inode_bitmap_start, sb.table_start,
+         sb.data_start, sb.free_blocks, sb.free_inodes, sb.root,
+         sb.journal_start, sb.journal_blocks, sb.shared_blocks) = fields
+        return sb
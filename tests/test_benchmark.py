@@ -0,0 +1,16 @@
+import unittest
+
+import benchmark
+
+
+class DuplicateProfileTest(unittest.TestCase):
+    def test_dedup_measures_something(self):
+        for fs_key in ("inode", "chain"):
+            with self.subTest(fs_key):
+                res = benchmark.one_iteration(fs_key, "dup", 400, 0, 100, dedup=True)
+                self.assertEqual(res["errors"], 0)
+                self.assertGreater(res["dedup_ratio"], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
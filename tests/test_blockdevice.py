@@ -0,0 +1,25 @@
+import mmap
+import sys
+import unittest
+
+from blockdevice import BlockDevice
+
+
+class BlockDeviceTest(unittest.TestCase):
+    @unittest.skipUnless(sys.platform.startswith("linux"), "MAP_NORESERVE is Linux-only")
+    def test_noreserve(self):
+        self.assertTrue(BlockDevice.ANONYMOUS & BlockDevice.MAP_NORESERVE)
+        if hasattr(mmap, "MAP_NORESERVE"):
+            self.assertEqual(BlockDevice.MAP_NORESERVE, mmap.MAP_NORESERVE)
+
+    def test_large_device_is_lazy(self):
+        # 16 GiB sem reservar nada: só o bloco escrito vira memória
+        dev = BlockDevice(1 << 22, 4096)
+        dev.write(dev.num_blocks - 1, b"x")
+        self.assertEqual(bytes(dev[dev.num_blocks - 1][:2]), b"x\0")
+        self.assertEqual(bytes(dev[0][:2]), b"\0\0")
+        dev.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import contextlib
+import io
+import sys
+import threading
+import unittest
+
+from chainfilesystem import ChainFileSystem
+from inodefilesystem import INodeFileSystem
+
+FILESYSTEMS = (INodeFileSystem, ChainFileSystem)
+
+
+def blocks_of(fs, name):
+    f = fs.open(name)
+    if isinstance(fs, ChainFileSystem):
+        return fs.chain_blocks(f.first_block)
+    return [start + k for start, length in f.inode.iter_extents(fs) for k in range(length)]
+
+
+class CopyOnWriteTest(unittest.TestCase):
+    def test_shared_until_written(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(256, 512)
+                fs.make_file(["a", "x" * 3000])
+                free = len(fs.allocator)
+                fs.copy(["a", "b"])
+                # O encadeado copia só a cabeça; o inode não copia bloco nenhum
+                self.assertEqual(free - len(fs.allocator), int(cls is ChainFileSystem))
+                shared = blocks_of(fs, "a")[int(cls is ChainFileSystem):]
+                for idx in shared:
+                    self.assertEqual(fs.allocator.refcount(idx), 2)
+
+                fs.open("b").pwrite(0, b"Y")
+                self.assertEqual(fs._cat(["a"]), b"x" * 3000)
+                self.assertEqual(fs._cat(["b"]), b"Y" + b"x" * 2999)
+
+                fs.remove_file(["a"])
+                for idx in blocks_of(fs, "b"):
+                    self.assertEqual(fs.allocator.refcount(idx), 1)
+                fs.remove_file(["b"])
+                self.assertEqual(len(fs.allocator), free + 6)
+                self.assertEqual(fs.allocator.shared, 0)
+                fs.close()
+
+
+# O cp acha o arquivo antes de pegar a trava dele: se o rm passou no meio,
+# a cópia tem que desistir sem ler o que sobrou
+class CloneRecheckTest(unittest.TestCase):
+    def test_removed(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(256, 64, threadsafe=True)
+                fs.make_file(["a", "x" * 300])
+                value = fs.root.lookup("a")
+                fs.remove_file(["a"])
+                free = len(fs.allocator)
+                with self.assertRaises(FileNotFoundError):
+                    fs._clone_file(fs.root, "a", value)
+                self.assertEqual(len(fs.allocator), free)
+                fs.close()
+
+    def test_replaced(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(256, 64, threadsafe=True)
+                fs.make_file(["a", "x" * 300])
+                value = fs.root.lookup("a")
+                fs.remove_file(["a"])
+                fs.make_file(["a", "other"])
+                with self.assertRaises(FileNotFoundError):
+                    fs._clone_file(fs.root, "a", value)
+                fs.close()
+
+    def test_out_of_inodes(self):
+        fs = INodeFileSystem(256, 64)
+        a, b = fs.open("a", create=True), fs.open("b", create=True)
+        # Intercalados, a fica com um extent por bloco e precisa de mais de
+        # um inode
+        for _ in range(10):
+            a.append(b"a" * 64)
+            b.append(b"b" * 64)
+        self.assertIsNotNone(a.inode.next_inode)
+        n = 0
+        while len(fs.inode_allocator) > 1:
+            fs.make_file([f"f{n}", "."])
+            n += 1
+        free, inodes = len(fs.allocator), len(fs.inode_allocator)
+        with self.assertRaises(RuntimeError):
+            fs._clone_file(fs.root, "a", a.inode_idx)
+        self.assertEqual(len(fs.allocator), free)
+        self.assertEqual(len(fs.inode_allocator), inodes)
+        self.assertEqual(fs.allocator.shared, 0)
+        fs.close()
+
+    def test_race_with_rm(self):
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-5)
+        self.addCleanup(sys.setswitchinterval, interval)
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(256, 64, threadsafe=True)
+                free, errors = len(fs.allocator), []
+
+                def copier(t):
+                    try:
+                        for i in range(1000):
+                            fs.copy([f"s{i % 4}", f"c{t}"])
+                            fs.remove_file([f"c{t}"])
+                    except Exception as e:
+                        errors.append(e)
+
+                def remover(t):
+                    try:
+                        for i in range(1000):
+                            fs.make_file([f"s{t}", "z" * 200])
+                            fs.remove_file([f"s{t}"])
+                    except Exception as e:
+                        errors.append(e)
+
+                threads = [threading.Thread(target=copier, args=(t,)) for t in range(2)]
+                threads += [threading.Thread(target=remover, args=(t,)) for t in range(4)]
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for t in threads:
+                        t.start()
+                    for t in threads:
+                        t.join()
+                self.assertEqual(errors, [])
+                self.assertEqual(len(fs.allocator), free)
+                if cls is INodeFileSystem:
+                    self.assertEqual(len(fs.inode_allocator), fs.NUM_INODES - 1)
+                fs.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from chainfilesystem import ChainFileSystem
+from dcache import DentryCache
+from inodefilesystem import INodeFileSystem
+
+
+class DentryCacheTest(unittest.TestCase):
+    def test_hit_and_miss(self):
+        cache = DentryCache()
+        self.assertIs(cache.get(1, "a"), DentryCache.MISSING)
+        cache.put(1, "a", 7)
+        self.assertEqual(cache.get(1, "a"), 7)
+        self.assertIs(cache.get(2, "a"), DentryCache.MISSING)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_negative_entry(self):
+        cache = DentryCache()
+        cache.put(1, "gone", None)
+        self.assertIsNone(cache.get(1, "gone"))
+        self.assertEqual(cache.hits, 1)
+
+    def test_lru_eviction(self):
+        cache = DentryCache(capacity=2)
+        cache.put(1, "a", 1)
+        cache.put(1, "b", 2)
+        cache.get(1, "a")
+        cache.put(1, "c", 3)
+        self.assertIs(cache.get(1, "b"), DentryCache.MISSING)
+        self.assertEqual(cache.get(1, "a"), 1)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_invalidate_dir(self):
+        cache = DentryCache()
+        cache.put(1, "a", 1)
+        cache.put(2, "a", 2)
+        cache.invalidate_dir(1)
+        self.assertIs(cache.get(1, "a"), DentryCache.MISSING)
+        self.assertEqual(cache.get(2, "a"), 2)
+        cache.put(1, "a", 3)
+        self.assertEqual(cache.get(1, "a"), 3)
+
+
+class DirectoryCacheTest(unittest.TestCase):
+    def test_rmdir_and_id_reuse(self):
+        for cls in (INodeFileSystem, ChainFileSystem):
+            with self.subTest(cls.__name__):
+                # Com best o buraco do diretório apagado é o primeiro a voltar
+                fs = cls(512, 512, alloc_policy="best")
+                fs.make_directory(["d"])
+                fs.make_file(["d/x", "old"])
+                old = fs.get_dir("d")
+                self.assertIsNotNone(old.lookup("x"))
+                self.assertIsNone(old.lookup("y"))
+                ident = old.ident()
+                fs.remove_file(["d/x"])
+                fs.remove_directory(["d"])
+                self.assertIsNone(fs.root.lookup("d"))
+
+                # Cria e apaga até um diretório novo ganhar o mesmo id
+                for n in range(1000):
+                    fs.make_directory([f"e{n}"])
+                    new = fs.get_dir(f"e{n}")
+                    if new.ident() == ident:
+                        break
+                    fs.remove_directory([f"e{n}"])
+                else:
+                    self.fail("directory id was never reused")
+                self.assertIsNone(new.lookup("x"))
+                fs.make_file([f"e{n}/y", "new"])
+                self.assertIsNotNone(new.lookup("y"))
+                fs.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
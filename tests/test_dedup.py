@@ -0,0 +1,55 @@
+import unittest
+
+from chainfilesystem import ChainFileSystem
+from inodefilesystem import INodeFileSystem
+
+FILESYSTEMS = (INodeFileSystem, ChainFileSystem)
+BLOB = "".join(c * 512 for c in "wxyz")
+
+
+class DedupTest(unittest.TestCase):
+    def test_identical_files_share_blocks(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(512, 512, dedup=True)
+                free = len(fs.allocator)
+                fs.make_file(["a", BLOB])
+                self.assertEqual(free - len(fs.allocator), 4)
+                fs.make_file(["b", BLOB])
+                # O encadeado ainda precisa de uma cabeça própria
+                self.assertEqual(free - len(fs.allocator), 4 + int(cls is ChainFileSystem))
+                self.assertGreater(fs.dedup.stats()["deduped_blocks"], 0)
+                self.assertEqual(fs._cat(["b"]), BLOB.encode())
+                fs.close()
+
+    def test_write_and_remove(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(512, 512, dedup=True)
+                free = len(fs.allocator)
+                fs.make_file(["a", BLOB])
+                fs.make_file(["b", BLOB])
+                fs.open("b").pwrite(600, b"!")
+                self.assertEqual(fs._cat(["a"]), BLOB.encode())
+                self.assertEqual(fs._cat(["b"]), (BLOB[:600] + "!" + BLOB[601:]).encode())
+
+                fs.remove_file(["a"])
+                self.assertEqual(fs._cat(["b"]), (BLOB[:600] + "!" + BLOB[601:]).encode())
+                fs.remove_file(["b"])
+                self.assertEqual(len(fs.allocator), free)
+                self.assertEqual(fs.allocator.shared, 0)
+                self.assertEqual(fs.dedup.by_block, {})
+                fs.close()
+
+    def test_off_by_default(self):
+        fs = INodeFileSystem(512, 512)
+        free = len(fs.allocator)
+        fs.make_file(["a", BLOB])
+        fs.make_file(["b", BLOB])
+        self.assertIsNone(fs.dedup)
+        self.assertEqual(free - len(fs.allocator), 8)
+        fs.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import unittest
+import zlib
+
+from chainfilesystem import ChainFileSystem
+from directory import Directory
+from inodefilesystem import INodeFileSystem
+
+FILESYSTEMS = (INodeFileSystem, ChainFileSystem)
+
+
+# Nomes que caem no mesmo bucket de uma tabela com buckets buckets
+def colliding(buckets, bucket, count, prefix):
+    names = []
+    i = 0
+    while len(names) < count:
+        name = f"{prefix}{i}"
+        if zlib.crc32(name.encode()) % buckets == bucket:
+            names.append(name)
+        i += 1
+    return names
+
+
+# Bloco lógico e slot de cada nome vivo na tabela
+def placement(d):
+    buckets, _, _ = d._header()
+    span = d._slots() * Directory.RECORD.size
+    slots = {}
+    for k in range(1, buckets + 1):
+        blk = d.fs.blocks[d._block(k)][:span]
+        for i, (status, _, name, _, _) in enumerate(Directory.RECORD.iter_unpack(blk)):
+            if status == Directory.LIVE:
+                slots[name.rstrip(b"\0").decode()] = (k, i)
+    return slots
+
+
+class DirectoryTableTest(unittest.TestCase):
+    def setUp(self):
+        self.filesystems = []
+
+    def tearDown(self):
+        for fs in self.filesystems:
+            fs.close()
+
+    # Diretório vazio e o valor de um arquivo qualquer pra pôr nas entradas
+    def directory(self, cls):
+        fs = cls(2048, 512)
+        self.filesystems.append(fs)
+        fs.make_file(["f", "data"])
+        fs.make_directory(["d"])
+        return fs.get_dir("d"), fs.root.lookup("f")
+
+    def test_probe_past_full_bucket(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                d, value = self.directory(cls)
+                d.update_entries({f"base{i}": value for i in range(10)})
+                buckets, _, _ = d._header()
+                slots = d._slots()
+                # Mais nomes no bucket 0 do que ele tem slots, sem passar da
+                # carga máxima (senão a tabela é reconstruída)
+                names = colliding(buckets, 0, slots + 1, "c")
+                for name in names:
+                    self.assertTrue(d.add_entry(name, value))
+                self.assertEqual(d._header()[0], buckets)
+                where = placement(d)
+                self.assertTrue(any(where[name][0] != 1 for name in names))
+                for name in names:
+                    self.assertEqual(d.lookup(name), value)
+                # Apagar no bucket cheio não esconde quem foi pro seguinte
+                d.fs.dcache.clear()
+                for name in names[:slots // 2]:
+                    self.assertEqual(d.remove_entry(name), value)
+                for name in names[slots // 2:]:
+                    self.assertEqual(d.lookup(name), value)
+                self.assertFalse(d.add_entry(names[-1], value))
+
+    def test_tombstone_reused(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                d, value = self.directory(cls)
+                for name in ("a", "b", "c"):
+                    d.add_entry(name, value)
+                slot = placement(d)["b"]
+                d.remove_entry("b")
+                buckets, live, used = d._header()
+                self.assertEqual((live, used), (2, 3))
+                # Uma tabela de um bucket só: o insert passa pela lápide
+                self.assertEqual(buckets, 1)
+                d.add_entry("e", value)
+                self.assertEqual(d._header(), (1, 3, 3))
+                self.assertEqual(placement(d)["e"], slot)
+                self.assertIsNone(d.lookup("b"))
+                self.assertEqual(sorted(d.get_entries()), ["a", "c", "e"])
+
+    def test_compaction_shrinks(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                d, value = self.directory(cls)
+                names = [f"n{i}" for i in range(60)]
+                for name in names:
+                    d.add_entry(name, value)
+                grown = len(list(d._blocks()))
+                free = len(d.fs.allocator)
+                for name in names[3:]:
+                    d.remove_entry(name)
+                buckets, live, used = d._header()
+                self.assertEqual(live, 3)
+                self.assertLessEqual(used, 4 * live)
+                self.assertLess(len(list(d._blocks())), grown)
+                self.assertEqual(len(list(d._blocks())), buckets + 1)
+                self.assertGreater(len(d.fs.allocator), free)
+                self.assertEqual(sorted(d.get_entries()), sorted(names[:3]))
+
+
+class MigrateTest(unittest.TestCase):
+    # Texto "nome:..." por linha, o formato de antes da tabela hash
+    def test_inode_legacy_directory(self):
+        fs = INodeFileSystem(1024, 512)
+        fs.make_file(["f", "data"])
+        idx = fs.root.lookup("f")
+        d = fs.alloc_inode()
+        fs.inodes[d].file_type = "directory"
+        fs.inodes[d].update_data(fs, f"f:{idx}\ng:{idx}".encode())
+        fs.root.add_entry("old", d)
+        old = fs.get_dir("old")
+        self.assertTrue(old.is_legacy())
+        self.assertEqual(old.get_entries(), {"f": idx, "g": idx})
+        self.assertFalse(old.is_legacy())
+        self.assertEqual(fs._cat(["old/g"]), b"data")
+        old.add_entry("h", idx)
+        self.assertEqual(sorted(old.get_entries()), ["f", "g", "h"])
+        fs.close()
+
+    def test_chain_legacy_directory(self):
+        fs = ChainFileSystem(1024, 512)
+        first, size = fs.write_chain(b"data")
+        dfirst, dsize = fs.write_chain(f"f:file:{first}:{size}\n".encode())
+        fs.root.add_entry("old", ("directory", dfirst, dsize))
+        old = fs.get_dir("old")
+        self.assertTrue(old.is_legacy())
+        self.assertEqual(fs._cat(["old/f"]), b"data")
+        self.assertFalse(old.is_legacy())
+        # A cabeça da cadeia não muda, então a entrada no pai continua certa
+        self.assertEqual(old.first_block, dfirst)
+        self.assertEqual(fs.get_dir("old").lookup("f"), ("file", first, size))
+        fs.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+from chainfilesystem import ChainFileSystem
+from inodefilesystem import INodeFileSystem
+
+FILESYSTEMS = (INodeFileSystem, ChainFileSystem)
+
+
+class RootPathTest(unittest.TestCase):
+    # "/nome" fica na raiz mesmo com o diretório atual em outro lugar
+    def test_root_names_from_subdirectory(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(512, 512)
+                fs.make_directory(["a"])
+                fs.change_directory(["a"])
+                fs.make_file(["/r", "root"])
+                fs.make_directory(["/d"])
+                fs.make_file(["x", "1"])
+                fs.move(["x", "/z"])
+                fs.make_file(["y", "2"])
+                fs.move(["/z", "/d/z"])
+                self.assertEqual(sorted(fs.root.get_entries()), ["a", "d", "r"])
+                self.assertEqual(sorted(fs.current_dir.get_entries()), ["y"])
+                self.assertEqual(fs._cat(["/d/z"]), b"1")
+                self.assertEqual(fs._cat(["/r"]), b"root")
+                fs.remove_file(["/r"])
+                self.assertIsNone(fs.root.lookup("r"))
+                fs.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
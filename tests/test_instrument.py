@@ -0,0 +1,107 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import instrument
+from chainfilesystem import ChainFileSystem
+from inodefilesystem import INodeFileSystem
+from shell import Shell
+
+FILESYSTEMS = (INodeFileSystem, ChainFileSystem)
+
+
+class InstrumentTest(unittest.TestCase):
+    def test_off_by_default(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(512, 512)
+                shell = Shell(fs)
+                self.assertIsNone(fs.probe)
+                self.assertIsNone(fs.blocks.probe)
+                self.assertIsNone(fs.allocator.probe)
+                [(ok, out)] = shell.run([["stats"]])
+                self.assertFalse(ok)
+                self.assertTrue(out.startswith("stats: "))
+                fs.close()
+
+    def test_counts_per_command(self):
+        for cls in FILESYSTEMS:
+            for cache_size in (None, 8):
+                with self.subTest(cls.__name__, cache_size=cache_size):
+                    fs = cls(512, 512, cache_size=cache_size)
+                    shell = Shell(fs)
+                    results = shell.run([
+                        ["stats", "on"], ["mkdir", "a"], ["mkfile", "a/x", "x" * 2000],
+                        ["cat", "a/x"], ["rm", "a/x"],
+                    ])
+                    self.assertTrue(all(ok for ok, _ in results))
+                    probe = fs.probe
+                    dump = probe.dump()
+                    commands = dump["commands"]
+                    for name in ("mkdir", "mkfile", "cat", "rm"):
+                        self.assertEqual(commands[name]["command"]["calls"], 1)
+                    self.assertEqual(commands["mkfile"]["alloc"]["amount"], 4)
+                    self.assertEqual(commands["rm"]["free"]["amount"], 4)
+                    self.assertGreaterEqual(commands["cat"]["block_read"]["amount"], 4)
+                    self.assertEqual(commands["cat"]["path_walk"]["max"], 1)
+                    self.assertIn("block_write", commands["mkfile"])
+                    self.assertEqual(
+                        dump["totals"]["alloc"]["calls"],
+                        sum(c["alloc"]["calls"] for c in commands.values() if "alloc" in c),
+                    )
+
+                    # Desligado nada mais é contado (só o próprio "stats off",
+                    # que começou ligado)
+                    shell.run([["stats", "off"], ["mkfile", "y", "y"]])
+                    self.assertIsNone(fs.blocks.probe)
+                    after = probe.dump()
+                    self.assertEqual(after["totals"], dump["totals"])
+                    self.assertEqual(after["commands"]["mkfile"], commands["mkfile"])
+                    fs.close()
+
+    def test_reset_and_json(self):
+        fs = INodeFileSystem(512, 512)
+        shell = Shell(fs)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "stats.json")
+            results = shell.run([
+                ["stats", "on"], ["mkfile", "x", "hi"], ["stats", "--json", path],
+            ])
+            self.assertTrue(all(ok for ok, _ in results))
+            with open(path) as f:
+                self.assertEqual(json.load(f)["commands"]["mkfile"]["command"]["calls"], 1)
+        [(ok, _), (_, out)] = shell.run([["stats", "reset"], ["stats", "--json"]])
+        self.assertTrue(ok)
+        # Só sobra o próprio "stats reset", que termina depois de zerar
+        dump = json.loads(out)
+        self.assertEqual(dump["totals"], {})
+        self.assertEqual(list(dump["commands"]), ["stats"])
+        fs.close()
+
+    def test_threads(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(4096, 512, threadsafe=True)
+                shell = Shell(fs)
+                probe = instrument.enable(fs)
+
+                def work(t):
+                    for i in range(50):
+                        shell.commands["mkfile"]([f"/f{t}_{i}", "x" * 700])
+                        shell.commands["rm"]([f"/f{t}_{i}"])
+                threads = [threading.Thread(target=work, args=(t,)) for t in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                dump = probe.dump()
+                self.assertEqual(dump["commands"]["mkfile"]["command"]["calls"], 200)
+                self.assertEqual(dump["commands"]["rm"]["command"]["calls"], 200)
+                self.assertEqual(dump["totals"]["alloc"]["amount"], dump["totals"]["free"]["amount"])
+                fs.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
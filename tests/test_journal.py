@@ -0,0 +1,200 @@
+import os
+import tempfile
+import unittest
+import warnings
+from unittest import mock
+
+from blockdevice import BlockDevice
+from chainfilesystem import ChainFileSystem
+from image import mkfs, mount
+from inodefilesystem import INodeFileSystem
+
+FILESYSTEMS = (INodeFileSystem, ChainFileSystem)
+
+
+class Crash(Exception):
+    pass
+
+
+def listing(fs, path):
+    return sorted(fs.get_dir(path).get_entries())
+
+
+# Como se o processo tivesse morrido: larga o arquivo sem sync
+def abandon(fs):
+    fs.device.file.close()
+
+
+# Cai na gravação no lugar que vem depois do registro; a dos blocos livres
+# (flush(blocks), antes do registro) passa
+def crash_after_record():
+    flush = BlockDevice.flush
+
+    def crashing(device, blocks=None):
+        if blocks is None:
+            raise Crash
+        flush(device, blocks)
+    return mock.patch.object(BlockDevice, "flush", crashing)
+
+
+class JournalReplayTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.image = os.path.join(tmp.name, "fs.img")
+
+    def prepare(self, cls):
+        if os.path.exists(self.image):
+            os.remove(self.image)
+        fs = mkfs(self.image, cls, 2048, 512)
+        fs.make_directory(["a"])
+        fs.make_directory(["b"])
+        fs.make_file(["a/f", "hello"])
+        fs.sync()
+        fs.move(["a/f", "b/g"])
+        fs.make_file(["a/h", "x" * 3000])
+        return fs
+
+    def test_uncommitted_is_lost(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = self.prepare(cls)
+                free = fs.sb.free_blocks
+                # Sem sync nada chega no arquivo
+                other = mount(self.image)
+                self.assertEqual(listing(other, "/a"), ["f"])
+                self.assertEqual(listing(other, "/b"), [])
+                self.assertEqual(len(other.allocator), free)
+                other.close()
+                abandon(fs)
+
+    def test_replay_after_crash(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = self.prepare(cls)
+                # Cai depois do registro no journal, antes de gravar no lugar
+                with crash_after_record():
+                    with self.assertRaises(Crash):
+                        fs.sync()
+                other = mount(self.image)
+                self.assertEqual(listing(other, "/a"), ["h"])
+                self.assertEqual(listing(other, "/b"), ["g"])
+                self.assertEqual(other._cat(["/b/g"]), b"hello")
+                self.assertEqual(other._cat(["/a/h"]), b"x" * 3000)
+                self.assertEqual(other.journal.replay(), 0)
+                other.close()
+                abandon(fs)
+
+    def test_torn_record_is_ignored(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = self.prepare(cls)
+                persist = BlockDevice.persist
+
+                def torn(device, block, data):
+                    if block != fs.journal.start:
+                        return persist(device, block, data)
+                    persist(device, block, data[:len(data) // 2])
+                    raise Crash
+
+                # O registro fica pela metade: o crc não bate e o mount
+                # fica com o último commit inteiro
+                with mock.patch.object(BlockDevice, "persist", torn):
+                    with self.assertRaises(Crash):
+                        fs.sync()
+                other = mount(self.image)
+                self.assertEqual(listing(other, "/a"), ["f"])
+                self.assertEqual(listing(other, "/b"), [])
+                other.close()
+                abandon(fs)
+
+
+    # Com bloco de 64 bytes o superbloco relido depois do replay ocupa dois
+    # blocos
+    def test_replay_small_blocks(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                if os.path.exists(self.image):
+                    os.remove(self.image)
+                fs = mkfs(self.image, cls, 4096, 64)
+                fs.make_file(["x", "hello"])
+                with crash_after_record():
+                    with self.assertRaises(Crash):
+                        fs.sync()
+                other = mount(self.image)
+                self.assertEqual(other._cat(["x"]), b"hello")
+                other.close()
+                abandon(fs)
+
+
+class JournalOrderedTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.image = os.path.join(tmp.name, "fs.img")
+
+    def mkfs(self, cls):
+        if os.path.exists(self.image):
+            os.remove(self.image)
+        return mkfs(self.image, cls, 2048, 512)
+
+    def test_new_data_bypasses_record(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = self.mkfs(cls)
+                fs.sync()
+                journal = fs.journal
+                # Bem maior que o journal inteiro, mas os blocos são novos
+                data = "x" * (3 * journal.num_blocks * 512)
+                with warnings.catch_warnings():
+                    warnings.simplefilter("error", RuntimeWarning)
+                    fs.make_file(["big", data])
+                    with crash_after_record():
+                        with self.assertRaises(Crash):
+                            fs.sync()
+                stats = journal.stats()
+                self.assertGreaterEqual(stats["ordered_blocks"], 3 * journal.num_blocks)
+                self.assertEqual(stats["unprotected"], 0)
+                other = mount(self.image)
+                self.assertEqual(other._cat(["big"]), data.encode())
+                other.close()
+                abandon(fs)
+
+    def test_oversized_rewrite_warns(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = self.mkfs(cls)
+                size = 2 * fs.journal.num_blocks * 512
+                fs.make_file(["big", "x" * size])
+                fs.sync()
+                # Reescrever blocos em uso tem que ir pelo registro, e não cabe
+                f = fs.open("big")
+                with self.assertWarns(RuntimeWarning):
+                    f.pwrite(0, b"y" * size)
+                    fs.sync()
+                self.assertGreater(fs.journal.stats()["unprotected"], 0)
+                fs.close()
+                other = mount(self.image)
+                self.assertEqual(other._cat(["big"]), b"y" * size)
+                other.close()
+
+    def test_handle_writes_commit(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = self.mkfs(cls)
+                fs.make_file(["a", ""])
+                fs.sync()
+                commits = fs.journal.commits
+                f = fs.open("a")
+                # Sem comando nenhum no meio, os pwrites fecham um grupo
+                for i in range(fs.journal.GROUP_SIZE):
+                    f.pwrite(i, b"z")
+                self.assertEqual(fs.journal.commits, commits + 1)
+                other = mount(self.image)
+                self.assertEqual(other._cat(["a"]), b"z" * fs.journal.GROUP_SIZE)
+                other.close()
+                abandon(fs)
+
+
+if __name__ == "__main__":
+    unittest.main()
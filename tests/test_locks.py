@@ -0,0 +1,112 @@
+import contextlib
+import io
+import threading
+import unittest
+
+from chainfilesystem import ChainFileSystem
+from inodefilesystem import INodeFileSystem
+from locks import LockTable, RWLock
+
+
+class RWLockTest(unittest.TestCase):
+    def test_readers_share(self):
+        lock = RWLock()
+        inside = threading.Barrier(3, timeout=5)
+
+        def reader():
+            with lock.read():
+                inside.wait()
+
+        threads = [threading.Thread(target=reader) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(lock.readers, 0)
+
+    def test_writer_excludes_readers(self):
+        lock = RWLock()
+        entered = threading.Event()
+
+        def reader():
+            with lock.read():
+                entered.set()
+
+        with lock.write():
+            t = threading.Thread(target=reader)
+            t.start()
+            self.assertFalse(entered.wait(0.1))
+        self.assertTrue(entered.wait(5))
+        t.join()
+
+    def test_writer_reenters(self):
+        lock = RWLock()
+        with lock.write():
+            with lock.read():
+                with lock.write():
+                    self.assertEqual(lock.depth, 3)
+        self.assertIsNone(lock.writer)
+        self.assertEqual(lock.depth, 0)
+
+    def test_table_orders_keys(self):
+        # Os dois pedem as mesmas travas em ordens diferentes; com a ordem
+        # por id nenhum fica esperando o outro
+        table = LockTable()
+
+        def worker(keys):
+            for _ in range(2000):
+                with table.write(*keys):
+                    pass
+
+        threads = [threading.Thread(target=worker, args=(keys,)) for keys in ((1, 2), (2, 1))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+            self.assertFalse(t.is_alive())
+
+
+# Trava do arquivo seguida da do diretório pai (handle escrevendo) contra mv
+# e rm, que pegam só as dos diretórios
+class LockOrderTest(unittest.TestCase):
+    def test_handles_against_mv_and_rm(self):
+        for cls in (INodeFileSystem, ChainFileSystem):
+            with self.subTest(cls.__name__):
+                fs = cls(2048, 512, threadsafe=True)
+                fs.make_directory(["d"])
+                errors = []
+
+                def writer():
+                    for i in range(300):
+                        try:
+                            f = fs.open("d/log", create=True)
+                            f.append(b"x" * 100)
+                            f.read()
+                        except OSError:
+                            pass
+                        except Exception as e:
+                            errors.append(e)
+
+                def mover():
+                    for i in range(300):
+                        try:
+                            fs.move(["d/log", "d/old"])
+                            fs.remove_file(["d/old"])
+                            fs._cat(["d/log"])
+                        except Exception as e:
+                            errors.append(e)
+
+                threads = [threading.Thread(target=writer), threading.Thread(target=mover)]
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for t in threads:
+                        t.start()
+                    for t in threads:
+                        t.join(60)
+                for t in threads:
+                    self.assertFalse(t.is_alive())
+                self.assertEqual(errors, [])
+                fs.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
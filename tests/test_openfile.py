@@ -0,0 +1,138 @@
+import errno
+import unittest
+
+from chainfilesystem import ChainFileSystem
+from inodefilesystem import INodeFileSystem
+
+
+class ChainStaleHandleTest(unittest.TestCase):
+    def setUp(self):
+        self.fs = ChainFileSystem(256, 64, threadsafe=True)
+        self.fs.make_file(["a", "hello"])
+        self.f = self.fs.open("a")
+
+    def tearDown(self):
+        self.fs.close()
+
+    def assertStale(self, call, *args):
+        with self.assertRaises(OSError) as ctx:
+            call(*args)
+        self.assertEqual(ctx.exception.errno, errno.ESTALE)
+
+    def test_move(self):
+        self.fs.move(["a", "b"])
+        self.assertStale(self.f.write, b"XX")
+        self.assertStale(self.f.read)
+        self.assertEqual(self.fs._cat(["b"]), b"hello")
+        self.assertIsNone(self.fs.root.lookup("a"))
+
+    def test_remove_and_recreate(self):
+        self.fs.remove_file(["a"])
+        self.fs.make_file(["a", "other"])
+        self.assertStale(self.f.append, b"XX")
+        self.assertStale(self.f.truncate, 0)
+        self.assertEqual(self.fs._cat(["a"]), b"other")
+
+    def test_remove(self):
+        free = len(self.fs.allocator)
+        self.fs.remove_file(["a"])
+        self.assertStale(self.f.write, b"X" * 500)
+        # A escrita não pode ressuscitar a entrada
+        self.assertIsNone(self.fs.root.lookup("a"))
+        self.assertEqual(len(self.fs.allocator), free + 1)
+
+    def test_same_file(self):
+        self.f.seek(0, 2)
+        self.f.write(b" world")
+        self.f.seek(0)
+        self.assertEqual(self.f.read(), b"hello world")
+        self.assertEqual(self.fs._cat(["a"]), b"hello world")
+
+
+class INodeHandleTest(unittest.TestCase):
+    def setUp(self):
+        self.fs = INodeFileSystem(256, 64, threadsafe=True)
+        self.fs.make_file(["a", "hello"])
+        self.f = self.fs.open("a")
+
+    def tearDown(self):
+        self.fs.close()
+
+    def assertStale(self, call, *args):
+        with self.assertRaises(OSError) as ctx:
+            call(*args)
+        self.assertEqual(ctx.exception.errno, errno.ESTALE)
+
+    # O inode não depende do nome: o handle continua valendo depois do mv
+    def test_move(self):
+        self.fs.move(["a", "b"])
+        self.f.seek(0, 2)
+        self.f.write(b"!")
+        self.assertEqual(self.fs._cat(["b"]), b"hello!")
+
+    def test_remove(self):
+        self.fs.remove_file(["a"])
+        self.assertStale(self.f.read)
+        self.assertStale(self.f.pwrite, 0, b"XX")
+        self.assertStale(self.f.truncate, 0)
+
+    def test_inode_reused(self):
+        idx = self.f.inode_idx
+        self.fs.remove_file(["a"])
+        # Gira os inodes até o número do a voltar pra outro arquivo
+        n = 0
+        while self.fs.inodes[idx].file_type != "file":
+            self.fs.make_file([f"b{n}", "B" * 10])
+            n += 1
+        other = next(name for name, i in self.fs.root.get_entries().items() if i == idx)
+        self.assertStale(self.f.pwrite, 0, b"XX")
+        self.assertStale(self.f.append, b"XX")
+        self.assertStale(self.f.read)
+        self.assertEqual(self.fs._cat([other]), b"B" * 10)
+
+    def test_empty_file(self):
+        f = self.fs.open("e", create=True)
+        self.assertEqual(f.read(), b"")
+        f.write(b"ok")
+        self.assertEqual(self.fs._cat(["e"]), b"ok")
+
+
+
+class StreamTest(unittest.TestCase):
+    def check(self, fs, name, data):
+        f = fs.open(name)
+        bs = fs.BLOCK_SIZE
+        views = list(f.stream())
+        self.assertTrue(all(isinstance(view, memoryview) for view in views))
+        self.assertTrue(all(len(view) <= fs.STREAM_BLOCKS * bs for view in views))
+        self.assertEqual(b"".join(views), data)
+        # Pedaços que começam e terminam no meio de um bloco
+        for offset, n in ((1, 10), (bs - 1, 2), (bs, bs), (3 * bs + 7, 70 * bs), (len(data) - 5, 100)):
+            self.assertEqual(b"".join(f.stream(offset, n)), data[offset:offset + n])
+        self.assertEqual(list(f.stream(len(data))), [])
+        self.assertEqual(list(f.stream(0, 0)), [])
+
+    def test_contiguous_and_fragmented(self):
+        for cls in (INodeFileSystem, ChainFileSystem):
+            for cache_size in (None, 16):
+                with self.subTest(cls.__name__, cache_size=cache_size):
+                    fs = cls(2048, 64, cache_size=cache_size)
+                    data = bytes(range(256)) * 40
+                    fs.make_file(["big", ""])
+                    fs.open("big").pwrite(0, data)
+                    self.check(fs, "big", data)
+                    # Dois arquivos crescendo juntos ficam com os blocos
+                    # intercalados
+                    fs.make_file(["x", ""])
+                    fs.make_file(["y", ""])
+                    x, y = fs.open("x"), fs.open("y")
+                    for i in range(100):
+                        x.append(bytes([i]) * 64)
+                        y.append(bytes([255 - i]) * 64)
+                    self.check(fs, "x", b"".join(bytes([i]) * 64 for i in range(100)))
+                    self.check(fs, "y", b"".join(bytes([255 - i]) * 64 for i in range(100)))
+                    fs.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import benchmark
+import regression
+
+
+class MinPValueTest(unittest.TestCase):
+    def test_matches_exact_test(self):
+        for m, n in ((2, 2), (3, 3), (3, 5), (5, 5)):
+            x = list(range(m))
+            y = [v + 100 for v in range(n)]
+            self.assertAlmostEqual(regression.mann_whitney(x, y), regression.min_p_value(m, n))
+        self.assertEqual(regression.min_p_value(3, 3), 0.05)
+        self.assertLess(regression.min_p_value(4, 4), 0.05)
+
+    def test_compare_refuses_underpowered_baseline(self):
+        config = {
+            "sizes": [100], "profiles": ["metadata"], "fs": ["chain"], "seed": 0,
+            "warmup": 0, "iterations": 3, "live": 50, "block_size": 512,
+            "image": False, "dedup": False, "instrument": False,
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "benchmark_stats.json")
+            with open(path, "w") as f:
+                json.dump({"config": config, "results": []}, f)
+            with self.assertRaises(SystemExit) as ctx, \
+                    contextlib.redirect_stderr(io.StringIO()) as err:
+                benchmark.main(["--compare", path, "--out", tmp])
+            self.assertEqual(ctx.exception.code, 2)
+            self.assertIn("smallest possible p-value", err.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from chainfilesystem import ChainFileSystem
+from server import COMMANDS, Server
+
+
+class ServerTest(unittest.TestCase):
+    def test_admin_commands_not_exposed(self):
+        fs = ChainFileSystem(256, 512, threadsafe=True)
+        server = Server(fs, workers=1)
+        self.assertEqual(sorted(server.commands), sorted(COMMANDS))
+        for name in ("import", "export", "stats", "snapshot", "rollback", "sync", "exit"):
+            self.assertNotIn(name, server.commands)
+        server.pool.shutdown()
+        fs.close()
+
+    def test_protocol(self):
+        fs = ChainFileSystem(256, 512, threadsafe=True)
+        server = Server(fs, workers=2)
+
+        async def talk(lines):
+            listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+            port = listener.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            replies = []
+            for line in lines:
+                writer.write(f"{line}\n".encode())
+                # Pula a saída ("| ..."), fica com o status
+                while (reply := (await reader.readline()).decode().strip()).startswith("| "):
+                    pass
+                replies.append(reply)
+            writer.close()
+            listener.close()
+            await listener.wait_closed()
+            return replies
+
+        # Como no serve: a saída dos comandos passa pelo despachante
+        with mock.patch("sys.stdout", server.output):
+            replies = asyncio.run(talk([
+                "mkdir a", "cd a", "export / /tmp/x", "stats --json",
+                "mkdir /a", "cat nope", "mv nope y", "mkfile x hi", "cat x",
+            ]))
+        self.assertEqual(replies[:2], ["OK /", "OK /a"])
+        self.assertEqual(replies[2], "ERR Command not found: export")
+        self.assertEqual(replies[3], "ERR Command not found: stats")
+        # O comando rodou mas imprimiu um erro
+        for reply, cmd in zip(replies[4:7], ("mkdir", "cat", "mv")):
+            self.assertTrue(reply.startswith(f"ERR {cmd}: "), reply)
+        self.assertEqual(replies[7:], ["OK /a", "OK /a"])
+        server.pool.shutdown()
+        fs.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
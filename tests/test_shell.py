@@ -0,0 +1,41 @@
+import unittest
+
+from chainfilesystem import ChainFileSystem
+from inodefilesystem import INodeFileSystem
+from shell import Shell
+
+FILESYSTEMS = (INodeFileSystem, ChainFileSystem)
+
+
+class ShellRunTest(unittest.TestCase):
+    def test_batches_absolute_paths_from_subdirectory(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(512, 512)
+                shell = Shell(fs)
+                results = shell.run([
+                    ("mkdir", "a"), ("cd", "a"),
+                    ("mkfile", "/x", "hi"), ("mkfile", "/y", "yo"),
+                    ("mkdir", "/d"), ("mkdir", "/e"),
+                    ("mkfile", "here", "local"),
+                ])
+                self.assertTrue(all(ok for ok, _ in results), results)
+                self.assertEqual(sorted(fs.root.get_entries()), ["a", "d", "e", "x", "y"])
+                self.assertEqual(sorted(fs.current_dir.get_entries()), ["here"])
+                self.assertEqual(fs.open("/x").read(), b"hi")
+
+                results = shell.run([("rm", "/x"), ("rm", "/y")])
+                self.assertTrue(all(ok for ok, _ in results), results)
+                self.assertEqual(sorted(fs.root.get_entries()), ["a", "d", "e"])
+                fs.close()
+
+    def test_batch_reports_each_error(self):
+        fs = ChainFileSystem(512, 512)
+        results = Shell(fs).run([("mkfile", "x", "1"), ("mkfile", "x", "2"), ("rm", "nope")])
+        self.assertEqual([ok for ok, _ in results], [True, False, False])
+        self.assertIn("already exists", results[1][1])
+        fs.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
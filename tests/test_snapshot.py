@@ -0,0 +1,74 @@
+import contextlib
+import errno
+import io
+import unittest
+
+from chainfilesystem import ChainFileSystem
+from inodefilesystem import INodeFileSystem
+
+FILESYSTEMS = (INodeFileSystem, ChainFileSystem)
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.out = io.StringIO()
+        redirect = contextlib.redirect_stdout(self.out)
+        redirect.__enter__()
+        self.addCleanup(redirect.__exit__, None, None, None)
+
+    def test_browse_and_rollback(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(2048, 512)
+                fs.make_directory(["a"])
+                fs.make_file(["a/x", "hello"])
+                fs.make_file(["y", "z" * 3000])
+                fs.snapshot("s0")
+
+                fs.remove_file(["a/x"])
+                fs.append_file(["y", "more"])
+                fs.make_file(["new", "n" * 1000])
+                self.assertIsNone(fs.get_dir("a").lookup("x"))
+                self.assertEqual(fs._cat(["/.snapshots/s0/a/x"]), b"hello")
+                self.assertEqual(fs._cat(["/.snapshots/s0/y"]), b"z" * 3000)
+                self.assertIsNone(fs.get_dir("/.snapshots/s0").lookup("new"))
+                with self.assertRaises(OSError) as ctx:
+                    fs.open("/.snapshots/s0/y").pwrite(0, b"!")
+                self.assertEqual(ctx.exception.errno, errno.EROFS)
+
+                fs.rollback("s0")
+                self.assertEqual(fs._cat(["a/x"]), b"hello")
+                self.assertEqual(fs._cat(["y"]), b"z" * 3000)
+                self.assertIsNone(fs.root.lookup("new"))
+                fs.close()
+
+    def test_cat_missing_directory(self):
+        # Um caminho que não existe não pode cair no arquivo de mesmo nome
+        # do diretório atual
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(256, 512)
+                fs.make_file(["x", "cwd"])
+                fs.snapshot("s0")
+                self.assertIsNone(fs._cat(["/.snapshots/nope/x"]))
+                self.assertIsNone(fs._cat(["missing/x"]))
+                fs.close()
+        self.assertIn("cat: cannot access 'missing': No such directory", self.out.getvalue())
+
+
+    # Com bloco de 64 bytes o superbloco ocupa dois blocos
+    def test_small_blocks(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(4096, 64)
+                fs.make_file(["x", "hello " * 20])
+                fs.snapshot("s0")
+                fs.remove_file(["x"])
+                self.assertEqual(fs._cat(["/.snapshots/s0/x"]), b"hello " * 20)
+                fs.rollback("s0")
+                self.assertEqual(fs._cat(["x"]), b"hello " * 20)
+                fs.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
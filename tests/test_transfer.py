@@ -0,0 +1,108 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+
+import transfer
+from chainfilesystem import ChainFileSystem
+from inodefilesystem import INodeFileSystem
+
+FILESYSTEMS = (INodeFileSystem, ChainFileSystem)
+
+# Caminho relativo -> conteúdo; o arquivo grande passa de CHUNK_BLOCKS blocos
+TREE = {
+    "a.txt": b"hello",
+    "empty": b"",
+    "sub/b.bin": bytes(range(256)) * 200,
+    "sub/deep/c": b"c" * 513,
+}
+
+
+def host_files(root):
+    files = {}
+    for path, _, names in os.walk(root):
+        for name in names:
+            full = os.path.join(path, name)
+            with open(full, "rb") as f:
+                files[os.path.relpath(full, root)] = f.read()
+    return files
+
+
+class TransferTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.src = os.path.join(self.tmp, "src")
+        for path, data in TREE.items():
+            full = os.path.join(self.src, path)
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            with open(full, "wb") as f:
+                f.write(data)
+
+    def test_tree_round_trip(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(4096, 512)
+                fs.make_directory(["in"])
+                free = len(fs.allocator)
+                stats = transfer.import_tree(fs, self.src, "/in")
+                self.assertEqual(stats["files"], len(TREE))
+                self.assertEqual(stats["directories"], 3)
+                self.assertEqual(stats["bytes"], sum(map(len, TREE.values())))
+                self.assertEqual(stats["skipped"], [])
+                self.assertEqual(fs._cat(["/in/src/sub/b.bin"]), TREE["sub/b.bin"])
+                # A reserva que sobra volta pro alocador
+                used = free - len(fs.allocator)
+                self.assertLess(used, sum(map(len, TREE.values())) // 512 + 16)
+                out = os.path.join(self.tmp, f"out-{cls.__name__}")
+                transfer.export_tree(fs, "/in/src", out)
+                self.assertEqual(host_files(os.path.join(out, "src")), TREE)
+                with self.assertRaises(FileExistsError):
+                    transfer.import_tree(fs, self.src, "/in")
+                fs.close()
+
+    def test_tar_round_trip(self):
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(4096, 512)
+                archive = os.path.join(self.tmp, "src.tar.gz")
+                with tarfile.open(archive, "w:gz") as tar:
+                    tar.add(self.src, "src")
+                transfer.import_tar(fs, archive)
+                # Exporta como stream e importa de novo, também como stream
+                buf = io.BytesIO()
+                stats = transfer.export_tar(fs, "src", buf)
+                self.assertEqual(stats["files"], len(TREE))
+                fs.make_directory(["again"])
+                buf.seek(0)
+                transfer.import_tar(fs, buf, "again")
+                for path, data in TREE.items():
+                    self.assertEqual(fs._cat([f"/src/{path}"]), data)
+                    self.assertEqual(fs._cat([f"/again/src/{path}"]), data)
+                fs.close()
+
+    def test_tar_skips_unsafe_members(self):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w") as tar:
+            for name, data in (("../evil", b"x"), ("ok", b"y"), ("n" * 60, b"z")):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+            link = tarfile.TarInfo("link")
+            link.type = tarfile.SYMTYPE
+            link.linkname = "ok"
+            tar.addfile(link)
+        for cls in FILESYSTEMS:
+            with self.subTest(cls.__name__):
+                fs = cls(1024, 512)
+                buf.seek(0)
+                stats = transfer.import_tar(fs, buf)
+                self.assertEqual(sorted(stats["skipped"]), sorted(["../evil", "n" * 60, "link"]))
+                self.assertEqual(sorted(fs.root.get_entries()), ["ok"])
+                fs.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,485 @@
+import os
+import posixpath
+import tarfile
+import time
+from collections import Counter, deque
+
+from directory import Directory
+
+# Cópia em lote entre o host (pasta ou tar) e o filesystem simulado, igual
+# pros dois backends. Cada filesystem só dá os ganchos:
+#   _file_blocks(size)              blocos que um arquivo de size bytes usa
+#   _new_file_at(runs, size)        arquivo em cima de faixas já alocadas
+#   _new_directory(parent, name)    diretório novo, ainda fora do pai
+#   _child_dir(parent, name, value) o diretório da entrada, ou None se é arquivo
+#   _open_entry(parent, name, value) OpenFile do arquivo da entrada
+#   _clone_file(parent, name, value) cópia do arquivo com os blocos compartilhados
+#
+# Na importação os blocos de dado saem de uma reserva feita de uma vez, cada
+# diretório novo recebe todas as entradas num add_entries só e o conteúdo é
+# copiado de CHUNK_BLOCKS em CHUNK_BLOCKS blocos, sem ler o arquivo inteiro.
+# O que foi importado só aparece no diretório de destino no fim.
+
+# Blocos copiados de cada vez; a memória da cópia não depende do arquivo
+CHUNK_BLOCKS = 64
+
+TAR_SUFFIXES = {
+    ".tar": "", ".tar.gz": "gz", ".tgz": "gz", ".tar.bz2": "bz2",
+    ".tbz2": "bz2", ".tar.xz": "xz", ".txz": "xz",
+}
+
+
+def is_tar(path):
+    return _tar_suffix(path) is not None
+
+
+def _tar_suffix(path):
+    for suffix, compression in TAR_SUFFIXES.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+# Blocos reservados pra importação inteira, entregues aos arquivos em faixas
+# contíguas. O que sobra volta pro alocador no release.
+class BlockPool:
+    def __init__(self, fs):
+        self.fs = fs
+        self.runs = deque()
+        self.free = 0
+
+    def reserve(self, count):
+        if count:
+            self.runs.extend(self.fs.alloc_blocks(count))
+            self.free += count
+
+    def take(self, count):
+        if count > self.free:
+            self.reserve(count - self.free)
+        runs = []
+        self.free -= count
+        while count:
+            start, length = self.runs[0]
+            n = min(count, length)
+            runs.append((start, n))
+            if n == length:
+                self.runs.popleft()
+            else:
+                self.runs[0] = (start + n, length - n)
+            count -= n
+        return runs
+
+    def release(self):
+        while self.runs:
+            self.fs.free_extent(*self.runs.popleft())
+        self.free = 0
+
+
+class Importer:
+    def __init__(self, fs):
+        self.fs = fs
+        self.pool = BlockPool(fs)
+        self.buffer = memoryview(bytearray(CHUNK_BLOCKS * fs.BLOCK_SIZE))
+        self.stats = {"files": 0, "directories": 0, "bytes": 0, "skipped": []}
+
+    def skip(self, path):
+        self.stats["skipped"].append(path)
+
+    # Cria o arquivo com até size bytes de stream. Se o stream acabar antes,
+    # o arquivo fica com o que veio.
+    def file(self, stream, size):
+        fs = self.fs
+        bs = fs.BLOCK_SIZE
+        runs = self.pool.take(fs._file_blocks(size))
+        done = 0
+        for start, length in runs:
+            for k in range(0, length, CHUNK_BLOCKS):
+                want = min(size - done, min(CHUNK_BLOCKS, length - k) * bs)
+                if want <= 0:
+                    break
+                got = stream.readinto(self.buffer[:want])
+                fs.blocks.write(start + k, self.buffer[:got])
+                done += got
+                if got < want:
+                    size = done
+        try:
+            value = fs._new_file_at(runs, done)
+        except RuntimeError:
+            # Sem inode pro arquivo: os blocos voltam pro alocador
+            for start, length in runs:
+                fs.free_extent(start, length)
+            raise
+        self.stats["files"] += 1
+        self.stats["bytes"] += done
+        return value
+
+    def directory(self, parent, name):
+        self.stats["directories"] += 1
+        return self.fs._new_directory(parent, name)
+
+
+def _target_dir(fs, fs_path):
+    target = fs.get_dir(fs_path)
+    if not target:
+        raise FileNotFoundError(f"No such directory: '{fs_path}'")
+    return target
+
+
+def _name_ok(name):
+    return len(name.encode("utf-8")) <= Directory.NAME_MAX
+
+
+# Confere antes de começar se cabe tudo: os blocos de dado (que vão ser
+# reservados) mais as tabelas dos diretórios novos, que crescem depois
+def _check_space(fs, data_blocks, dir_sizes):
+    bs = fs.BLOCK_SIZE
+    needed = data_blocks + sum(Directory.blocks_for(n, bs) for n in dir_sizes)
+    if needed > len(fs.allocator):
+        raise RuntimeError("No free blocks available")
+
+
+# Percorre a pasta do host uma vez antes de copiar: diz o que tem em cada
+# pasta e quantos blocos os arquivos vão usar no total
+def _plan_host(fs, root, importer):
+    plan = {}
+    total = 0
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        children = plan[path] = []
+        with os.scandir(path) as it:
+            for entry in sorted(it, key=lambda e: e.name):
+                if not _name_ok(entry.name):
+                    importer.skip(entry.path)
+                elif entry.is_dir(follow_symlinks=False):
+                    children.append((entry.name, True, 0))
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    size = entry.stat(follow_symlinks=False).st_size
+                    children.append((entry.name, False, size))
+                    total += fs._file_blocks(size)
+                else:
+                    importer.skip(entry.path)
+    return plan, total
+
+
+def import_tree(fs, host_path, fs_path=""):
+    """Copy the host file or directory *host_path* into the directory *fs_path*.
+
+    Returns counters of what was copied and the host paths that were skipped
+    (names too long, links and special files).
+    """
+    target = _target_dir(fs, fs_path)
+    host_path = os.path.normpath(host_path)
+    name = os.path.basename(host_path)
+    if not _name_ok(name):
+        raise ValueError(f"File name too long: '{name}'")
+    if target.lookup(name) is not None:
+        raise FileExistsError(f"File exists: '{name}'")
+    importer = Importer(fs)
+
+    if not os.path.isdir(host_path):
+        with open(host_path, "rb") as f:
+            value = importer.file(f, os.fstat(f.fileno()).st_size)
+        importer.pool.release()
+        _link(fs, target, [(name, value)])
+        return importer.stats
+
+    plan, total = _plan_host(fs, host_path, importer)
+    _check_space(fs, total, [len(children) for children in plan.values()])
+    importer.pool.reserve(total)
+    value, top = importer.directory(target, name)
+    try:
+        stack = [(host_path, top)]
+        while stack:
+            path, dir = stack.pop()
+            entries = []
+            try:
+                for child, is_dir, size in plan[path]:
+                    child_path = os.path.join(path, child)
+                    if is_dir:
+                        child_value, sub = importer.directory(dir, child)
+                        stack.append((child_path, sub))
+                    else:
+                        with open(child_path, "rb") as f:
+                            child_value = importer.file(f, size)
+                    entries.append((child, child_value))
+            finally:
+                # Mesmo se der erro no meio o que já foi criado fica ligado
+                dir.add_entries(entries)
+    finally:
+        importer.pool.release()
+        _link(fs, target, [(name, value)])
+    return importer.stats
+
+
+def _link(fs, target, entries):
+    for (name, _), added in zip(entries, target.add_entries(entries)):
+        if not added:
+            raise FileExistsError(f"File exists: '{name}'")
+
+
+def import_tar(fs, source, fs_path=""):
+    """Extract the tar archive *source* (a path or a file object) into *fs_path*.
+
+    For a path the headers are read first, so the blocks of every file are
+    reserved at once; a file object is read as a stream, in a single pass.
+    """
+    target = _target_dir(fs, fs_path)
+    importer = Importer(fs)
+    if isinstance(source, (str, os.PathLike)):
+        tar = tarfile.open(source, "r:*")
+        members = tar.getmembers()
+        total = sum(fs._file_blocks(m.size) for m in members if m.isfile())
+        sizes = Counter(posixpath.dirname(posixpath.normpath(m.name)) for m in members)
+        _check_space(fs, total, sizes.values())
+        importer.pool.reserve(total)
+    else:
+        tar = tarfile.open(fileobj=source, mode="r|*")
+
+    # Caminho no tar -> (diretório, entradas novas). Os que já existiam no
+    # filesystem também entram aqui, pra receber as entradas no fim.
+    dirs = {"": (target, {})}
+
+    def get(path):
+        if path in dirs:
+            return dirs[path][0]
+        head, _, name = path.rpartition("/")
+        parent = get(head)
+        if parent is None:
+            return None
+        pending = dirs[head][1]
+        value = pending.get(name)
+        if value is None:
+            value = parent.lookup(name)
+        if value is not None:
+            dir = fs._child_dir(parent, name, value)
+        elif _name_ok(name):
+            value, dir = importer.directory(parent, name)
+            pending[name] = value
+        else:
+            dir = None
+        if dir is not None:
+            dirs[path] = (dir, {})
+        return dir
+
+    try:
+        with tar:
+            for member in tar:
+                path = posixpath.normpath(member.name).lstrip("/")
+                if path in (".", "") or path.split("/")[0] == "..":
+                    importer.skip(member.name)
+                    continue
+                if member.isdir():
+                    if get(path) is None:
+                        importer.skip(member.name)
+                    continue
+                head, _, name = path.rpartition("/")
+                parent = get(head)
+                if not member.isfile() or parent is None or not _name_ok(name):
+                    importer.skip(member.name)
+                    continue
+                pending = dirs[head][1]
+                if name in pending or parent.lookup(name) is not None:
+                    importer.skip(member.name)
+                    continue
+                pending[name] = importer.file(tar.extractfile(member), member.size)
+    finally:
+        importer.pool.release()
+        # Filhos antes dos pais, o destino por último
+        for dir, pending in reversed(dirs.values()):
+            if pending:
+                dir.add_entries(list(pending.items()))
+    return importer.stats
+
+
+# Entrada de path como (pai, nome, valor, diretório ou None)
+def _entry(fs, path):
+    dir = fs.get_dir(path)
+    if dir:
+        if dir.parent is None:
+            raise ValueError("cannot copy the root directory")
+        return dir.parent, dir.name, dir.parent.lookup(dir.name), dir
+    head, _, name = path.rpartition("/")
+    parent = fs.get_dir(head or ("/" if path.startswith("/") else ""))
+    value = parent.lookup(name) if parent and name else None
+    if value is None:
+        raise FileNotFoundError(f"cannot stat '{path}': No such file or directory")
+    return parent, name, value, None
+
+
+def copy_tree(fs, src_path, dst_path, recursive=False):
+    """Copy *src_path* to *dst_path* inside the filesystem, like ``cp``.
+
+    No data is copied: the new files share the blocks of the old ones until
+    either side writes to them. If *dst_path* is a directory the copy goes
+    inside it. Directories are only copied with *recursive*.
+    """
+    parent, name, value, dir = _entry(fs, src_path)
+    if dir is not None and not recursive:
+        raise IsADirectoryError(f"-r not specified; omitting directory '{src_path}'")
+    target = fs.get_dir(dst_path)
+    if target:
+        new_name = name
+    else:
+        head, _, new_name = dst_path.rstrip("/").rpartition("/")
+        target = fs.get_dir(head or ("/" if dst_path.startswith("/") else ""))
+        if not target:
+            raise FileNotFoundError(f"cannot create '{dst_path}': No such directory")
+    if not _name_ok(new_name):
+        raise ValueError(f"File name too long: '{new_name}'")
+    if target.lookup(new_name) is not None:
+        raise FileExistsError(f"File exists: '{new_name}'")
+    stats = {"files": 0, "directories": 0}
+
+    if dir is None:
+        copied = fs._clone_file(parent, name, value)
+        _link(fs, target, [(new_name, copied)])
+        stats["files"] += 1
+        return stats
+
+    # Percorre a árvore antes, pra conferir o espaço: cada arquivo copiado
+    # usa o mesmo que um arquivo vazio (no encadeado, a cabeça da cadeia)
+    plan = []
+    files = 0
+    stack = [dir]
+    while stack:
+        src = stack.pop()
+        children = []
+        for child, child_value in sorted(src.get_entries().items()):
+            sub = fs._child_dir(src, child, child_value)
+            if sub is not None:
+                stack.append(sub)
+            else:
+                files += 1
+            children.append((child, child_value, sub))
+        plan.append((src, children))
+    _check_space(fs, files * fs._file_blocks(0), [len(children) for _, children in plan])
+
+    # O plano está de cima pra baixo, então cada diretório novo já existe
+    # quando chega a vez dele
+    new, top = fs._new_directory(target, new_name)
+    stats["directories"] += 1
+    copies = {dir.ident(): top}
+    try:
+        for src, children in plan:
+            dst = copies[src.ident()]
+            entries = []
+            try:
+                for child, child_value, sub in children:
+                    if sub is None:
+                        copied = fs._clone_file(src, child, child_value)
+                        stats["files"] += 1
+                    else:
+                        copied, copies[sub.ident()] = fs._new_directory(dst, child)
+                        stats["directories"] += 1
+                    entries.append((child, copied))
+            finally:
+                dst.add_entries(entries)
+    finally:
+        _link(fs, target, [(new_name, new)])
+    return stats
+
+
+# O que exportar: (nome, diretório, None) ou (nome, None, arquivo aberto).
+# A raiz não tem nome, aí vai só o conteúdo. O caminho pode ser de um
+# snapshot (/.snapshots/...), que é outro filesystem: por isso dir.fs.
+def _source(fs, fs_path):
+    dir = fs.get_dir(fs_path)
+    if dir:
+        return (dir.name if dir.parent is not None else ""), dir, None
+    dir_path, _, name = fs_path.rpartition("/")
+    parent = fs.get_dir(dir_path or ("/" if fs_path.startswith("/") else ""))
+    value = parent.lookup(name) if parent else None
+    if value is None:
+        raise FileNotFoundError(f"No such file or directory: '{fs_path}'")
+    return name, None, parent.fs._open_entry(parent, name, value)
+
+
+# Diretórios abaixo de dir, de cima pra baixo, como (caminho relativo,
+# diretório, arquivos como [(nome, arquivo aberto)])
+def _walk(fs, dir, path):
+    stack = [(path, dir)]
+    while stack:
+        path, dir = stack.pop()
+        files = []
+        entries = dir.get_entries()
+        for name in sorted(entries):
+            sub = dir.fs._child_dir(dir, name, entries[name])
+            if sub is not None:
+                stack.append((posixpath.join(path, name), sub))
+            else:
+                files.append((name, dir.fs._open_entry(dir, name, entries[name])))
+        yield path, dir, files
+
+
+def _copy_out(f, out):
+    size = 0
+    for view in f.stream():
+        out.write(view)
+        size += len(view)
+    return size
+
+
+def export_tree(fs, fs_path, host_path):
+    """Copy the file or directory *fs_path* into the host directory *host_path*."""
+    name, dir, f = _source(fs, fs_path)
+    stats = {"files": 0, "directories": 0, "bytes": 0, "skipped": []}
+    os.makedirs(host_path, exist_ok=True)
+    if f is not None:
+        with open(os.path.join(host_path, name), "wb") as out:
+            stats["bytes"] += _copy_out(f, out)
+        stats["files"] += 1
+        return stats
+    for path, _, files in _walk(fs, dir, name):
+        dest = os.path.join(host_path, path)
+        if path:
+            os.makedirs(dest, exist_ok=True)
+            stats["directories"] += 1
+        for file_name, f in files:
+            with open(os.path.join(dest, file_name), "wb") as out:
+                stats["bytes"] += _copy_out(f, out)
+            stats["files"] += 1
+    return stats
+
+
+def _tar_info(path, size=None):
+    info = tarfile.TarInfo(path)
+    info.mtime = int(time.time())
+    if size is None:
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+    else:
+        info.size = size
+        info.mode = 0o644
+    return info
+
+
+def export_tar(fs, fs_path, target):
+    """Write the file or directory *fs_path* as a tar archive to *target*.
+
+    *target* is a path (compressed according to its suffix) or a file object,
+    which is written as a stream.
+    """
+    name, dir, f = _source(fs, fs_path)
+    stats = {"files": 0, "directories": 0, "bytes": 0, "skipped": []}
+    if isinstance(target, (str, os.PathLike)):
+        tar = tarfile.open(target, "w:" + (_tar_suffix(os.fspath(target)) or ""))
+    else:
+        tar = tarfile.open(fileobj=target, mode="w|")
+    with tar:
+        if f is not None:
+            tar.addfile(_tar_info(name, f.size()), f)
+            stats["files"] += 1
+            stats["bytes"] += f.size()
+            return stats
+        for path, _, files in _walk(fs, dir, name):
+            if path:
+                tar.addfile(_tar_info(path))
+                stats["directories"] += 1
+            for file_name, f in files:
+                size = f.size()
+                tar.addfile(_tar_info(posixpath.join(path, file_name), size), f)
+                stats["files"] += 1
+                stats["bytes"] += size
+    return stats